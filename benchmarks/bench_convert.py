@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+from bruker2nifti.converter import Bruker2Nifti
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def bench_convert(benchmark, synthetic_study, pfo_output, workers):
+    runs = []
+
+    def setup():
+        # convert creates the study folder: each round writes in a new output folder.
+        pfo_run = os.path.join(pfo_output, str(len(runs)))
+        os.makedirs(pfo_run)
+        runs.append(pfo_run)
+        bru = Bruker2Nifti(synthetic_study["study"], pfo_run)
+        bru.verbose = 0
+        bru.workers = workers
+        return (bru,), {}
+
+    benchmark.pedantic(lambda bru: bru.convert(), setup=setup, rounds=3)
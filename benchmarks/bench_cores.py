@@ -0,0 +1,16 @@
+import pytest
+
+from bruker2nifti._cores import scan2struct, write_struct
+
+
+@pytest.mark.parametrize("scan", ["2d", "3d", "msme", "dti", "multi_recon"])
+def bench_scan2struct(benchmark, synthetic_study, scan):
+    benchmark(scan2struct, synthetic_study["scans"][scan], correct_slope=True)
+
+
+@pytest.mark.parametrize("scan", ["2d", "3d", "msme", "dti", "multi_recon"])
+def bench_write_struct(benchmark, synthetic_study, pfo_output, scan):
+    struct_scan = scan2struct(
+        synthetic_study["scans"][scan], correct_slope=True, get_method=True
+    )
+    benchmark(write_struct, struct_scan, pfo_output, fin_scan=scan, verbose=0)
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from bruker2nifti._utils import data_corrector, data_slope_offset_corrector
+
+
+@pytest.fixture(scope="module")
+def data_4d():
+    return np.random.RandomState(0).randint(-2000, 30000, size=(128, 128, 30, 20))
+
+
+def bench_data_corrector_scalar_slope(benchmark, data_4d):
+    benchmark(data_corrector, data_4d, 1.5, kind="slope")
+
+
+def bench_data_corrector_slice_wise_slope(benchmark, data_4d):
+    slope = np.linspace(0.5, 1.5, data_4d.shape[2])
+    benchmark(data_corrector, data_4d, slope, kind="slope")
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def bench_data_slope_offset_corrector(benchmark, data_4d, dtype):
+    slope = np.linspace(0.5, 1.5, data_4d.shape[2])
+    offset = np.linspace(-10, 10, data_4d.shape[2])
+    benchmark(
+        data_slope_offset_corrector, data_4d, slope=slope, offset=offset, dtype=dtype
+    )
@@ -0,0 +1,31 @@
+import os
+
+import numpy as np
+import pytest
+
+from bruker2nifti._getters import get_data_dtype_from_visu_pars, nifti_getter
+from bruker2nifti._utils import bruker_read_files
+
+
+@pytest.mark.parametrize("scan", ["2d", "3d", "msme", "dti"])
+@pytest.mark.parametrize("correct_slope", [False, True])
+def bench_nifti_getter(benchmark, synthetic_study, scan, correct_slope):
+    pfo_scan = synthetic_study["scans"][scan]
+    visu_pars = bruker_read_files("visu_pars", pfo_scan)
+    img_data_vol = np.memmap(
+        os.path.join(pfo_scan, "pdata", "1", "2dseq"),
+        dtype=get_data_dtype_from_visu_pars(visu_pars),
+        mode="r",
+    )
+
+    benchmark(
+        nifti_getter,
+        img_data_vol,
+        visu_pars,
+        correct_slope,
+        False,  # correct_offset
+        False,  # sample_upside_down
+        1,  # nifti_version
+        1,  # qform_code
+        2,  # sform_code
+    )
@@ -0,0 +1,40 @@
+import pytest
+
+from bruker2nifti._utils import bruker_read_files, param_files_cache
+
+
+@pytest.mark.parametrize(
+    "param_file, scan",
+    [
+        ("acqp", "2d"),
+        ("method", "dti"),
+        ("reco", "2d"),
+        ("visu_pars", "msme"),
+        ("visu_pars", "dti"),
+    ],
+)
+def bench_bruker_read_files(benchmark, synthetic_study, param_file, scan):
+    pfo_scan = synthetic_study["scans"][scan]
+
+    def parse():
+        param_files_cache.clear()
+        return bruker_read_files(param_file, pfo_scan)
+
+    benchmark(parse)
+
+
+def bench_bruker_read_files_cached(benchmark, synthetic_study):
+    pfo_scan = synthetic_study["scans"]["dti"]
+    param_files_cache.clear()
+    bruker_read_files("visu_pars", pfo_scan)
+    benchmark(bruker_read_files, "visu_pars", pfo_scan)
+
+
+def bench_bruker_read_files_selected_keys(benchmark, synthetic_study):
+    pfo_scan = synthetic_study["scans"]["dti"]
+
+    def parse():
+        param_files_cache.clear()
+        return bruker_read_files("visu_pars", pfo_scan, keys=["VisuSubjectId"])
+
+    benchmark(parse)
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from synthetic_study import write_synthetic_study
+
+# Scans of the synthetic study, for each size selected with the environment variable BRUKER2NIFTI_BENCH_SIZE.
+SCAN_NAMES = ["2d", "3d", "msme", "dti", "multi_recon"]
+STUDY_SIZES = {
+    "small": {
+        "2d": {"kind": "2d", "matrix": (128, 128), "slices": 30},
+        "3d": {"kind": "3d", "matrix": (96, 96, 96)},
+        "msme": {"kind": "msme", "matrix": (128, 128), "slices": 15, "echoes": 8},
+        "dti": {"kind": "dti", "matrix": (64, 64), "slices": 20, "directions": 150},
+        "multi_recon": {"kind": "2d", "matrix": (128, 128), "slices": 30, "recons": 3},
+    },
+    "large": {
+        "2d": {"kind": "2d", "matrix": (256, 256), "slices": 60},
+        "3d": {"kind": "3d", "matrix": (256, 256, 256)},
+        "msme": {"kind": "msme", "matrix": (256, 256), "slices": 40, "echoes": 16},
+        "dti": {"kind": "dti", "matrix": (128, 128), "slices": 60, "directions": 500},
+        "multi_recon": {"kind": "2d", "matrix": (256, 256), "slices": 60, "recons": 4},
+    },
+}
+
+
+@pytest.fixture(scope="session")
+def synthetic_study(tmp_path_factory):
+    """
+    Synthetic Bruker study written once per session.
+    :return: dictionary with the path to the study, 'study', and the paths to its scans, 'scans', by scan name.
+    """
+    size = os.environ.get("BRUKER2NIFTI_BENCH_SIZE", "small")
+    if size not in STUDY_SIZES:
+        raise IOError(
+            "BRUKER2NIFTI_BENCH_SIZE must be one of {}".format(sorted(STUDY_SIZES))
+        )
+    pfo_study = str(tmp_path_factory.mktemp("synthetic").joinpath("study"))
+    write_synthetic_study(pfo_study, [STUDY_SIZES[size][name] for name in SCAN_NAMES])
+    return {
+        "study": pfo_study,
+        "scans": {
+            name: os.path.join(pfo_study, str(num))
+            for num, name in enumerate(SCAN_NAMES, 1)
+        },
+    }
+
+
+@pytest.fixture
+def pfo_output(tmp_path):
+    return str(tmp_path)
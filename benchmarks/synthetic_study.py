@@ -0,0 +1,292 @@
+"""
+Generator of synthetic Bruker studies, for the benchmarks.
+
+The parameter files (subject, acqp, method, reco, visu_pars) are written in the JCAMP-DX format used by ParaVision,
+with the variables read by bruker2nifti, and the 2dseq files are filled with random 16 bits integers.
+Sizes are configurable, so that studies from a few MB to many GB can be produced:
+
+write_synthetic_study(pfo_study, [
+    {"kind": "2d", "matrix": (128, 128), "slices": 30},
+    {"kind": "3d", "matrix": (128, 128, 128)},
+    {"kind": "msme", "matrix": (128, 128), "slices": 20, "echoes": 8},
+    {"kind": "dti", "matrix": (96, 96), "slices": 30, "directions": 200},
+    {"kind": "2d", "matrix": (128, 128), "slices": 30, "recons": 3},
+])
+"""
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+SCAN_KINDS = ["2d", "3d", "msme", "dti"]
+
+
+class Raw(str):
+    """
+    Value written as it is after the '=', e.g. the ParaVision enumerations.
+    """
+
+
+def format_param_value(value):
+    """
+    :param value: value of a parameter: number, Raw, string, list of strings, list of Raw (written as a list of
+    tuples, e.g. VisuFGOrderDesc) or numpy array.
+    :return: text following the '=' in the parameter file.
+    """
+    if isinstance(value, Raw):
+        return str(value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return "{:.15g}".format(value)
+    if isinstance(value, str):
+        return "( 65 )\n<{}>".format(value)
+    if isinstance(value, list) and all(isinstance(v, Raw) for v in value):
+        return "( {} )\n{}".format(len(value), " ".join(value))
+    if isinstance(value, list):
+        return "( {}, 65 )\n{}".format(
+            len(value), " ".join("<{}>".format(v) for v in value)
+        )
+
+    value = np.asarray(value)
+    shape = ", ".join(str(d) for d in value.shape)
+    numbers = ["{:.15g}".format(v) for v in value.ravel(order="C")]
+    # ParaVision wraps the values in rows of at most 80 characters.
+    rows = []
+    row = ""
+    for number in numbers:
+        if len(row) + len(number) + 1 > 80:
+            rows.append(row)
+            row = ""
+        row += number + " "
+    rows.append(row)
+    return "( {} )\n{}".format(shape, "\n".join(r.rstrip() for r in rows))
+
+
+def write_param_file(pfi_param_file, params):
+    """
+    :param pfi_param_file: path to the output parameter file.
+    :param params: ordered dictionary {variable name: value}, see format_param_value.
+    :return: [None] write the parameter file.
+    """
+    with open(pfi_param_file, "w") as f:
+        f.write("##TITLE=Parameter List\n")
+        f.write("##JCAMPDX=4.24\n")
+        f.write("##DATATYPE=Parameter Values\n")
+        f.write("##ORIGIN=Bruker BioSpin MRI GmbH\n")
+        f.write("##OWNER=bruker2nifti\n")
+        f.write("$$ synthetic study generated for the benchmarks\n")
+        for name, value in params.items():
+            f.write("##${}={}\n".format(name, format_param_value(value)))
+        f.write("##END=\n")
+
+
+def _frame_groups(kind, slices, echoes, directions):
+    """
+    :return: list of the frame groups (size, name), in the order they are stored in the 2dseq.
+    """
+    if kind == "2d":
+        return [(slices, "FG_SLICE")]
+    if kind == "3d":
+        return []
+    if kind == "msme":
+        return [(echoes, "FG_ECHO"), (slices, "FG_SLICE")]
+    if kind == "dti":
+        return [(slices, "FG_SLICE"), (directions, "FG_MOVIE")]
+    raise IOError("Synthetic scan kind must be one of {}".format(SCAN_KINDS))
+
+
+def synthetic_visu_pars(kind, matrix, slices, echoes, directions, recon):
+    """
+    :return: ordered dictionary with the variables of a visu_pars file.
+    """
+    frame_groups = _frame_groups(kind, slices, echoes, directions)
+    num_frames = int(np.prod([size for size, _ in frame_groups]))
+    spatial_dim = len(matrix)
+    thickness = 1.0
+
+    # slice positions along z, repeated for each of the other frame groups.
+    slice_position = np.zeros([num_frames, 3])
+    slice_position[:, 0] = -0.5 * matrix[0] * 0.2
+    slice_position[:, 1] = -0.5 * matrix[1] * 0.2
+    if kind in ["2d", "msme", "dti"]:
+        slice_index = np.arange(num_frames)
+        if kind == "msme":
+            slice_index = slice_index // echoes
+        else:
+            slice_index = slice_index % slices
+        slice_position[:, 2] = (slice_index - 0.5 * slices) * thickness
+
+    params = OrderedDict()
+    params["VisuVersion"] = 1
+    params["VisuUid"] = "2.16.756.5.5.100.1.{}.{}".format(kind, recon)
+    params["VisuCreator"] = "ParaVision"
+    params["VisuCreatorVersion"] = "6.0.1"
+    params["VisuCoreFrameCount"] = num_frames
+    params["VisuCoreDim"] = spatial_dim
+    params["VisuCoreSize"] = np.array(matrix)
+    params["VisuCoreDimDesc"] = [Raw("spatial")] * spatial_dim
+    params["VisuCoreExtent"] = np.array(matrix) * 0.2
+    params["VisuCoreFrameThickness"] = np.array([thickness])
+    params["VisuCoreUnits"] = ["mm"] * spatial_dim
+    params["VisuCoreOrientation"] = np.tile(np.eye(3).ravel(), (num_frames, 1))
+    params["VisuCorePosition"] = slice_position
+    params["VisuCoreDataMin"] = np.full(num_frames, -32768.0)
+    params["VisuCoreDataMax"] = np.full(num_frames, 32767.0)
+    params["VisuCoreDataOffs"] = np.zeros(num_frames)
+    params["VisuCoreDataSlope"] = np.linspace(0.5, 1.5, num_frames)
+    params["VisuCoreFrameType"] = Raw("MAGNITUDE_IMAGE")
+    params["VisuCoreWordType"] = Raw("_16BIT_SGN_INT")
+    params["VisuCoreByteOrder"] = Raw("littleEndian")
+    params["VisuFGOrderDescDim"] = len(frame_groups)
+    if frame_groups:
+        params["VisuFGOrderDesc"] = [
+            Raw("({}, <{}>, <>, 0, 2)".format(size, name))
+            for size, name in frame_groups
+        ]
+    params["VisuSubjectName"] = "Synthetic"
+    params["VisuSubjectId"] = "Synthetic_subject"
+    params["VisuSubjectPosition"] = Raw("Head_Supine")
+    params["VisuAcqSequenceName"] = {
+        "2d": "FLASH (pvm)",
+        "3d": "FLASH (pvm)",
+        "msme": "MSME (pvm)",
+        "dti": "DtiEpi (pvm)",
+    }[kind]
+    if kind == "3d":
+        params["VisuCoreDiskSliceOrder"] = Raw("disk_normal_slice_order")
+    else:
+        params["VisuCoreSlicePacksSlices"] = [Raw("(0, {})".format(slices))]
+    return params
+
+
+def synthetic_method(kind, matrix, directions):
+    """
+    :return: ordered dictionary with the variables of a method file.
+    """
+    method_name = {"2d": "FLASH", "3d": "FLASH", "msme": "MSME", "dti": "DtiEpi"}[kind]
+    params = OrderedDict()
+    params["Method"] = Raw("<Bruker:{}>".format(method_name))
+    params["PVM_ScanTime"] = 60000
+    params["PVM_SpatDimEnum"] = Raw("<{}D>".format(len(matrix)))
+    params["PVM_Matrix"] = np.array(matrix)
+    params["PVM_SpatResol"] = np.full(len(matrix), 0.2)
+    params["PVM_SPackArrSliceOrient"] = [Raw("axial")]
+    params["PVM_SPackArrReadOrient"] = [Raw("L_R")]
+    if kind == "dti":
+        rng = np.random.RandomState(directions)
+        grad_vec = rng.normal(size=(directions, 3))
+        grad_vec /= np.linalg.norm(grad_vec, axis=1)[:, np.newaxis]
+        grad_vec[0] = 0
+        params["PVM_DwNDiffExp"] = directions
+        params["PVM_DwGradVec"] = grad_vec
+        params["PVM_DwDir"] = grad_vec[1:]
+        params["PVM_DwEffBval"] = np.where(np.arange(directions) == 0, 5.0, 1000.0)
+    return params
+
+
+def synthetic_acqp(kind, slices, echoes, directions):
+    """
+    :return: ordered dictionary with the variables of an acqp file.
+    """
+    params = OrderedDict()
+    params["ACQ_sw_version"] = "PV 6.0.1"
+    params["ACQ_protocol_name"] = "Synthetic_{}".format(kind)
+    params["ACQ_method"] = "Bruker:{}".format(kind)
+    params["NR"] = directions if kind == "dti" else 1
+    params["NI"] = slices
+    params["ACQ_n_echo_images"] = echoes if kind == "msme" else 1
+    params["ACQ_slice_thick"] = 1
+    return params
+
+
+def synthetic_reco(matrix):
+    """
+    :return: ordered dictionary with the variables of a reco file.
+    """
+    params = OrderedDict()
+    params["RECO_size"] = np.array(matrix)
+    params["RECO_inp_order"] = Raw("NO_REORDERING")
+    return params
+
+
+def write_synthetic_scan(
+    pfo_scan,
+    kind="2d",
+    matrix=(64, 64),
+    slices=10,
+    echoes=4,
+    directions=30,
+    recons=1,
+    seed=0,
+):
+    """
+    :param pfo_scan: path to the folder of the scan, created if needed.
+    :param kind: [2d] one of '2d' (2D multi-slice), '3d', 'msme' (2D multi-slice multi-echo) or 'dti' (2D multi-slice
+    DtiEpi with directions diffusion directions).
+    :param matrix: [(64, 64)] in-plane matrix for 2d, msme and dti, volume matrix for 3d.
+    :param slices: [10] number of slices, unused for 3d.
+    :param echoes: [4] number of echoes of the msme scans.
+    :param directions: [30] number of diffusion directions of the dti scans.
+    :param recons: [1] number of reconstructions, in pdata/1, pdata/2, ...
+    :param seed: [0] seed of the random data.
+    :return: size in bytes of the 2dseq files written.
+    """
+    if kind == "3d":
+        matrix = tuple(matrix) + (1,) * (3 - len(matrix))
+    else:
+        matrix = tuple(matrix[:2])
+
+    rng = np.random.RandomState(seed)
+    write_param_file(
+        os.path.join(_makedirs(pfo_scan), "acqp"),
+        synthetic_acqp(kind, slices, echoes, directions),
+    )
+    write_param_file(
+        os.path.join(pfo_scan, "method"), synthetic_method(kind, matrix, directions)
+    )
+
+    bytes_written = 0
+    for recon in range(1, recons + 1):
+        pfo_recon = _makedirs(os.path.join(pfo_scan, "pdata", str(recon)))
+        visu_pars = synthetic_visu_pars(kind, matrix, slices, echoes, directions, recon)
+        write_param_file(os.path.join(pfo_recon, "visu_pars"), visu_pars)
+        write_param_file(os.path.join(pfo_recon, "reco"), synthetic_reco(matrix))
+
+        frame_size = int(np.prod(matrix))
+        with open(os.path.join(pfo_recon, "2dseq"), "wb") as f:
+            # frame by frame, to write large studies in bounded memory.
+            for _ in range(int(visu_pars["VisuCoreFrameCount"])):
+                frame = rng.randint(-2000, 30000, size=frame_size).astype("<i2")
+                f.write(frame.tobytes())
+                bytes_written += frame.nbytes
+
+    return bytes_written
+
+
+def write_synthetic_study(pfo_study, scans):
+    """
+    :param pfo_study: path to the folder of the study, created if needed.
+    :param scans: list of dictionaries with the keyword arguments of write_synthetic_scan, one for each scan. Scans
+    are written in the sub-folders 1, 2, ...
+    :return: size in bytes of the 2dseq files written.
+    """
+    subject = OrderedDict()
+    subject["SUBJECT_id"] = "Synthetic_subject"
+    subject["SUBJECT_name_string"] = "Synthetic"
+    subject["SUBJECT_date"] = "2019-01-01T10:00:00,000+0000"
+    write_param_file(os.path.join(_makedirs(pfo_study), "subject"), subject)
+
+    bytes_written = 0
+    for scan_num, scan in enumerate(scans, 1):
+        kwargs = dict(scan)
+        kwargs.setdefault("seed", scan_num)
+        bytes_written += write_synthetic_scan(
+            os.path.join(pfo_study, str(scan_num)), **kwargs
+        )
+    return bytes_written
+
+
+def _makedirs(pfo):
+    if not os.path.isdir(pfo):
+        os.makedirs(pfo)
+    return pfo
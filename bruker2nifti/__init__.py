@@ -1,11 +1,19 @@
 import os
 from subprocess import check_output
 
-
 __author__ = "Sebastiano Ferraris UCL"
 __licence__ = "MIT"
 __repository__ = "https://github.com/SebastianoF/bruker2nifti"
-__all__ = ["_cores", "_getters", "_metadata", "_utils", "converter"]
+__all__ = [
+    "_cores",
+    "_getters",
+    "_manifest",
+    "_metadata",
+    "_sidecar",
+    "_utils",
+    "converter",
+    "watcher",
+]
 
 # here = os.path.abspath(os.path.dirname(__file__))
 # git_dir = os.path.dirname(here)
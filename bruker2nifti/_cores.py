@@ -1,19 +1,29 @@
+import json
 import os
 import nibabel as nib
-import sys
 import numpy as np
 import warnings
 
 from os.path import join as jph
 
-from bruker2nifti._getters import get_list_scans, nifti_getter
+from bruker2nifti._getters import (
+    get_list_scans,
+    get_data_dtype_from_visu_pars,
+    nifti_getter,
+)
+from bruker2nifti._sidecar import sidecar_paths, write_sidecar
 from bruker2nifti._utils import (
     bruker_read_files,
     normalise_b_vect,
     from_dict_to_txt_sorted,
     set_new_data,
+    extract_volumes,
     apply_reorientation_to_b_vects,
     obtain_b_vectors_orient_matrix,
+    save_nifti,
+    StageTimer,
+    WriteDispatcher,
+    CorrectedArrayProxy,
 )
 
 
@@ -31,6 +41,12 @@ def scan2struct(
     frame_body_as_frame_head=False,
     keep_same_det=True,
     consider_subject_position=False,
+    corrected_dtype=np.float64,
+    lazy_correction=False,
+    integer_output=False,
+    geometry_only=False,
+    iterate_recons=False,
+    timer=None,
 ):
     """
     The core method of the converter has 2 parts.
@@ -59,17 +75,30 @@ def scan2struct(
     tuned to switch from radiological to neurological coordinate systems in a work-around.
     If the subject is Prone and the technician wants to have the coordinates
     in neurological he/she can consciously set the variable vc_subject_position to 'Head_Supine'.
+    :param corrected_dtype: [np.float64] datatype of the data after slope and offset correction, np.float32
+    halves the size of the corrected images.
+    :param lazy_correction: [False] if True the slope and offset correction is not applied in memory, but slice by
+    slice when the images are written (see write_struct with a chunk_size).
+    :param integer_output: [False] if True, a slope and an offset uniform across the frames are saved in the nifti
+    header (scl_slope, scl_inter) with the raw integer data, instead of being corrected (see _getters.nifti_getter).
+    :param geometry_only: [False] if True the 2dseq are not read: shape, datatype, affine and sub-volumes of the
+    images are derived from visu_pars only, and their data are zeros taking no memory (see _getters.nifti_getter).
+    :param iterate_recons: [False] if True, the images of the sub-scans are not created all at once: 'nib_scans_list'
+    is an iterator creating them one after the other while they are consumed (see iter_scan_recons), so that
+    write_struct holds in memory a single sub-scan at a time. A struct with iterated sub-scans can be written once.
+    :param timer: [None] optional StageTimer recording the 'parse_parameters' and 'read_2dseq' stages, and the stages
+    of nifti_getter.
     :return: output_data data structure containing the nibabel image(s) {nib_list, visu_pars_list, acqp, method, reco}
     """
 
     if not os.path.isdir(pfo_scan):
         raise IOError("Input folder does not exists.")
 
-    # Get system endian_nes
-    system_endian_nes = sys.byteorder
+    if timer is None:
+        timer = StageTimer()
 
     # Get sub-scans series in the same experiment.
-    list_sub_scans = get_list_scans(jph(pfo_scan, "pdata"))
+    list_sub_scans = get_list_scans(jph(pfo_scan, "pdata"), print_structure=False)
 
     if not list_sub_scans:
         warn_msg = (
@@ -79,112 +108,55 @@ def scan2struct(
         warnings.warn(warn_msg)
         return None
 
-    nib_scans_list = []
+    # visu_pars of all the sub-scans are parsed and checked before any image is created.
     visu_pars_list = []
-
     for id_sub_scan in list_sub_scans:
-
-        visu_pars = bruker_read_files("visu_pars", pfo_scan, sub_scan_num=id_sub_scan)
-
-        if visu_pars == {}:
-            warn_msg = (
-                "\nNo 'visu_pars' data found here: \n{}. \nAre you sure the input folder contains a "
-                "proper Bruker scan?\n".format(jph(pfo_scan, "pdata", id_sub_scan))
-            )
-            warnings.warn(warn_msg)
-            return None
-
-        # In some cases we cannot deal with, VisuPars['VisuCoreSize'] can be a float. No conversion in this case.
-        if not (
-            isinstance(visu_pars["VisuCoreSize"], np.ndarray)
-            or isinstance(visu_pars["VisuCoreSize"], list)
-        ):
-            warn_msg = (
-                "\nWarning, VisuCoreSize in VisuPars parameter file {} \n"
-                "is not a list or a vector in. The study cannot be converted."
-                " \n".format(jph(pfo_scan, "pdata", id_sub_scan))
-            )
-            warnings.warn(warn_msg)
+        visu_pars = _read_recon_visu_pars(pfo_scan, id_sub_scan, timer)
+        if visu_pars is None:
             return None
+        visu_pars_list.append(visu_pars)
 
-        # Get data endian_nes - default big!!
-        if visu_pars["VisuCoreByteOrder"] == "littleEndian":
-            data_endian_ness = "little"
-        elif visu_pars["VisuCoreByteOrder"] == "bigEndian":
-            data_endian_ness = "big"
-        else:
-            data_endian_ness = "big"
-
-        # Get datatype
-        if visu_pars["VisuCoreWordType"] == "_32BIT_SGN_INT":
-            dt = np.int32
-        elif visu_pars["VisuCoreWordType"] == "_16BIT_SGN_INT":
-            dt = np.int16
-        elif visu_pars["VisuCoreWordType"] == "_8BIT_UNSGN_INT":
-            dt = np.uint8
-        elif visu_pars["VisuCoreWordType"] == "_32BIT_FLOAT":
-            dt = np.float32
-        else:
-            raise IOError("Unknown data type for VisuPars VisuCoreWordType")
-
-        # GET IMAGE VOLUME
-        if os.path.exists(jph(pfo_scan, "pdata", id_sub_scan, "2dseq")):
-            img_data_vol = np.copy(
-                np.fromfile(jph(pfo_scan, "pdata", id_sub_scan, "2dseq"), dtype=dt)
-            )
-        else:
-            warn_msg = (
-                "\nNo '2dseq' data found here: \n{}. \nAre you sure the input folder contains a "
-                "proper Bruker scan?\n".format(jph(pfo_scan, "pdata", id_sub_scan))
-            )
-            warnings.warn(warn_msg)
+    # the 2dseq of all the sub-scans are checked as well, so that no image of the scan is written if one is missing.
+    if not geometry_only:
+        for id_sub_scan in list_sub_scans:
+            if not _has_2dseq(pfo_scan, id_sub_scan):
+                return None
+
+    recons = iter_scan_recons(
+        pfo_scan,
+        correct_slope=correct_slope,
+        correct_offset=correct_offset,
+        sample_upside_down=sample_upside_down,
+        nifti_version=nifti_version,
+        qform_code=qform_code,
+        sform_code=sform_code,
+        frame_body_as_frame_head=frame_body_as_frame_head,
+        keep_same_det=keep_same_det,
+        consider_subject_position=consider_subject_position,
+        corrected_dtype=corrected_dtype,
+        lazy_correction=lazy_correction,
+        integer_output=integer_output,
+        geometry_only=geometry_only,
+        timer=timer,
+        visu_pars_list=visu_pars_list,
+    )
+    if iterate_recons:
+        nib_scans_list = _recon_images(recons)
+    else:
+        nib_scans_list = [nib_im for _, nib_im in recons]
+        if len(nib_scans_list) < len(visu_pars_list):
+            # a sub-scan can not be converted, the warning is given by iter_scan_recons.
             return None
 
-        if not data_endian_ness == system_endian_nes:
-            img_data_vol.byteswap(True)
-
-        if "VisuAcqSequenceName" in visu_pars.keys():
-            visu_pars_acq_sequence_name = visu_pars["VisuAcqSequenceName"]
-        else:
-            visu_pars_acq_sequence_name = ""
-
-        is_dwi = "dtiepi" in visu_pars_acq_sequence_name.lower()
-
-        if is_dwi:
-            # Force to not correcting the slope, if true. Diffusion weighted images must be slope corrected before the
-            # DTI analysis. They will be to heavy otherwise.
-            correct_slope = False
-            correct_offset = False
-            # Force method to be parsed. Useful infos in this file to process the DWI.
-            get_method = True
-
-        # ------------------------------------------------------ #
-        # ------ Generate the nifti image using visu_pars. ----- #
-        # ------------------------------------------------------ #
-
-        nib_im = nifti_getter(
-            img_data_vol,
-            visu_pars,
-            correct_slope,
-            correct_offset,
-            sample_upside_down,
-            nifti_version,
-            qform_code,
-            sform_code,
-            frame_body_as_frame_head=frame_body_as_frame_head,
-            keep_same_det=keep_same_det,
-            consider_subject_position=consider_subject_position,
-        )
-        # ------------------------------------------------------ #
-        # ------------------------------------------------------ #
-
-        nib_scans_list.append(nib_im)
-        visu_pars_list.append(visu_pars)
+    if any(_is_dtiepi(visu_pars) for visu_pars in visu_pars_list):
+        # Force method to be parsed. Useful infos in this file to process the DWI.
+        get_method = True
 
     # -- Get additional data
 
     # Get information from method, if it exists. Parse Method parameter and erase the dictionary if unwanted
-    method = bruker_read_files("method", pfo_scan)
+    with timer.stage("parse_parameters"):
+        method = bruker_read_files("method", pfo_scan)
 
     if method == {}:
         print("Warning: No 'method' file to parse.")
@@ -203,12 +175,14 @@ def scan2struct(
     reco = {}
 
     if get_acqp:
-        acqp = bruker_read_files("acqp", pfo_scan)
+        with timer.stage("parse_parameters"):
+            acqp = bruker_read_files("acqp", pfo_scan)
         if acqp == {}:
             print("Warning: No 'acqp' file to parse.")
 
     if get_reco:
-        reco = bruker_read_files("reco", pfo_scan)
+        with timer.stage("parse_parameters"):
+            reco = bruker_read_files("reco", pfo_scan)
         if reco == {}:
             print("Warning: No 'method' file to parse.")
 
@@ -225,16 +199,182 @@ def scan2struct(
     return struct_scan
 
 
+def iter_scan_recons(
+    pfo_scan,
+    correct_slope=True,
+    correct_offset=True,
+    sample_upside_down=False,
+    nifti_version=1,
+    qform_code=1,
+    sform_code=2,
+    frame_body_as_frame_head=False,
+    keep_same_det=True,
+    consider_subject_position=False,
+    corrected_dtype=np.float64,
+    lazy_correction=False,
+    integer_output=False,
+    geometry_only=False,
+    timer=None,
+    visu_pars_list=None,
+):
+    """
+    Parse the sub-scans (reconstructions, pdata/<n>) of a scan one at a time, creating the nibabel image of each one
+    only when the previous one has been consumed. See scan2struct for the parameters.
+    :param visu_pars_list: [None] visu_pars of the sub-scans, already parsed. Parsed here, one at a time, if None.
+    :return: generator of tuples (visu_pars, nib_im), one for each sub-scan, where nib_im is a nibabel image or a
+    list of nibabel images for the sub-volumes. It stops with a warning at the first sub-scan that can not be
+    converted.
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    list_sub_scans = get_list_scans(jph(pfo_scan, "pdata"), print_structure=False)
+
+    for i, id_sub_scan in enumerate(list_sub_scans):
+
+        if visu_pars_list is None:
+            visu_pars = _read_recon_visu_pars(pfo_scan, id_sub_scan, timer)
+            if visu_pars is None:
+                return
+        else:
+            visu_pars = visu_pars_list[i]
+
+        # Get datatype, with the data endian_ness
+        dt = get_data_dtype_from_visu_pars(visu_pars)
+
+        # GET IMAGE VOLUME
+        # The 2dseq is memory-mapped with its own byte order: no copy is held in memory until the data are
+        # corrected or written, and non-native data do not need to be byteswapped in place.
+        if geometry_only:
+            # only the geometry is needed: the 2dseq is not opened, nor needed.
+            img_data_vol = None
+        else:
+            if not _has_2dseq(pfo_scan, id_sub_scan):
+                return
+            # no byte is read when mapping the file: they are counted by the stages reading the data
+            # (slope_correction, load_data).
+            with timer.stage("read_2dseq"):
+                img_data_vol = np.memmap(
+                    jph(pfo_scan, "pdata", id_sub_scan, "2dseq"), dtype=dt, mode="r"
+                )
+
+        if _is_dtiepi(visu_pars):
+            # Force to not correcting the slope, if true. Diffusion weighted images must be slope corrected before the
+            # DTI analysis. They will be to heavy otherwise.
+            correct_slope = False
+            correct_offset = False
+
+        # ------------------------------------------------------ #
+        # ------ Generate the nifti image using visu_pars. ----- #
+        # ------------------------------------------------------ #
+
+        nib_im = nifti_getter(
+            img_data_vol,
+            visu_pars,
+            correct_slope,
+            correct_offset,
+            sample_upside_down,
+            nifti_version,
+            qform_code,
+            sform_code,
+            frame_body_as_frame_head=frame_body_as_frame_head,
+            keep_same_det=keep_same_det,
+            consider_subject_position=consider_subject_position,
+            corrected_dtype=corrected_dtype,
+            lazy_correction=lazy_correction,
+            integer_output=integer_output,
+            timer=timer,
+        )
+        # ------------------------------------------------------ #
+        # ------------------------------------------------------ #
+
+        yield visu_pars, nib_im
+        # released before the next image is created.
+        del nib_im, img_data_vol
+
+
+def _recon_images(recons):
+    """
+    :param recons: generator given by iter_scan_recons.
+    :return: generator of the nibabel images of the sub-scans, holding no reference to the images consumed.
+    """
+    for _, nib_im in recons:
+        yield nib_im
+        del nib_im
+
+
+def _has_2dseq(pfo_scan, id_sub_scan):
+    """
+    :return: True if the sub-scan has its 2dseq, False with a warning otherwise.
+    """
+    if os.path.exists(jph(pfo_scan, "pdata", id_sub_scan, "2dseq")):
+        return True
+    warn_msg = (
+        "\nNo '2dseq' data found here: \n{}. \nAre you sure the input folder contains a "
+        "proper Bruker scan?\n".format(jph(pfo_scan, "pdata", id_sub_scan))
+    )
+    warnings.warn(warn_msg)
+    return False
+
+
+def _read_recon_visu_pars(pfo_scan, id_sub_scan, timer):
+    """
+    :return: visu_pars of a sub-scan, or None with a warning if the sub-scan can not be converted.
+    """
+    with timer.stage("parse_parameters"):
+        visu_pars = bruker_read_files("visu_pars", pfo_scan, sub_scan_num=id_sub_scan)
+
+    if visu_pars == {}:
+        warn_msg = (
+            "\nNo 'visu_pars' data found here: \n{}. \nAre you sure the input folder contains a "
+            "proper Bruker scan?\n".format(jph(pfo_scan, "pdata", id_sub_scan))
+        )
+        warnings.warn(warn_msg)
+        return None
+
+    # In some cases we cannot deal with, VisuPars['VisuCoreSize'] can be a float. No conversion in this case.
+    if not (
+        isinstance(visu_pars["VisuCoreSize"], np.ndarray)
+        or isinstance(visu_pars["VisuCoreSize"], list)
+    ):
+        warn_msg = (
+            "\nWarning, VisuCoreSize in VisuPars parameter file {} \n"
+            "is not a list or a vector in. The study cannot be converted."
+            " \n".format(jph(pfo_scan, "pdata", id_sub_scan))
+        )
+        warnings.warn(warn_msg)
+        return None
+
+    return visu_pars
+
+
+def _is_dtiepi(visu_pars):
+    """
+    :return: True if the sub-scan is a DtiEpi: its slope and offset are not corrected, and the method is parsed.
+    """
+    return "dtiepi" in visu_pars.get("VisuAcqSequenceName", "").lower()
+
+
 def write_struct(
     bruker_struct,
     pfo_output,
     fin_scan="",
     save_human_readable=True,
     save_b0_if_dwi=True,
+    save_mean_b0_if_dwi=False,
+    b0_threshold=50,
     verbose=1,
     frame_body_as_frame_head=False,
     keep_same_det=True,
     consider_subject_position=False,
+    chunk_size=None,
+    compress_output=True,
+    compression_level=1,
+    compression_threads=1,
+    write_threads=1,
+    geometry_only=False,
+    metadata_format="npy",
+    timer=None,
 ):
     """
     The core method of the converter has 2 parts.
@@ -247,10 +387,27 @@ def write_struct(
     :param fin_scan: filename of the scan
     :param save_human_readable: output data will be saved in .txt other than in numpy format.
     :param save_b0_if_dwi: save the first time-point if the data is a DWI.
+    :param save_mean_b0_if_dwi: [False] if the data is a DWI, save the mean of the volumes with b-value below
+    b0_threshold as _mean_b0.
+    :param b0_threshold: [50] highest effective b-value (s/mm2) of the volumes averaged in the mean b0.
     :param verbose:
     :param frame_body_as_frame_head: according to the animal. If True monkey, if False rat-rabbit
     :param keep_same_det: force the initial determinant to be the same as the final one
     :param consider_subject_position: Attribute manually set, or left blank, by the lab experts. False by default
+    :param chunk_size: [None] if not None, the nifti images are streamed to disk in slabs of at most chunk_size bytes
+    (see _utils.save_nifti).
+    :param compress_output: [True] nifti images are saved as .nii.gz if True, as .nii otherwise.
+    :param compression_level: [1] gzip compression level of the .nii.gz images, from 0 to 9.
+    :param compression_threads: [1] number of threads compressing each .nii.gz image.
+    :param write_threads: [1] number of threads writing the output files concurrently (see _utils.WriteDispatcher).
+    Up to 2 * write_threads images are held in memory, waiting to be written.
+    :param geometry_only: [False] if True, for structs parsed with geometry_only, the nifti images are saved as .nii
+    header-only stubs, and the geometry of the images is saved in a _geometry.json table (see struct_geometry).
+    :param metadata_format: ['npy'] 'npy' to save each parameter file as a .npy of a pickled dictionary (and a .txt
+    if save_human_readable), 'sidecar' to save all the parameters of the scan in a _metadata.json with a _metadata.npz
+    for the numeric arrays (see _sidecar).
+    :param timer: [None] optional StageTimer recording the 'write_nifti', 'write_parameters' (.npy files) and
+    'write_human_readable' (.txt files) stages.
     :return: save the bruker_struct parsed in scan2struct in the specified folder, with the specified parameters.
     """
 
@@ -260,14 +417,29 @@ def write_struct(
     if bruker_struct is None:
         return
 
-    if not len(bruker_struct["visu_pars_list"]) == len(bruker_struct["nib_scans_list"]):
-        raise IOError(
-            "Visu pars list and scans list have a different number of elements."
-        )
+    if isinstance(bruker_struct["nib_scans_list"], list):
+        if not len(bruker_struct["visu_pars_list"]) == len(
+            bruker_struct["nib_scans_list"]
+        ):
+            raise IOError(
+                "Visu pars list and scans list have a different number of elements."
+            )
+
+    if metadata_format not in ["npy", "sidecar"]:
+        raise IOError("metadata_format must be 'npy' or 'sidecar'.")
 
     if fin_scan is None:
         fin_scan = ""
 
+    if timer is None:
+        timer = StageTimer()
+
+    # the parameters collected for the sidecar, if any.
+    if metadata_format == "sidecar":
+        metadata = {"visu_pars": []}
+    else:
+        metadata = None
+
     # -- WRITE Additional data shared by all the sub-scans:
     # if the modality is a DtiEpi or Dwimage then save the DW directions, b values and b vectors in separate csv .txt.
 
@@ -276,284 +448,640 @@ def write_struct(
         or "dwi" in bruker_struct["visu_pars_list"][0]["VisuAcqSequenceName"].lower()
     )
 
-    if (
-        is_dwi
-    ):  # File method is the same for each sub-scan. Cannot embed this in the next for cycle.
-
-        # -- Deals with b-vector: normalise, reorient and save in external .npy/txt.
-        dw_grad_vec = bruker_struct["method"]["DwGradVec"]
+    # the files are written by a pool of write_threads threads (see WriteDispatcher), the with is the final barrier.
+    with WriteDispatcher(write_threads) as dispatcher:
 
-        assert dw_grad_vec.shape[0] == bruker_struct["method"]["DwNDiffExp"]
-
-        # get b-vectors re-orientation matrix from visu-pars
-        reorientation_matrix = obtain_b_vectors_orient_matrix(
-            bruker_struct["visu_pars_list"][0]["VisuCoreOrientation"],
-            bruker_struct["visu_pars_list"][0]["VisuSubjectPosition"],
-            frame_body_as_frame_head=frame_body_as_frame_head,
-            keep_same_det=keep_same_det,
-            consider_subject_position=consider_subject_position,
-        )
+        if (
+            is_dwi
+        ):  # File method is the same for each sub-scan. Cannot embed this in the next for cycle.
 
-        # apply reorientation
-        dw_grad_vec = apply_reorientation_to_b_vects(reorientation_matrix, dw_grad_vec)
-        # normalise:
-        dw_grad_vec = normalise_b_vect(dw_grad_vec)
+            # -- Deals with b-vector: normalise, reorient and save in external .npy/txt.
+            dw_grad_vec = bruker_struct["method"]["DwGradVec"]
 
-        np.save(jph(pfo_output, fin_scan + "_DwGradVec.npy"), dw_grad_vec)
+            assert dw_grad_vec.shape[0] == bruker_struct["method"]["DwNDiffExp"]
 
-        if save_human_readable:
-            np.savetxt(
-                jph(pfo_output, fin_scan + "_DwGradVec.txt"), dw_grad_vec, fmt="%.14f"
+            # get b-vectors re-orientation matrix from visu-pars
+            reorientation_matrix = obtain_b_vectors_orient_matrix(
+                bruker_struct["visu_pars_list"][0]["VisuCoreOrientation"],
+                bruker_struct["visu_pars_list"][0]["VisuSubjectPosition"],
+                frame_body_as_frame_head=frame_body_as_frame_head,
+                keep_same_det=keep_same_det,
+                consider_subject_position=consider_subject_position,
             )
 
-        if verbose > 0:
-            msg = "Diffusion weighted directions saved in " + jph(
-                pfo_output, fin_scan + "_DwDir.npy"
+            # apply reorientation
+            dw_grad_vec = apply_reorientation_to_b_vects(
+                reorientation_matrix, dw_grad_vec
             )
-            print(msg)
+            # normalise:
+            dw_grad_vec = normalise_b_vect(dw_grad_vec)
 
-        b_vals = bruker_struct["method"]["DwEffBval"]
-        b_vects = bruker_struct["method"]["DwDir"]
+            b_vals = bruker_struct["method"]["DwEffBval"]
+            b_vects = bruker_struct["method"]["DwDir"]
 
-        np.save(jph(pfo_output, fin_scan + "_DwEffBval.npy"), b_vals)
-        np.save(jph(pfo_output, fin_scan + "_DwDir.npy"), b_vects)
+            if metadata is not None:
+                metadata["dwi"] = {
+                    "DwGradVec": dw_grad_vec,
+                    "DwEffBval": b_vals,
+                    "DwDir": b_vects,
+                }
+            else:
+                pfi_dw_grad_vec = jph(pfo_output, fin_scan + "_DwGradVec.npy")
+                dispatcher.submit(
+                    _timed_write,
+                    timer,
+                    "write_parameters",
+                    pfi_dw_grad_vec,
+                    np.save,
+                    pfi_dw_grad_vec,
+                    dw_grad_vec,
+                )
 
-        if save_human_readable:
-            np.savetxt(
-                jph(pfo_output, fin_scan + "_DwEffBval.txt"), b_vals, fmt="%.14f"
-            )
-            np.savetxt(jph(pfo_output, fin_scan + "_DwDir.txt"), b_vects, fmt="%.14f")
+                if save_human_readable:
+                    pfi_dw_grad_vec = jph(pfo_output, fin_scan + "_DwGradVec.txt")
+                    dispatcher.submit(
+                        _timed_write,
+                        timer,
+                        "write_human_readable",
+                        pfi_dw_grad_vec,
+                        np.savetxt,
+                        pfi_dw_grad_vec,
+                        dw_grad_vec,
+                        fmt="%.14f",
+                    )
 
-        if verbose > 0:
-            print(
-                "B-values  saved in {}".format(
-                    jph(pfo_output, fin_scan + "_DwEffBval.npy")
-                )
+                if verbose > 0:
+                    msg = "Diffusion weighted directions saved in " + jph(
+                        pfo_output, fin_scan + "_DwDir.npy"
+                    )
+                    print(msg)
+
+                for suffix, values in [("_DwEffBval", b_vals), ("_DwDir", b_vects)]:
+                    pfi_values = jph(pfo_output, fin_scan + suffix + ".npy")
+                    dispatcher.submit(
+                        _timed_write,
+                        timer,
+                        "write_parameters",
+                        pfi_values,
+                        np.save,
+                        pfi_values,
+                        values,
+                    )
+
+                if save_human_readable:
+                    for suffix, values in [("_DwEffBval", b_vals), ("_DwDir", b_vects)]:
+                        pfi_values = jph(pfo_output, fin_scan + suffix + ".txt")
+                        dispatcher.submit(
+                            _timed_write,
+                            timer,
+                            "write_human_readable",
+                            pfi_values,
+                            np.savetxt,
+                            pfi_values,
+                            values,
+                            fmt="%.14f",
+                        )
+
+                if verbose > 0:
+                    print(
+                        "B-values  saved in {}".format(
+                            jph(pfo_output, fin_scan + "_DwEffBval.npy")
+                        )
+                    )
+                    print(
+                        "B-vectors saved in {}".format(
+                            jph(pfo_output, fin_scan + "_DwGradVec.npy")
+                        )
+                    )
+
+        # save the dictionary as numpy array containing the corresponding dictionaries
+        # TODO use pickle instead of numpy to save the dictionaries(?)
+
+        for param_file in ["acqp", "method", "reco"]:
+            if bruker_struct[param_file] == {}:
+                continue
+            if metadata is not None:
+                metadata[param_file] = bruker_struct[param_file]
+                continue
+            pfi_param_file = jph(pfo_output, fin_scan + "_" + param_file + ".npy")
+            dispatcher.submit(
+                _timed_write,
+                timer,
+                "write_parameters",
+                pfi_param_file,
+                np.save,
+                pfi_param_file,
+                bruker_struct[param_file],
             )
-            print(
-                "B-vectors saved in {}".format(
-                    jph(pfo_output, fin_scan + "_DwGradVec.npy")
+            if save_human_readable:
+                pfi_param_file = jph(pfo_output, fin_scan + "_" + param_file + ".txt")
+                dispatcher.submit(
+                    _timed_write,
+                    timer,
+                    "write_human_readable",
+                    pfi_param_file,
+                    from_dict_to_txt_sorted,
+                    bruker_struct[param_file],
+                    pfi_param_file,
                 )
-            )
 
-    # save the dictionary as numpy array containing the corresponding dictionaries
-    # TODO use pickle instead of numpy to save the dictionaries(?)
+        # Visu_pars and summary info for each sub-scan:
+        summary_info = {}
 
-    if not bruker_struct["acqp"] == {}:
-        np.save(jph(pfo_output, fin_scan + "_acqp.npy"), bruker_struct["acqp"])
-        if save_human_readable:
-            from_dict_to_txt_sorted(
-                bruker_struct["acqp"], jph(pfo_output, fin_scan + "_acqp.txt")
-            )
-    if not bruker_struct["method"] == {}:
-        np.save(jph(pfo_output, fin_scan + "_method.npy"), bruker_struct["method"])
-        if save_human_readable:
-            from_dict_to_txt_sorted(
-                bruker_struct["method"], jph(pfo_output, fin_scan + "_method.txt")
-            )
-    if not bruker_struct["reco"] == {}:
-        np.save(jph(pfo_output, fin_scan + "_reco.npy"), bruker_struct["reco"])
-        if save_human_readable:
-            from_dict_to_txt_sorted(
-                bruker_struct["reco"], jph(pfo_output, fin_scan + "_reco.txt")
-            )
+        geometry = []
+        # if the struct iterates the sub-scans (see scan2struct), each image is created here.
+        nib_scans = iter(bruker_struct["nib_scans_list"])
 
-    # Visu_pars and summary info for each sub-scan:
-    summary_info = {}
+        for i in range(len(bruker_struct["visu_pars_list"])):
 
-    for i in range(len(bruker_struct["visu_pars_list"])):
+            nib_im = next(nib_scans, None)
+            if nib_im is None:
+                raise IOError("Sub-scan {} can not be converted.".format(i))
 
-        if len(bruker_struct["nib_scans_list"]) > 1:
-            i_label = "_subscan_" + str(i) + "_"
-        else:
-            i_label = "_"
+            if len(bruker_struct["visu_pars_list"]) > 1:
+                i_label = "_subscan_" + str(i) + "_"
+            else:
+                i_label = "_"
 
-        # A) Save visu_pars for each sub-scan:
-        np.save(
-            jph(pfo_output, fin_scan + i_label + "visu_pars.npy"),
-            bruker_struct["visu_pars_list"][i],
-        )
+            if metadata is not None:
+                # the slope is in the visu_pars.
+                metadata["visu_pars"].append(bruker_struct["visu_pars_list"][i])
+            else:
+                # A) Save visu_pars for each sub-scan:
+                pfi_visu_pars = jph(pfo_output, fin_scan + i_label + "visu_pars.npy")
+                dispatcher.submit(
+                    _timed_write,
+                    timer,
+                    "write_parameters",
+                    pfi_visu_pars,
+                    np.save,
+                    pfi_visu_pars,
+                    bruker_struct["visu_pars_list"][i],
+                )
 
-        # B) Save single slope data for each sub-scan (from visu_pars):
-        np.save(
-            jph(pfo_output, fin_scan + i_label + "slope.npy"),
-            bruker_struct["visu_pars_list"][i]["VisuCoreDataSlope"],
-        )
+                # B) Save single slope data for each sub-scan (from visu_pars):
+                pfi_slope = jph(pfo_output, fin_scan + i_label + "slope.npy")
+                dispatcher.submit(
+                    _timed_write,
+                    timer,
+                    "write_parameters",
+                    pfi_slope,
+                    np.save,
+                    pfi_slope,
+                    bruker_struct["visu_pars_list"][i]["VisuCoreDataSlope"],
+                )
 
-        # A and B) save them both in .txt if human readable version of data is required.
-        if save_human_readable:
-            from_dict_to_txt_sorted(
-                bruker_struct["visu_pars_list"][i],
-                jph(pfo_output, fin_scan + i_label + "visu_pars.txt"),
-            )
+                # A and B) save them both in .txt if human readable version of data is required.
+                if save_human_readable:
+                    pfi_visu_pars = jph(
+                        pfo_output, fin_scan + i_label + "visu_pars.txt"
+                    )
+                    dispatcher.submit(
+                        _timed_write,
+                        timer,
+                        "write_human_readable",
+                        pfi_visu_pars,
+                        from_dict_to_txt_sorted,
+                        bruker_struct["visu_pars_list"][i],
+                        pfi_visu_pars,
+                    )
 
-            slope = bruker_struct["visu_pars_list"][i]["VisuCoreDataSlope"]
-            if not isinstance(slope, np.ndarray):
-                slope = np.atleast_2d(slope)
-            np.savetxt(
-                jph(pfo_output, fin_scan + i_label + "slope.txt"), slope, fmt="%.14f"
-            )
+                    slope = bruker_struct["visu_pars_list"][i]["VisuCoreDataSlope"]
+                    if not isinstance(slope, np.ndarray):
+                        slope = np.atleast_2d(slope)
+                    pfi_slope = jph(pfo_output, fin_scan + i_label + "slope.txt")
+                    dispatcher.submit(
+                        _timed_write,
+                        timer,
+                        "write_human_readable",
+                        pfi_slope,
+                        np.savetxt,
+                        pfi_slope,
+                        slope,
+                        fmt="%.14f",
+                    )
+
+            # Update summary dictionary:
+            summary_info_i = {
+                i_label[1:]
+                + "visu_pars['VisuUid']": bruker_struct["visu_pars_list"][i]["VisuUid"],
+                i_label[1:]
+                + "visu_pars['VisuCoreDataSlope']": bruker_struct["visu_pars_list"][i][
+                    "VisuCoreDataSlope"
+                ],
+                i_label[1:]
+                + "visu_pars['VisuCoreSize']": bruker_struct["visu_pars_list"][i][
+                    "VisuCoreSize"
+                ],
+                i_label[1:]
+                + "visu_pars['VisuCoreOrientation']": bruker_struct["visu_pars_list"][
+                    i
+                ]["VisuCoreOrientation"],
+                i_label[1:]
+                + "visu_pars['VisuCorePosition']": bruker_struct["visu_pars_list"][i][
+                    "VisuCorePosition"
+                ],
+            }
+
+            if len(list(bruker_struct["visu_pars_list"][i]["VisuCoreExtent"])) == 2:
+                # equivalent to struct['method']['SpatDimEnum'] == '2D':
+                if (
+                    "VisuCoreSlicePacksSlices"
+                    in bruker_struct["visu_pars_list"][i].keys()
+                ):
+                    summary_info_i.update(
+                        {
+                            i_label[1:]
+                            + "visu_pars['VisuCoreSlicePacksSlices']": bruker_struct[
+                                "visu_pars_list"
+                            ][i]["VisuCoreSlicePacksSlices"]
+                        }
+                    )
 
-        # Update summary dictionary:
-        summary_info_i = {
-            i_label[1:]
-            + "visu_pars['VisuUid']": bruker_struct["visu_pars_list"][i]["VisuUid"],
-            i_label[1:]
-            + "visu_pars['VisuCoreDataSlope']": bruker_struct["visu_pars_list"][i][
-                "VisuCoreDataSlope"
-            ],
-            i_label[1:]
-            + "visu_pars['VisuCoreSize']": bruker_struct["visu_pars_list"][i][
-                "VisuCoreSize"
-            ],
-            i_label[1:]
-            + "visu_pars['VisuCoreOrientation']": bruker_struct["visu_pars_list"][i][
-                "VisuCoreOrientation"
-            ],
-            i_label[1:]
-            + "visu_pars['VisuCorePosition']": bruker_struct["visu_pars_list"][i][
-                "VisuCorePosition"
-            ],
-        }
-
-        if len(list(bruker_struct["visu_pars_list"][i]["VisuCoreExtent"])) == 2:
-            # equivalent to struct['method']['SpatDimEnum'] == '2D':
-            if "VisuCoreSlicePacksSlices" in bruker_struct["visu_pars_list"][i].keys():
+            if (
+                len(list(bruker_struct["visu_pars_list"][i]["VisuCoreExtent"])) == 3
+                and "VisuCoreDiskSliceOrder"
+                in bruker_struct["visu_pars_list"][i].keys()
+            ):
+                # first part equivalent to struct['method']['SpatDimEnum'] == '3D':
                 summary_info_i.update(
                     {
                         i_label[1:]
-                        + "visu_pars['VisuCoreSlicePacksSlices']": bruker_struct[
+                        + "visu_pars['VisuCoreDiskSliceOrder']": bruker_struct[
                             "visu_pars_list"
-                        ][i]["VisuCoreSlicePacksSlices"]
+                        ][i]["VisuCoreDiskSliceOrder"]
                     }
                 )
 
-        if (
-            len(list(bruker_struct["visu_pars_list"][i]["VisuCoreExtent"])) == 3
-            and "VisuCoreDiskSliceOrder" in bruker_struct["visu_pars_list"][i].keys()
-        ):
-            # first part equivalent to struct['method']['SpatDimEnum'] == '3D':
-            summary_info_i.update(
-                {
-                    i_label[1:]
-                    + "visu_pars['VisuCoreDiskSliceOrder']": bruker_struct[
-                        "visu_pars_list"
-                    ][i]["VisuCoreDiskSliceOrder"]
-                }
-            )
+            if "VisuCreatorVersion" in bruker_struct["visu_pars_list"][i].keys():
+                summary_info_i.update(
+                    {
+                        i_label[1:]
+                        + "visu_pars['VisuCreatorVersion']": bruker_struct[
+                            "visu_pars_list"
+                        ][i]["VisuCreatorVersion"]
+                    }
+                )
 
-        if "VisuCreatorVersion" in bruker_struct["visu_pars_list"][i].keys():
-            summary_info_i.update(
-                {
-                    i_label[1:]
-                    + "visu_pars['VisuCreatorVersion']": bruker_struct[
-                        "visu_pars_list"
-                    ][i]["VisuCreatorVersion"]
-                }
-            )
+            summary_info.update(summary_info_i)
 
-        summary_info.update(summary_info_i)
+            # WRITE NIFTI IMAGES:
+
+            ext = ".nii.gz" if compress_output and not geometry_only else ".nii"
+            nifti_kwargs = dict(
+                chunk_size=chunk_size,
+                compression_level=compression_level,
+                compression_threads=compression_threads,
+                header_only=geometry_only,
+            )
 
-        # WRITE NIFTI IMAGES:
+            if isinstance(nib_im, list):
+                # the scan had sub-volumes embedded. they are saved separately
+                for sub_vol_id, subvol in enumerate(nib_im):
+
+                    if fin_scan == "":
+                        pfi_scan = jph(
+                            pfo_output,
+                            "scan" + i_label[:-1] + "_subvol_" + str(sub_vol_id) + ext,
+                        )
+                    else:
+                        pfi_scan = jph(
+                            pfo_output,
+                            fin_scan
+                            + i_label[:-1]
+                            + "_subvol_"
+                            + str(sub_vol_id)
+                            + ext,
+                        )
+
+                    dispatcher.submit(
+                        _timed_write,
+                        timer,
+                        "write_nifti",
+                        pfi_scan,
+                        save_nifti,
+                        subvol,
+                        pfi_scan,
+                        **nifti_kwargs
+                    )
 
-        if isinstance(bruker_struct["nib_scans_list"][i], list):
-            # the scan had sub-volumes embedded. they are saved separately
-            for sub_vol_id, subvol in enumerate(bruker_struct["nib_scans_list"][i]):
+            else:
 
                 if fin_scan == "":
-                    pfi_scan = jph(
-                        pfo_output,
-                        "scan"
-                        + i_label[:-1]
-                        + "_subvol_"
-                        + str(sub_vol_id)
-                        + ".nii.gz",
-                    )
+                    pfi_scan = jph(pfo_output, "scan" + i_label[:-1] + ext)
                 else:
-                    pfi_scan = jph(
-                        pfo_output,
-                        fin_scan
-                        + i_label[:-1]
-                        + "_subvol_"
-                        + str(sub_vol_id)
-                        + ".nii.gz",
+                    pfi_scan = jph(pfo_output, fin_scan + i_label[:-1] + ext)
+
+                dispatcher.submit(
+                    _timed_write,
+                    timer,
+                    "write_nifti",
+                    pfi_scan,
+                    save_nifti,
+                    nib_im,
+                    pfi_scan,
+                    **nifti_kwargs
+                )
+
+                if save_b0_if_dwi and is_dwi:
+                    # save the b0, first slice alone. Optimized if you have
+                    # NiftiSeg (http://cmictig.cs.ucl.ac.uk/wiki/index.php/NiftySeg) installed
+
+                    if fin_scan == "":
+                        pfi_scan_b0 = jph(
+                            pfo_output, "scan" + i_label[:-1] + "_b0" + ext
+                        )
+                    else:
+                        pfi_scan_b0 = jph(
+                            pfo_output, fin_scan + i_label[:-1] + "_b0" + ext
+                        )
+
+                    # only the frames of the first volume are read.
+                    dispatcher.submit(
+                        _timed_write,
+                        timer,
+                        "write_nifti",
+                        pfi_scan_b0,
+                        _save_volumes,
+                        nib_im,
+                        0,
+                        pfi_scan_b0,
+                        **nifti_kwargs
+                    )
+                    if verbose > 0:
+                        msg = "b0 scan saved alone in " + pfi_scan_b0
+                        print(msg)
+
+                if save_mean_b0_if_dwi and is_dwi:
+                    # mean of all the b0 acquired, read one volume at a time.
+                    # The first volume if none is below threshold.
+                    b0_volumes = [
+                        v
+                        for v, b_val in enumerate(np.atleast_1d(b_vals))
+                        if b_val <= b0_threshold and v < nib_im.shape[-1]
+                    ] or [0]
+                    if fin_scan == "":
+                        pfi_scan_mean_b0 = jph(
+                            pfo_output, "scan" + i_label[:-1] + "_mean_b0" + ext
+                        )
+                    else:
+                        pfi_scan_mean_b0 = jph(
+                            pfo_output, fin_scan + i_label[:-1] + "_mean_b0" + ext
+                        )
+
+                    dispatcher.submit(
+                        _timed_write,
+                        timer,
+                        "write_nifti",
+                        pfi_scan_mean_b0,
+                        _save_volumes,
+                        nib_im,
+                        b0_volumes,
+                        pfi_scan_mean_b0,
+                        mean=True,
+                        **nifti_kwargs
                     )
+                    if verbose > 0:
+                        msg = "mean of {0} b0 saved in {1}".format(
+                            len(b0_volumes), pfi_scan_mean_b0
+                        )
+                        print(msg)
+
+            if geometry_only:
+                geometry += _image_geometry(i, nib_im)
+            # the images of the sub-scan are released as soon as they are written, before the next sub-scan is created
+            # if the writes are not dispatched to threads.
+            nib_im = subvol = None
+
+        if geometry_only:
+            pfi_geometry = jph(pfo_output, fin_scan + "_geometry.json")
+            dispatcher.submit(
+                _timed_write,
+                timer,
+                "write_parameters",
+                pfi_geometry,
+                _save_json,
+                geometry,
+                pfi_geometry,
+            )
 
-                nib.save(subvol, pfi_scan)
+        # complete the summary info with additional information from other parameter files, if required:
+
+        if not bruker_struct["acqp"] == {}:
+
+            summary_info_acqp = {
+                "acqp['ACQ_sw_version']": bruker_struct["acqp"]["ACQ_sw_version"],
+                "acqp['NR']": bruker_struct["acqp"]["NR"],
+                "acqp['NI']": bruker_struct["acqp"]["NI"],
+                "acqp['ACQ_n_echo_images']": bruker_struct["acqp"]["ACQ_n_echo_images"],
+                "acqp['ACQ_slice_thick']": bruker_struct["acqp"]["ACQ_slice_thick"],
+            }
+            summary_info.update(summary_info_acqp)
+
+        if not bruker_struct["method"] == {}:
+
+            summary_info_method = {
+                "method['SpatDimEnum']": bruker_struct["method"]["SpatDimEnum"],
+                "method['Matrix']": bruker_struct["method"]["Matrix"],
+                "method['SpatResol']": bruker_struct["method"]["SpatResol"],
+                "method['Method']": bruker_struct["method"]["Method"],
+                "method['SPackArrSliceOrient']": bruker_struct["method"][
+                    "SPackArrSliceOrient"
+                ],
+                "method['SPackArrReadOrient']": bruker_struct["method"][
+                    "SPackArrReadOrient"
+                ],
+            }
+            summary_info.update(summary_info_method)
+
+        if not bruker_struct["reco"] == {}:
+
+            summary_info_reco = {
+                "reco['RECO_size']": bruker_struct["reco"]["RECO_size"],
+                "reco['RECO_inp_order']": bruker_struct["reco"]["RECO_inp_order"],
+            }
+            summary_info.update(summary_info_reco)
+
+        # Finally summary info with the updated information, in the sidecar or alone.
+        if metadata is not None:
+            metadata["summary"] = summary_info
+            metadata["acquisition_method"] = bruker_struct["acquisition_method"]
+            pfi_json, pfi_npz = sidecar_paths(pfo_output, fin_scan)
+            dispatcher.submit(
+                _timed_write,
+                timer,
+                "write_parameters",
+                [pfi_json, pfi_npz],
+                write_sidecar,
+                metadata,
+                pfi_json,
+                pfi_npz,
+            )
+            if verbose > 0:
+                print("Metadata saved in {0} and {1}".format(pfi_json, pfi_npz))
+        else:
+            pfi_summary = jph(pfo_output, fin_scan + "_summary.txt")
+            dispatcher.submit(
+                _timed_write,
+                timer,
+                "write_human_readable",
+                pfi_summary,
+                from_dict_to_txt_sorted,
+                summary_info,
+                pfi_summary,
+            )
 
+    # Get the method name in a single .txt file:
+    if metadata is None and bruker_struct["acquisition_method"] is not "":
+        text_file = open(jph(pfo_output, "acquisition_method.txt"), "w+")
+        text_file.write(bruker_struct["acquisition_method"])
+        text_file.close()
+
+
+def _struct_images(bruker_struct):
+    """
+    :param bruker_struct: output of scan2struct.
+    :return: list of the nibabel images of the struct, with the sub-volumes of each sub-scan.
+    """
+    images = []
+    for nib_im in bruker_struct["nib_scans_list"]:
+        if isinstance(nib_im, list):
+            images += nib_im
         else:
+            images.append(nib_im)
+    return images
+
+
+def struct_geometry(bruker_struct):
+    """
+    :param bruker_struct: output of scan2struct, possibly parsed with geometry_only.
+    :return: list with the geometry of each image of the struct, in the order they are written: dictionaries with
+    'sub_scan', 'sub_volume' (None if the sub-scan is a single volume), 'shape', 'dtype', 'voxel_size', 'affine',
+    'qform_code' and 'sform_code', taken from the nifti headers.
+    """
+    geometry = []
+    for sub_scan, nib_im in enumerate(bruker_struct["nib_scans_list"]):
+        geometry += _image_geometry(sub_scan, nib_im)
+    return geometry
+
+
+def _image_geometry(sub_scan, nib_im):
+    """
+    :return: list with the geometry of the image of a sub-scan, or of its sub-volumes (see struct_geometry).
+    """
+    if isinstance(nib_im, list):
+        sub_volumes = list(enumerate(nib_im))
+    else:
+        sub_volumes = [(None, nib_im)]
+    geometry = []
+    for sub_volume, im in sub_volumes:
+        hdr = im.header
+        geometry.append(
+            {
+                "sub_scan": sub_scan,
+                "sub_volume": sub_volume,
+                "shape": [int(d) for d in im.shape],
+                "dtype": hdr.get_data_dtype().name,
+                "voxel_size": [float(z) for z in hdr.get_zooms()],
+                "affine": im.affine.tolist(),
+                "qform_code": int(hdr["qform_code"]),
+                "sform_code": int(hdr["sform_code"]),
+            }
+        )
+    return geometry
+
+
+def struct_nbytes(bruker_struct):
+    """
+    :param bruker_struct: output of scan2struct.
+    :return: bytes taken in memory by the images of the struct once loaded, also if they are still memory-mapped
+    or proxied (see load_struct).
+    """
+    return sum(
+        int(np.prod(im.dataobj.shape)) * np.dtype(im.dataobj.dtype).itemsize
+        for im in _struct_images(bruker_struct)
+    )
 
-            if fin_scan == "":
-                pfi_scan = jph(pfo_output, "scan" + i_label[:-1] + ".nii.gz")
+
+def load_struct(bruker_struct, timer=None):
+    """
+    Read from disk the images of the struct still memory-mapped, and apply the slope and offset correction still
+    proxied, so that no disk access nor computation is left to write_struct.
+    :param bruker_struct: output of scan2struct.
+    :param timer: [None] optional StageTimer recording the 'load_data' stage.
+    :return: the struct with the images in memory.
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    def load_image(nib_im):
+        if isinstance(nib_im.dataobj, CorrectedArrayProxy):
+            record["bytes_read"] += nib_im.dataobj.raw_data.nbytes
+            data = np.asarray(nib_im.dataobj)
+        elif isinstance(nib_im.dataobj, np.memmap):
+            record["bytes_read"] += nib_im.dataobj.nbytes
+            data = np.array(nib_im.dataobj)
+        else:
+            return nib_im
+        loaded_im = nib_im.__class__(data, nib_im.affine, header=nib_im.header)
+        # nibabel resets the scaling of the header of a new image (see integer_output in scan2struct).
+        loaded_im.header.set_slope_inter(*nib_im.header.get_slope_inter())
+        return loaded_im
+
+    with timer.stage("load_data") as record:
+        nib_scans_list = []
+        for nib_im in bruker_struct["nib_scans_list"]:
+            if isinstance(nib_im, list):
+                nib_scans_list.append([load_image(im) for im in nib_im])
             else:
-                pfi_scan = jph(pfo_output, fin_scan + i_label[:-1] + ".nii.gz")
+                nib_scans_list.append(load_image(nib_im))
 
-            nib.save(bruker_struct["nib_scans_list"][i], pfi_scan)
+    loaded_struct = dict(bruker_struct)
+    loaded_struct["nib_scans_list"] = nib_scans_list
+    return loaded_struct
 
-            if save_b0_if_dwi and is_dwi:
-                # save the b0, first slice alone. Optimized if you have
-                # NiftiSeg (http://cmictig.cs.ucl.ac.uk/wiki/index.php/NiftySeg) installed
 
-                if fin_scan == "":
-                    pfi_scan_b0 = jph(pfo_output, "scan" + i_label[:-1] + "_b0.nii.gz")
-                else:
-                    pfi_scan_b0 = jph(
-                        pfo_output, fin_scan + i_label[:-1] + "_b0.nii.gz"
-                    )
+def _timed_write(timer, stage_name, pfi_output, write, *args, **kwargs):
+    """
+    :param timer: StageTimer.
+    :param stage_name: stage of the timer recording the write.
+    :param pfi_output: path to the file written, or list of paths to the files written.
+    :param write: function writing the file, called with args and kwargs.
+    :return: [None] write the file, recording the time and the bytes written in the stage.
+    """
+    if not isinstance(pfi_output, list):
+        pfi_output = [pfi_output]
+    with timer.stage(stage_name) as record:
+        write(*args, **kwargs)
+        _add_written_bytes(record, *pfi_output)
 
-                nib.save(
-                    set_new_data(
-                        bruker_struct["nib_scans_list"][i],
-                        bruker_struct["nib_scans_list"][i].get_fdata()[..., 0],
-                    ),
-                    pfi_scan_b0,
-                )
-                if verbose > 0:
-                    msg = "b0 scan saved alone in " + pfi_scan_b0
-                    print(msg)
 
-    # complete the summary info with additional information from other parameter files, if required:
-
-    if not bruker_struct["acqp"] == {}:
-
-        summary_info_acqp = {
-            "acqp['ACQ_sw_version']": bruker_struct["acqp"]["ACQ_sw_version"],
-            "acqp['NR']": bruker_struct["acqp"]["NR"],
-            "acqp['NI']": bruker_struct["acqp"]["NI"],
-            "acqp['ACQ_n_echo_images']": bruker_struct["acqp"]["ACQ_n_echo_images"],
-            "acqp['ACQ_slice_thick']": bruker_struct["acqp"]["ACQ_slice_thick"],
-        }
-        summary_info.update(summary_info_acqp)
-
-    if not bruker_struct["method"] == {}:
-
-        summary_info_method = {
-            "method['SpatDimEnum']": bruker_struct["method"]["SpatDimEnum"],
-            "method['Matrix']": bruker_struct["method"]["Matrix"],
-            "method['SpatResol']": bruker_struct["method"]["SpatResol"],
-            "method['Method']": bruker_struct["method"]["Method"],
-            "method['SPackArrSliceOrient']": bruker_struct["method"][
-                "SPackArrSliceOrient"
-            ],
-            "method['SPackArrReadOrient']": bruker_struct["method"][
-                "SPackArrReadOrient"
-            ],
-        }
-        summary_info.update(summary_info_method)
-
-    if not bruker_struct["reco"] == {}:
-
-        summary_info_reco = {
-            "reco['RECO_size']": bruker_struct["reco"]["RECO_size"],
-            "reco['RECO_inp_order']": bruker_struct["reco"]["RECO_inp_order"],
-        }
-        summary_info.update(summary_info_reco)
-
-    # Finally summary info with the updated information.
-    from_dict_to_txt_sorted(summary_info, jph(pfo_output, fin_scan + "_summary.txt"))
+def _save_volumes(nib_im, volumes, pfi_output, mean=False, header_only=False, **kwargs):
+    """
+    :return: [None] save volumes of a 4d image, or their mean, read as in _utils.extract_volumes. With header_only,
+    the header of a 3d image is saved, as save_nifti.
+    """
+    if header_only:
+        nib_im = set_new_data(
+            nib_im,
+            np.broadcast_to(np.zeros(()), nib_im.shape[:-1]),
+            remove_nan=False,
+        )
+    else:
+        nib_im = extract_volumes(nib_im, volumes, mean=mean)
+    save_nifti(nib_im, pfi_output, header_only=header_only, **kwargs)
 
-    # Get the method name in a single .txt file:
-    if bruker_struct["acquisition_method"] is not "":
-        text_file = open(jph(pfo_output, "acquisition_method.txt"), "w+")
-        text_file.write(bruker_struct["acquisition_method"])
-        text_file.close()
+
+def _save_json(obj, pfi_output):
+    with open(pfi_output, "w") as f:
+        json.dump(obj, f, indent=2)
+
+
+def _add_written_bytes(record, *list_pfi):
+    """
+    :param record: record of a StageTimer stage.
+    :param list_pfi: paths to the files written in the stage.
+    :return: [None] add the size of the files to the bytes written in the stage.
+    """
+    for pfi in list_pfi:
+        record["bytes_written"] += os.path.getsize(pfi)
@@ -2,12 +2,22 @@ import os
 import nibabel as nib
 import numpy as np
 
+try:
+    from os import scandir
+except ImportError:
+    # python < 3.5
+    scandir = None
+
 from bruker2nifti._utils import (
     bruker_read_files,
     eliminate_consecutive_duplicates,
-    data_corrector,
+    get_broadcastable_factors,
+    get_uniform_scaling,
+    get_lossless_dtype,
+    CorrectedArrayProxy,
     compute_affine_from_visu_pars,
     compute_resolution_from_visu_pars,
+    StageTimer,
 )
 
 
@@ -15,31 +25,110 @@ def get_list_scans(start_path, print_structure=True):
     """
     Given a path containing scans (pfo_study) or sub-scans (join(pfo_study, 'pdata')),
     finds the list of the names of the scans.
+    Only the folder itself is read, with a single directory listing: the scans are not walked into.
     :param start_path: path to the folder containing scans or sub-scans.
     :param print_structure: [True] optional if you want to visualise the structure data at console
-    :return: list of scans/sub_scans names.
+    (see print_folder_structure, walking the whole folder).
+    :return: list of scans/sub_scans names. Empty if the folder does not exist.
     """
+    if print_structure:
+        print_folder_structure(start_path)
+
+    if not os.path.isdir(start_path):
+        return []
+
+    if scandir is not None:
+        scans_list = [
+            entry.name
+            for entry in scandir(start_path)
+            if entry.name.isdigit() and entry.is_dir()
+        ]
+    else:
+        scans_list = [
+            d
+            for d in os.listdir(start_path)
+            if d.isdigit() and os.path.isdir(os.path.join(start_path, d))
+        ]
+
+    scans_list.sort(key=float)
+    return scans_list
+
 
-    scans_list = []
+# {absolute path: (modification time of the folder, folder tree)}
+_folder_trees = {}
 
-    for dirpath, dirnames, filenames in os.walk(start_path):
 
-        if dirpath == start_path:
-            scans_list = [d for d in dirnames if d.isdigit()]
+def get_folder_tree(start_path, use_cache=False):
+    """
+    Full listing of a folder, as given by os.walk.
+    :param start_path: path to the folder.
+    :param use_cache: [False] if True, the listing kept in memory from a previous walk is given, unless the
+    modification time of the folder itself changed (e.g. a new scan in a study). Changes deeper in the folder do not
+    update the cached listing: only for folders known to be complete.
+    :return: list of tuples (dirpath, dirnames, filenames).
+    """
+    if not os.path.isdir(start_path):
+        return []
+    pfo = os.path.abspath(start_path)
+    mtime = os.stat(pfo).st_mtime
+
+    if use_cache and pfo in _folder_trees and _folder_trees[pfo][0] == mtime:
+        tree = _folder_trees[pfo][1]
+    else:
+        tree = [
+            (dirpath, list(dirnames), list(filenames))
+            for dirpath, dirnames, filenames in os.walk(pfo)
+        ]
+        _folder_trees[pfo] = (mtime, tree)
+
+    # paths as given
+    return [
+        (start_path + dirpath[len(pfo) :], dirnames, filenames)
+        for dirpath, dirnames, filenames in tree
+    ]
 
+
+def print_folder_structure(start_path, use_cache=False):
+    """
+    Print to console the tree of a folder, e.g. of a study.
+    :param start_path: path to the folder.
+    :param use_cache: [False] see get_folder_tree.
+    :return: [None] only print to console information.
+    """
+    for dirpath, dirnames, filenames in get_folder_tree(
+        start_path, use_cache=use_cache
+    ):
         level = dirpath.replace(start_path, "").count(os.sep)
         indent = (" " * 4) * level
-        if print_structure:
-            print("{}{}/".format(indent, os.path.basename(dirpath)))
+        print("{}{}/".format(indent, os.path.basename(dirpath)))
 
         sub_indent = (" " * 4) * (level + 1)
+        for f in filenames:
+            print("{}{}".format(sub_indent, f))
 
-        if print_structure:
-            for f in filenames:
-                print("{}{}".format(sub_indent, f))
 
-    scans_list.sort(key=float)
-    return scans_list
+def get_list_studies(pfo_root):
+    """
+    Finds the Bruker studies under a root folder, e.g. a scanner archive. A study is a folder with at least a scan,
+    i.e. a sub-folder with a numeric name containing a 'pdata' folder. The sub-folders of a study are not searched.
+    :param pfo_root: path to the root folder.
+    :return: sorted list of the paths to the studies.
+    """
+    studies_list = []
+
+    for dirpath, dirnames, filenames in os.walk(pfo_root):
+        if any(
+            d.isdigit() and os.path.isdir(os.path.join(dirpath, d, "pdata"))
+            for d in dirnames
+        ):
+            studies_list.append(dirpath)
+            # do not walk into the scans
+            del dirnames[:]
+        else:
+            dirnames.sort()
+
+    studies_list.sort()
+    return studies_list
 
 
 def get_subject_name(pfo_study):
@@ -49,18 +138,45 @@ def get_subject_name(pfo_study):
     """
     # (1) 'subject' at the study level is present
     if os.path.exists(os.path.join(pfo_study, "subject")):
-        subject = bruker_read_files("subject", pfo_study)
+        subject = bruker_read_files("subject", pfo_study, keys=["SUBJECT_id"])
         return subject["SUBJECT_id"]
     # (2) 'subject' at the study level is not present, we use 'VisuSubjectId' from visu_pars of the first scan.
-    # Longer solution as at the end 'visu_pars' will be unavoidably scanned twice.
+    # 'visu_pars' is read only up to 'VisuSubjectId'.
     else:
-        list_scans = get_list_scans(pfo_study)
+        list_scans = get_list_scans(pfo_study, print_structure=False)
         visu_pars = bruker_read_files(
-            "visu_pars", pfo_study, sub_scan_num=list_scans[0]
+            "visu_pars", pfo_study, sub_scan_num=list_scans[0], keys=["VisuSubjectId"]
         )
         return visu_pars["VisuSubjectId"]
 
 
+def get_data_dtype_from_visu_pars(visu_pars):
+    """
+    :param visu_pars: visu_pars parameter file parsed into a dictionary.
+    :return: numpy dtype of the data stored in the '2dseq' file, according to VisuCoreWordType, with the byte order
+    given by VisuCoreByteOrder (big endian if not specified).
+    """
+    # Get data endian_nes - default big!!
+    if visu_pars.get("VisuCoreByteOrder") == "littleEndian":
+        byte_order = "<"
+    else:
+        byte_order = ">"
+
+    # Get datatype
+    if visu_pars["VisuCoreWordType"] == "_32BIT_SGN_INT":
+        dt = np.int32
+    elif visu_pars["VisuCoreWordType"] == "_16BIT_SGN_INT":
+        dt = np.int16
+    elif visu_pars["VisuCoreWordType"] == "_8BIT_UNSGN_INT":
+        dt = np.uint8
+    elif visu_pars["VisuCoreWordType"] == "_32BIT_FLOAT":
+        dt = np.float32
+    else:
+        raise IOError("Unknown data type for VisuPars VisuCoreWordType")
+
+    return np.dtype(dt).newbyteorder(byte_order)
+
+
 def get_stack_direction_from_VisuCorePosition(visu_core_position, num_sub_volumes=1):
     """
     To be used when the acquisition is 2D: it returns the stack orientation and direction encoded in a string.
@@ -137,6 +253,78 @@ def get_stack_direction_from_VisuCorePosition(visu_core_position, num_sub_volume
     return res
 
 
+def get_frame_groups_from_visu_pars(visu_pars):
+    """
+    Frame groups of the scan, from VisuFGOrderDesc (see manuals D-2-73). Each descriptor is a string
+    '(size, <name>, <dependent variables>, start, count)', and the first frame group is the one varying fastest in
+    the frames stored in the 2dseq.
+    :param visu_pars: visu_pars parameter file parsed into a dictionary.
+    :return: list of tuples (size, name) in the order of VisuFGOrderDesc, e.g. [(8, 'FG_ECHO'), (20, 'FG_SLICE')].
+    Empty if the scan has no frame groups.
+    """
+    if "VisuFGOrderDescDim" not in visu_pars.keys():
+        return []
+    if not visu_pars["VisuFGOrderDescDim"] > 0:
+        return []
+
+    descr = visu_pars["VisuFGOrderDesc"]
+    if not isinstance(descr, list):
+        descr = [descr]
+
+    frame_groups = []
+    for dd in descr:
+        fields = dd.replace("(", "").replace(")", "").split(",")
+        frame_groups.append((int(fields[0]), fields[1].strip().strip("<>")))
+    return frame_groups
+
+
+def reorder_frame_groups(vol_data, spatial_shape, frame_groups):
+    """
+    Layout of the frame groups (slice, echo, movie, diffusion, cycle...) of a scan, with FG_SLICE first.
+    With FG_ECHO (e.g. MSME), the frames are split in the order of the frame groups, the first one varying fastest,
+    then FG_SLICE is moved to the first dimension after the spatial ones, the other frame groups keeping their order.
+    Without FG_ECHO, FG_SLICE is swapped with the first frame group and the frames are split in this order.
+    Both are a reshape and a transpose: arrays, memory maps and CorrectedArrayProxy are reordered with no copy.
+    :param vol_data: volume with shape spatial_shape + [number of frames], frames in Fortran order.
+    :param spatial_shape: spatial dimensions of the volume (VisuCoreSize).
+    :param frame_groups: list of tuples (size, name), as given by get_frame_groups_from_visu_pars.
+    :return: view of vol_data with shape spatial_shape + size of each frame group, FG_SLICE first. vol_data as it
+    is if the frame groups do not match the number of frames.
+    ----------
+    Example:
+
+    frame_groups = [(8, 'FG_ECHO'), (20, 'FG_SLICE')], vol_data.shape = (64, 64, 160)
+    -> output shape (64, 64, 20, 8), with output[:, :, z, t] = vol_data[:, :, z * 8 + t]
+    """
+    spatial_shape = [int(d) for d in spatial_shape]
+    names = [name for _, name in frame_groups]
+    sizes = [size for size, _ in frame_groups]
+
+    if "FG_SLICE" not in names:
+        raise IOError(
+            "FG_SLICE not found in the order descriptor, can not tell the ordering."
+        )
+    if np.prod(sizes) != vol_data.shape[-1]:
+        return vol_data
+
+    fg_slice = names.index("FG_SLICE")
+
+    if "FG_ECHO" not in names:
+        sizes[fg_slice], sizes[0] = sizes[0], sizes[fg_slice]
+        return vol_data.reshape(spatial_shape + sizes, order="F")
+
+    vol_data = vol_data.reshape(spatial_shape + sizes, order="F")
+
+    if fg_slice > 0:
+        groups_order = [fg_slice] + [g for g in range(len(names)) if g != fg_slice]
+        vol_data = vol_data.transpose(
+            list(range(len(spatial_shape)))
+            + [len(spatial_shape) + g for g in groups_order]
+        )
+
+    return vol_data
+
+
 def nifti_getter(
     img_data_vol,
     visu_pars,
@@ -149,10 +337,16 @@ def nifti_getter(
     frame_body_as_frame_head=False,
     keep_same_det=True,
     consider_subject_position=False,
+    corrected_dtype=np.float64,
+    lazy_correction=False,
+    integer_output=False,
+    timer=None,
 ):
     """
     Passage method to get a nifti image from the volume and the element contained into visu_pars.
-    :param img_data_vol: volume of the image.
+    :param img_data_vol: volume of the image, as a flat array. Can be memory-mapped: it is reshaped without copies
+    and materialised only if the slope or the offset are corrected. If None, geometry only: the shape and the datatype
+    of the image are given by visu_pars alone, and its data object is a read-only array of zeros taking no memory.
     :param visu_pars: corresponding dictionary to the 'visu_pars' data file.
     :param correct_slope: [True/False] if you want to correct the slope.
     :param correct_offset: [True/False] if you want to correct the offset.
@@ -163,8 +357,23 @@ def nifti_getter(
     :param frame_body_as_frame_head: [True/False] if the frame is the same for head and body [monkey] or not [mouse].
     :param keep_same_det: flag to constrain the determinant to be as the one provided into the orientation parameter.
     :param consider_subject_position: [False] if taking into account the 'Head_prone' 'Head_supine' input.
+    :param corrected_dtype: [np.float64] datatype of the data after slope and offset correction.
+    :param lazy_correction: [False] if True and the slope or the offset are corrected, the data object of the output
+    image is a CorrectedArrayProxy: data are corrected slice by slice when accessed (e.g. by _utils.save_nifti with a
+    chunk_size) instead of being corrected in memory all at once. Sub-volumes are always corrected in memory.
+    :param integer_output: [False] if True and the slope and the offset to correct are the same for all the frames,
+    the data are not corrected: the image keeps the raw (integer) data, with the slope and the offset in the
+    scl_slope and scl_inter of its header, applied by the readers of the saved image (the header stores them in
+    single precision, a relative difference below 1e-7 from the corrected data). Frame-wise factors are
+    corrected in the smallest datatype holding the corrected data exactly (see _utils.get_lossless_dtype), or in
+    corrected_dtype if there is none.
+    :param timer: [None] optional StageTimer recording the 'slope_correction' and 'affine' stages. The correction
+    stage includes the reading of memory-mapped data from disk.
     :return:
     """
+    if timer is None:
+        timer = StageTimer()
+
     # Check units of measurements:
     if not ["mm"] * len(visu_pars["VisuCoreSize"]) == visu_pars["VisuCoreUnits"]:
         # if the UoM is not mm, change here. Add other measurements and refer to xyzt_units from nibabel convention.
@@ -177,7 +386,13 @@ def nifti_getter(
     if int(visu_pars["VisuCoreFrameCount"]) > 1:
         vol_pre_shape += [int(visu_pars["VisuCoreFrameCount"])]
 
-    if np.prod(vol_pre_shape) == img_data_vol.shape[0]:
+    if img_data_vol is None:
+        # geometry only: zeros broadcast to the volume, with the datatype of the 2dseq.
+        vol_data = np.broadcast_to(
+            np.zeros((), dtype=get_data_dtype_from_visu_pars(visu_pars)),
+            vol_pre_shape,
+        )
+    elif np.prod(vol_pre_shape) == img_data_vol.shape[0]:
         vol_data = img_data_vol.reshape(vol_pre_shape, order="F")
     else:
         echo = img_data_vol.shape[0] / np.prod(vol_pre_shape)
@@ -185,17 +400,38 @@ def nifti_getter(
         vol_pre_shape = [int(k) for k in vol_pre_shape]
         vol_data = img_data_vol.reshape(vol_pre_shape, order="F")
 
-    # correct slope if required
+    # correct slope and offset (AFTER slope), if required, in a single pass. The correction is proxied through the
+    # re-shaping of the volume, and applied when the nifti image is created (or when it is written if lazy_correction)
+    slope = None
+    offset = None
     if correct_slope:
-        vol_data = data_corrector(
-            vol_data, visu_pars["VisuCoreDataSlope"], kind="slope"
+        slope = get_broadcastable_factors(
+            visu_pars["VisuCoreDataSlope"], vol_data.shape, kind="slope"
         )
-    # correct offset (AFTER slope) if required
     if correct_offset:
-        vol_data = data_corrector(
-            vol_data, visu_pars["VisuCoreDataOffs"], kind="offset"
+        offset = get_broadcastable_factors(
+            visu_pars["VisuCoreDataOffs"], vol_data.shape, kind="offset"
         )
 
+    # integer output: uniform factors go in the header, frame-wise factors are corrected without loss if possible.
+    header_scaling = None
+    if integer_output and (slope is not None or offset is not None):
+        header_scaling = get_uniform_scaling(slope, offset)
+        if header_scaling is None:
+            corrected_dtype = get_lossless_dtype(
+                vol_data.dtype, slope, offset, default_dtype=corrected_dtype
+            )
+
+    if header_scaling is None and (slope is not None or offset is not None):
+        if img_data_vol is None:
+            vol_data = np.broadcast_to(
+                np.zeros((), dtype=corrected_dtype), vol_data.shape
+            )
+        else:
+            vol_data = CorrectedArrayProxy(
+                vol_data, slope=slope, offset=offset, dtype=corrected_dtype
+            )
+
     # get number sub-volumes
     num_sub_volumes = len(
         eliminate_consecutive_duplicates(list(visu_pars["VisuCoreOrientation"]))
@@ -213,32 +449,43 @@ def nifti_getter(
         )
 
         # get resolution - same for all sub-volumes.
-        resolution = compute_resolution_from_visu_pars(
-            visu_pars["VisuCoreExtent"],
-            visu_pars["VisuCoreSize"],
-            visu_pars["VisuCoreFrameThickness"],
-        )
+        with timer.stage("affine"):
+            resolution = compute_resolution_from_visu_pars(
+                visu_pars["VisuCoreExtent"],
+                visu_pars["VisuCoreSize"],
+                visu_pars["VisuCoreFrameThickness"],
+            )
 
         for id_sub_vol in range(num_sub_volumes):
 
             # compute affine
-            affine_transf = compute_affine_from_visu_pars(
-                list(visu_pars["VisuCoreOrientation"])[id_sub_vol * vol_shape[2]],
-                list(visu_pars["VisuCorePosition"])[id_sub_vol * vol_shape[2]],
-                visu_pars["VisuSubjectPosition"],
-                resolution,
-                frame_body_as_frame_head=frame_body_as_frame_head,
-                keep_same_det=keep_same_det,
-                consider_subject_position=consider_subject_position,
+            with timer.stage("affine"):
+                affine_transf = compute_affine_from_visu_pars(
+                    list(visu_pars["VisuCoreOrientation"])[id_sub_vol * vol_shape[2]],
+                    list(visu_pars["VisuCorePosition"])[id_sub_vol * vol_shape[2]],
+                    visu_pars["VisuSubjectPosition"],
+                    resolution,
+                    frame_body_as_frame_head=frame_body_as_frame_head,
+                    keep_same_det=keep_same_det,
+                    consider_subject_position=consider_subject_position,
+                )
+
+                if sample_upside_down:
+                    affine_transf = affine_transf.dot(np.diag([-1, 1, -1, 1]))
+
+            # get sub volume in the correct shape. Slicing a proxy gives the corrected data in memory.
+            sub_vol_slice = slice(
+                id_sub_vol * vol_shape[2], (id_sub_vol + 1) * vol_shape[2]
             )
-
-            if sample_upside_down:
-                affine_transf = affine_transf.dot(np.diag([-1, 1, -1, 1]))
-
-            # get sub volume in the correct shape
-            img_data_sub_vol = vol_data[
-                ..., id_sub_vol * vol_shape[2] : (id_sub_vol + 1) * vol_shape[2]
-            ]
+            if isinstance(vol_data, CorrectedArrayProxy):
+                with timer.stage("slope_correction") as record:
+                    img_data_sub_vol = vol_data[..., sub_vol_slice]
+                    record["bytes_read"] += (
+                        img_data_sub_vol.size * vol_data.raw_data.dtype.itemsize
+                    )
+                    record["bytes_written"] += img_data_sub_vol.nbytes
+            else:
+                img_data_sub_vol = vol_data[..., sub_vol_slice]
 
             if nifti_version == 1:
                 nib_im_sub_vol = nib.Nifti1Image(img_data_sub_vol, affine=affine_transf)
@@ -251,89 +498,46 @@ def nifti_getter(
             hdr_sub_vol.set_qform(affine_transf, code=qform_code)
             hdr_sub_vol.set_sform(affine_transf, code=sform_code)
             hdr_sub_vol["xyzt_units"] = 10  # default mm, seconds
+            if header_scaling is not None:
+                hdr_sub_vol.set_slope_inter(*header_scaling)
             nib_im_sub_vol.update_header()
 
             output_nifti.append(nib_im_sub_vol)
 
     else:
 
-        # get shape
-        sh = vol_pre_shape
-
-        # check for frame groups:  -- Very convoluted scaffolding. Waiting to have more infos to refactor this part.
-        # ideally an external function read VisuFGOrderDesc should provide the sh and the choice between # A and # B
-        # while testing for exception.
-
-        if "VisuFGOrderDescDim" in visu_pars.keys():  # see manuals D-2-73
-            if visu_pars["VisuFGOrderDescDim"] > 0:
-                if isinstance(visu_pars["VisuFGOrderDesc"], list):
-                    if len(visu_pars["VisuFGOrderDesc"]) > 1:
-                        descr = visu_pars["VisuFGOrderDesc"][:]
-                        # sort descr so that FG_SLICE is the first one, all the others came as they are after swapping.
-                        fg_slice_pos = -1
-                        fg_echo = -1
-                        fg_movie = -1
-                        for d in range(len(descr)):
-                            if "<FG_SLICE>" in descr[d]:
-                                fg_slice_pos = d
-                            if "<FG_ECHO>" in descr[d]:
-                                fg_echo = d
-                            if "<FG_MOVIE>" in descr[d]:
-                                fg_movie = d
-                        if fg_slice_pos == -1:
-                            raise IOError(
-                                "FG_SLICE not found in the order descriptor, can not tell the ordering."
-                            )
-
-                        descr[fg_slice_pos], descr[0] = descr[0], descr[fg_slice_pos]
-
-                        dims = []
-                        for dd in descr:
-                            dims.append(
-                                int(dd.replace("(", "").replace(")", "").split(",")[0])
-                            )
-
-                        if np.prod(dims) == sh[-1]:
-                            sh = vol_pre_shape[:-1] + dims
-                            # A
-                            if fg_echo > -1:
-                                # MSME
-                                stack_data = np.zeros(sh, dtype=vol_data.dtype)
-                                for t in range(sh[3]):
-                                    for z in range(sh[2]):
-                                        stack_data[:, :, z, t] = vol_data[
-                                            :, :, z * sh[3] + t
-                                        ]
-
-                                vol_data = np.copy(stack_data)
-                            # B
-                            elif fg_movie > -1:
-                                # DTI
-                                vol_data = vol_data.reshape(sh, order="F")
-                            else:
-                                # Else ?
-                                vol_data = vol_data.reshape(sh, order="F")
-
-        # get resolution
-        resolution = compute_resolution_from_visu_pars(
-            visu_pars["VisuCoreExtent"],
-            visu_pars["VisuCoreSize"],
-            visu_pars["VisuCoreFrameThickness"],
-        )
+        # split the frames in their frame groups, FG_SLICE first (e.g. MSME: [x, y, slices, echoes]).
+        frame_groups = get_frame_groups_from_visu_pars(visu_pars)
+        if len(frame_groups) > 1:
+            vol_data = reorder_frame_groups(vol_data, vol_pre_shape[:-1], frame_groups)
+
+        with timer.stage("affine"):
+            # get resolution
+            resolution = compute_resolution_from_visu_pars(
+                visu_pars["VisuCoreExtent"],
+                visu_pars["VisuCoreSize"],
+                visu_pars["VisuCoreFrameThickness"],
+            )
 
-        # compute affine
-        affine_transf = compute_affine_from_visu_pars(
-            list(visu_pars["VisuCoreOrientation"])[0],
-            list(visu_pars["VisuCorePosition"])[0],
-            visu_pars["VisuSubjectPosition"],
-            resolution,
-            frame_body_as_frame_head=frame_body_as_frame_head,
-            keep_same_det=keep_same_det,
-            consider_subject_position=consider_subject_position,
-        )
+            # compute affine
+            affine_transf = compute_affine_from_visu_pars(
+                list(visu_pars["VisuCoreOrientation"])[0],
+                list(visu_pars["VisuCorePosition"])[0],
+                visu_pars["VisuSubjectPosition"],
+                resolution,
+                frame_body_as_frame_head=frame_body_as_frame_head,
+                keep_same_det=keep_same_det,
+                consider_subject_position=consider_subject_position,
+            )
+
+            if sample_upside_down:
+                affine_transf = affine_transf.dot(np.diag([-1, 1, -1, 1]))
 
-        if sample_upside_down:
-            affine_transf = affine_transf.dot(np.diag([-1, 1, -1, 1]))
+        if isinstance(vol_data, CorrectedArrayProxy) and not lazy_correction:
+            with timer.stage("slope_correction") as record:
+                record["bytes_read"] += vol_data.raw_data.nbytes
+                vol_data = np.asarray(vol_data)
+                record["bytes_written"] += vol_data.nbytes
 
         if nifti_version == 1:
             output_nifti = nib.Nifti1Image(vol_data, affine=affine_transf)
@@ -346,6 +550,8 @@ def nifti_getter(
         hdr_sub_vol.set_qform(affine_transf, code=qform_code)
         hdr_sub_vol.set_sform(affine_transf, code=sform_code)
         hdr_sub_vol["xyzt_units"] = 10
+        if header_scaling is not None:
+            hdr_sub_vol.set_slope_inter(*header_scaling)
         output_nifti.update_header()
 
     return output_nifti
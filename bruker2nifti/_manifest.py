@@ -0,0 +1,149 @@
+"""
+Manifest of the conversion of a study, for the incremental conversion.
+
+The manifest is a json file in the output folder of the study, with an entry for each scan converted:
+
+scans {
+  [bruker_scan_name]: {
+    'status': 'converted' or 'failed',
+    'output': path to the output folder of the scan,
+    'settings': { [converter_attribute]: [value] },
+    'inputs': { [path relative to the scan folder]: [size, mtime] },
+    'outputs': { [path relative to the output folder]: {'size': ..., 'mtime': ..., 'sha1': ...} }
+  }
+}
+
+A scan is up to date if it was converted with the same settings and in the same output folder, none of its input
+files changed, and all of its outputs are still there, unchanged. Only the sizes and the modification times are
+compared, so that checking a study takes a few stat calls; the hashes are kept to verify the outputs on demand.
+"""
+
+import hashlib
+import json
+import os
+
+
+class ConversionManifest(object):
+    """
+    Manifest of the conversion of the scans of a study, stored in pfo_nifti_study.
+    """
+
+    filename = "bruker2nifti_manifest.json"
+
+    def __init__(self, pfo_nifti_study):
+        """
+        :param pfo_nifti_study: output folder of the study, where the manifest is stored. An existing manifest is
+        loaded, an unreadable one (e.g. if a previous conversion was killed while saving it) is ignored.
+        """
+        self.pfi_manifest = os.path.join(pfo_nifti_study, self.filename)
+        self.scans = {}
+        if os.path.exists(self.pfi_manifest):
+            try:
+                with open(self.pfi_manifest) as f:
+                    self.scans = json.load(f)["scans"]
+            except (ValueError, KeyError):
+                self.scans = {}
+
+    def is_up_to_date(
+        self, bruker_scan_name, pfo_scan_bruker, pfo_scan_nifti, settings
+    ):
+        """
+        :param bruker_scan_name: name of the scan in the Bruker study.
+        :param pfo_scan_bruker: path to the folder of the Bruker scan.
+        :param pfo_scan_nifti: path to the output folder of the scan.
+        :param settings: dictionary with the settings of the converter (see Bruker2Nifti.conversion_settings).
+        :return: True if the scan does not need to be converted again.
+        """
+        entry = self.scans.get(bruker_scan_name)
+        if entry is None or entry["status"] != "converted":
+            return False
+        if entry["output"] != pfo_scan_nifti or entry["settings"] != settings:
+            return False
+        if entry["inputs"] != files_signature(pfo_scan_bruker):
+            return False
+        outputs = files_signature(pfo_scan_nifti)
+        return all(
+            outputs.get(pfi) == [record["size"], record["mtime"]]
+            for pfi, record in entry["outputs"].items()
+        )
+
+    def record(self, bruker_scan_name, pfo_scan_bruker, result, settings, inputs=None):
+        """
+        :param bruker_scan_name: name of the scan in the Bruker study.
+        :param pfo_scan_bruker: path to the folder of the Bruker scan.
+        :param result: result of the conversion of the scan, with the keys 'output' and 'status'.
+        :param settings: dictionary with the settings of the converter (see Bruker2Nifti.conversion_settings).
+        :param inputs: [None] signature of the input files taken before the conversion (see files_signature), so that
+        files changed during the conversion are seen as changed at the next run. Taken now if None.
+        :return: [None] add or replace the entry of the scan. Call save to write the manifest.
+        """
+        if inputs is None:
+            inputs = files_signature(pfo_scan_bruker)
+        outputs = {}
+        if result["status"] == "converted":
+            for pfi, (size, mtime) in files_signature(result["output"]).items():
+                outputs[pfi] = {
+                    "size": size,
+                    "mtime": mtime,
+                    "sha1": file_sha1(os.path.join(result["output"], pfi)),
+                }
+        self.scans[bruker_scan_name] = {
+            "status": result["status"],
+            "output": result["output"],
+            "settings": settings,
+            "inputs": inputs,
+            "outputs": outputs,
+        }
+
+    def verify_outputs(self, bruker_scan_name):
+        """
+        :param bruker_scan_name: name of the scan in the Bruker study.
+        :return: list of the outputs of the scan missing or whose content differs from the one recorded, by hash.
+        """
+        entry = self.scans[bruker_scan_name]
+        corrupted = []
+        for pfi, record in sorted(entry["outputs"].items()):
+            pfi_output = os.path.join(entry["output"], pfi)
+            if (
+                not os.path.exists(pfi_output)
+                or file_sha1(pfi_output) != record["sha1"]
+            ):
+                corrupted.append(pfi)
+        return corrupted
+
+    def save(self):
+        """
+        :return: [None] write the manifest. The file is replaced at once, so that it is never left half written.
+        """
+        pfi_tmp = self.pfi_manifest + ".tmp"
+        with open(pfi_tmp, "w") as f:
+            json.dump({"scans": self.scans}, f, indent=2, sort_keys=True)
+        getattr(os, "replace", os.rename)(pfi_tmp, self.pfi_manifest)
+
+
+def files_signature(pfo):
+    """
+    :param pfo: path to a folder.
+    :return: dictionary {path relative to pfo: [size, mtime]} of all the files in the folder and its sub-folders.
+    Empty if the folder does not exist.
+    """
+    signature = {}
+    for dirpath, dirnames, filenames in os.walk(pfo):
+        for filename in filenames:
+            pfi = os.path.join(dirpath, filename)
+            stat = os.stat(pfi)
+            signature[os.path.relpath(pfi, pfo)] = [stat.st_size, stat.st_mtime]
+    return signature
+
+
+def file_sha1(pfi, block_size=1024 ** 2):
+    """
+    :param pfi: path to a file.
+    :param block_size: [1MB] size of the blocks read.
+    :return: sha1 hex digest of the content of the file.
+    """
+    sha1 = hashlib.sha1()
+    with open(pfi, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
@@ -34,8 +34,26 @@ read_recon() returns the sub-dictionary corresponding to [recon_number] for a
 
 list_scans() returns a list of scan numbers
 list_recons() returns a list of recon numbers for a given scan
+
+An optional MetadataIndex, persistent on disk, can be shared among the
+BrukerMetadata of many studies: parameter files already parsed and unchanged
+since are then read from the index instead.
+
+In lazy mode the dictionaries of the parameter files are replaced by
+LazyParamFile mappings, parsing their file only when first accessed. With
+keys, only the selected variables of each parameter file are kept.
 """
+import json
 import os
+import sqlite3
+import threading
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+import numpy as np
 
 import bruker2nifti._utils as utils
 
@@ -43,16 +61,32 @@ import bruker2nifti._utils as utils
 class BrukerMetadata(object):
     """Represents metadata associated with a given MRI study."""
 
-    def __init__(self, study):
+    def __init__(self, study, index=None, lazy=False, keys=None):
         """
         Initialises a new object with the location of the study.
 
         self.pfo_input stores the path to the root directory of a give MRI
         study. The path is not checked for validity during initialisation.
+
+        index is an optional MetadataIndex, or the path to the folder of one,
+        where the parsed parameter files are stored and looked up.
+
+        If lazy is True, each parameter file is parsed only when its data are
+        first accessed. If keys is a list of variable names, only these
+        variables are kept from each parameter file. If keys is a dictionary
+        {param_file: list of variable names}, e.g. {'acqp': ['ACQ_method']},
+        each parameter file keeps only its own variables, and it is read only
+        up to the last of them. The files missing from the dictionary are
+        fully parsed.
         """
         self.pfo_input = study
         self.subject_data = None
         self.scan_data = None
+        if index is not None and not isinstance(index, MetadataIndex):
+            index = MetadataIndex(index)
+        self.index = index
+        self.lazy = lazy
+        self.keys = keys
 
     def parse_subject(self):
         """
@@ -80,7 +114,7 @@ class BrukerMetadata(object):
         populates a dictionary with the data where keys correspond to variables
         within the source file (minus any ##/$/PVM_ decorators).
         """
-        return utils.bruker_read_files("subject", self.pfo_input)
+        return self._read_param_file("subject", self.pfo_input)
 
     def read_scans(self):
         """
@@ -106,8 +140,8 @@ class BrukerMetadata(object):
         """
         scan_data = {}
         data_path = os.path.join(self.pfo_input, scan)
-        scan_data["acqp"] = utils.bruker_read_files("acqp", data_path)
-        scan_data["method"] = utils.bruker_read_files("method", data_path)
+        scan_data["acqp"] = self._read_param_file("acqp", data_path)
+        scan_data["method"] = self._read_param_file("method", data_path)
         scan_data["recons"] = self.read_recons(scan)
         return scan_data
 
@@ -136,10 +170,45 @@ class BrukerMetadata(object):
         """
         recon_data = {}
         data_path = os.path.join(self.pfo_input, scan)
-        recon_data["reco"] = utils.bruker_read_files("reco", data_path, recon)
-        recon_data["visu_pars"] = utils.bruker_read_files("visu_pars", data_path, recon)
+        recon_data["reco"] = self._read_param_file("reco", data_path, recon)
+        recon_data["visu_pars"] = self._read_param_file("visu_pars", data_path, recon)
         return recon_data
 
+    def _read_param_file(self, *args):
+        """
+        Reads a parameter file with bruker_read_files, through the index if
+        any. In lazy mode, returns a LazyParamFile instead.
+        """
+        if self.lazy:
+            return LazyParamFile(self._load_param_file, *args)
+        return self._load_param_file(*args)
+
+    def _load_param_file(self, *args):
+        """
+        Parses a parameter file, keeping only the selected keys if any.
+        The index stores whole files: with an index, the file is fully parsed
+        once and the keys are selected afterwards.
+        """
+        keys = self._selected_keys(args[0])
+        if self.index is not None:
+            param_data = self.index.read(*args)
+            if keys is not None:
+                param_data = {k: v for k, v in param_data.items() if k in keys}
+            return param_data
+        if keys is not None:
+            # parse only the selected keys, up to the last of them.
+            return utils.bruker_read_files(*args, keys=keys)
+        return utils.bruker_read_files(*args)
+
+    def _selected_keys(self, param_file):
+        """
+        Returns the variable names selected for the parameter file, None for
+        all of them.
+        """
+        if isinstance(self.keys, Mapping):
+            return self.keys.get(param_file)
+        return self.keys
+
     def list_scans(self):
         """
         Returns a list of scans that comprise this study.
@@ -184,3 +253,140 @@ class BrukerMetadata(object):
             if os.path.isdir(os.path.join(path, d)) and d.isdigit()
         ]
         return sorted(dirs, key=int)
+
+
+class LazyParamFile(Mapping):
+    """
+    Read-only mapping with the data of a parameter file.
+
+    The file is parsed by loader(*args) when the data are first accessed,
+    and kept afterwards.
+    """
+
+    def __init__(self, loader, *args):
+        self._loader = loader
+        self._args = args
+        self._data = None
+
+    @property
+    def loaded(self):
+        """
+        True if the parameter file has already been parsed.
+        """
+        return self._data is not None
+
+    def _load(self):
+        if self._data is None:
+            self._data = self._loader(*self._args)
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __repr__(self):
+        if self._data is None:
+            return "LazyParamFile{} (not loaded)".format(self._args)
+        return "LazyParamFile({})".format(self._data)
+
+
+class MetadataIndex(object):
+    """
+    Persistent index of parsed parameter files.
+
+    The dictionaries parsed from the parameter files are stored in a SQLite
+    database in the folder pfo_index, together with the modification time
+    and the size of their file. A file is parsed again only if it changed,
+    so that listing a study seen before does not parse any file. The same
+    index can be shared by many studies.
+    """
+
+    filename = "bruker2nifti_metadata_index.sqlite"
+
+    def __init__(self, pfo_index):
+        """
+        Opens the index in the folder pfo_index, created if needed.
+        """
+        if not os.path.isdir(pfo_index):
+            os.makedirs(pfo_index)
+        self.pfi_database = os.path.join(pfo_index, self.filename)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.pfi_database, timeout=60, check_same_thread=False
+        )
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS param_files "
+                "(path TEXT PRIMARY KEY, mtime REAL, size INTEGER, content TEXT)"
+            )
+
+    def read(self, param_file, data_path, sub_scan_num="1"):
+        """
+        Returns the parameter file parsed as bruker_read_files would do.
+
+        The parsed dictionary is looked up in the index, and stored in it if
+        missing or outdated.
+        """
+        pfi_param_file = utils.get_param_file_path(param_file, data_path, sub_scan_num)
+        if pfi_param_file is None:
+            return {}
+        pfi_param_file = os.path.abspath(pfi_param_file)
+        stat = os.stat(pfi_param_file)
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content FROM param_files "
+                "WHERE path = ? AND mtime = ? AND size = ?",
+                (pfi_param_file, stat.st_mtime, stat.st_size),
+            ).fetchone()
+        if row is not None:
+            return json.loads(row[0], object_hook=_decode_param_value)
+
+        dict_info = utils.param_files_cache.read(pfi_param_file)
+        content = json.dumps(dict_info, default=_encode_param_value)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO param_files VALUES (?, ?, ?, ?)",
+                (pfi_param_file, stat.st_mtime, stat.st_size, content),
+            )
+        return dict_info
+
+    def clear(self):
+        """
+        Removes all the entries of the index.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM param_files")
+
+    def close(self):
+        """
+        Closes the connection to the database of the index.
+        """
+        self._connection.close()
+
+
+def _encode_param_value(value):
+    """
+    JSON encoding of the numpy arrays of a parsed parameter file.
+    """
+    if isinstance(value, np.ndarray):
+        return {
+            "__ndarray__": value.ravel().tolist(),
+            "dtype": str(value.dtype),
+            "shape": list(value.shape),
+        }
+    raise TypeError("{} is not JSON serializable".format(type(value)))
+
+
+def _decode_param_value(obj):
+    """
+    Decoding of the JSON objects encoded by _encode_param_value.
+    """
+    if "__ndarray__" in obj:
+        return np.array(obj["__ndarray__"], dtype=obj["dtype"]).reshape(obj["shape"])
+    return obj
@@ -0,0 +1,135 @@
+"""
+Metadata sidecar of a converted scan: all the parameters of the scan in two files, instead of a .npy (and a .txt)
+for each parameter file.
+
+[fin_scan]_metadata.json holds the structure and the values of the parameters:
+
+{
+  'acqp': { [key_from_acqp_file]: [corresponding_value] },
+  'method': { [key_from_method_file]: [corresponding_value] },
+  'reco': { [key_from_reco_file]: [corresponding_value] },
+  'visu_pars': [ { [key_from_visu_pars_file]: [corresponding_value] }, one for each sub-scan ],
+  'dwi': { 'DwGradVec': ..., 'DwEffBval': ..., 'DwDir': ... }, if the scan is a DWI,
+  'summary': { [summary_key]: [corresponding_value] },
+  'acquisition_method': [acquisition_method]
+}
+
+[fin_scan]_metadata.npz holds the numeric arrays, referred to in the json by {'__npz__': [name of the array]}.
+Nothing is pickled: the arrays are read with np.load(allow_pickle=False), each one only when accessed.
+"""
+
+import json
+import os
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+import numpy as np
+
+
+def sidecar_paths(pfo_output, fin_scan):
+    """
+    :param pfo_output: output folder of the scan.
+    :param fin_scan: filename of the scan.
+    :return: paths to the .json and the .npz files of the sidecar.
+    """
+    pfi_root = os.path.join(pfo_output, fin_scan + "_metadata")
+    return pfi_root + ".json", pfi_root + ".npz"
+
+
+def write_sidecar(metadata, pfi_json, pfi_npz):
+    """
+    :param metadata: dictionary with the metadata of the scan (see the module docstring). Values can be nested
+    dictionaries and lists, strings, numbers, numpy scalars and numpy arrays.
+    :param pfi_json: path to the output .json file.
+    :param pfi_npz: path to the output .npz file.
+    :return: [None] save the metadata, the numeric arrays in the .npz file, uncompressed.
+    """
+    arrays = {}
+    with open(pfi_json, "w") as f:
+        json.dump(_encode(metadata, "", arrays), f, indent=1, sort_keys=True)
+    np.savez(pfi_npz, **arrays)
+
+
+def read_sidecar(pfi_json, pfi_npz=None):
+    """
+    :param pfi_json: path to the .json file of the sidecar.
+    :param pfi_npz: [None] path to the .npz file of the sidecar, next to the .json file if None.
+    :return: read-only dictionary with the metadata of the scan. The arrays are read from the .npz file when first
+    accessed.
+    """
+    if pfi_npz is None:
+        pfi_npz = os.path.splitext(pfi_json)[0] + ".npz"
+    with open(pfi_json) as f:
+        metadata = json.load(f)
+    return _SidecarDict(metadata, _NpzArrays(pfi_npz))
+
+
+def _encode(value, name, arrays):
+    """
+    :return: value with the numeric arrays replaced by references to arrays, where they are added with their name.
+    """
+    if isinstance(value, Mapping):
+        return {
+            str(k): _encode(v, name + "/" + str(k), arrays) for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [_encode(v, name + "/" + str(i), arrays) for i, v in enumerate(value)]
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind in "biufc":
+            arrays[name[1:]] = value
+            return {"__npz__": name[1:]}
+        # e.g. arrays of strings
+        return _encode(value.tolist(), name, arrays)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class _NpzArrays(object):
+    """
+    Arrays of the .npz file of a sidecar. The file is opened at each array read, so that no file is left open.
+    """
+
+    def __init__(self, pfi_npz):
+        self.pfi_npz = pfi_npz
+
+    def __getitem__(self, name):
+        with np.load(self.pfi_npz, allow_pickle=False) as npz:
+            if name not in npz.files:
+                raise IOError("Array {0} not found in {1}".format(name, self.pfi_npz))
+            return npz[name]
+
+
+def _decode(value, arrays):
+    if isinstance(value, dict):
+        if "__npz__" in value:
+            return arrays[value["__npz__"]]
+        return _SidecarDict(value, arrays)
+    if isinstance(value, list):
+        return [_decode(v, arrays) for v in value]
+    return value
+
+
+class _SidecarDict(Mapping):
+    """
+    Read-only dictionary of a sidecar, resolving the references to the arrays when accessed.
+    """
+
+    def __init__(self, data, arrays):
+        self._data = data
+        self._arrays = arrays
+
+    def __getitem__(self, key):
+        return _decode(self._data[key], self._arrays)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return "<{0} keys: {1}>".format(type(self).__name__, sorted(self._data))
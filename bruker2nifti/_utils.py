@@ -1,9 +1,20 @@
+import copy
+import io
+import json
 import numpy as np
 import os
 import nibabel as nib
 import re
+import struct
+import threading
+import time
 import warnings
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 from os.path import join as jph
+from timeit import default_timer
 
 
 # --- text-files utils ---
@@ -15,6 +26,10 @@ def unique_words_in_string(in_string):
     return ulist[0]
 
 
+# a string made only of digits, '-', '.', ' ' and 'e' is parsed as a number or as an array of numbers.
+_numeric_string = re.compile(r"[-. e]*\d[-. e\d]*\Z")
+
+
 def indians_file_parser(s, sh=None):
     """
     An here-called indians file is a string obtained from a sequence of rows from a Bruker parameter file
@@ -40,26 +55,25 @@ def indians_file_parser(s, sh=None):
         s = s[1:-1]  # removes initial and final ( )
         a = ["(" + v + ")" for v in s.split(") (")]
     # B
-    elif (
-        s.replace("-", "").replace(".", "").replace(" ", "").replace("e", "").isdigit()
-    ):
+    elif _numeric_string.match(s):
         if " " in s:
-            a = np.array([float(x) for x in s.split()])
+            # bulk conversion, much faster than float() element by element for long arrays.
+            a = np.array(s.split(), dtype=np.float64)
             if sh is not None:
                 a = a.reshape(sh)
         else:
             a = float(s)
     # B-bis
     elif "inf" in s:
-        if "inf" == unique_words_in_string(s):
-            num_occurrences = sum("inf" == word for word in s.split())
-            a = [np.inf] * num_occurrences
+        words = s.split()
+        if words[0] == "inf":
+            a = [np.inf] * words.count("inf")
         else:
             a = s[:]
     # C
     elif ("<" in s) and (">" in s):
         s = s[1:-1]  # removes initial and final < >
-        a = [v for v in s.split("> <")]
+        a = s.split("> <")
     # D
     else:
         a = s[:]
@@ -96,165 +110,142 @@ def from_dict_to_txt_sorted(dict_input, pfi_output):
         f.writelines("{0} = {1} \n".format(k, dict_input[k]) for k in sorted_keys)
 
 
-def bruker_read_files(param_file, data_path, sub_scan_num="1"):
+def get_param_file_path(param_file, data_path, sub_scan_num="1"):
     """
-    Reads parameters files of from Bruker raw data imaging format.
-    It parses the files 'acqp', 'method', 'reco', 'visu_pars' and 'subject'.
-    Even if only 'visu_pars' is relevant for the conversion to nifti, having a more general parser has turned out
-    to be useful in many cases (e.g. in PV5.1 to check).
+    Path to a parameter file of a Bruker scan.
     :param param_file: file parameter, must be a string in the list ['acqp', 'method', 'reco', 'visu_pars', 'subject'].
     :param data_path: path to data.
     :param sub_scan_num: number of the sub-scan folder where usually the 'reco' and 'visu_pars' parameter files
     are stored.
-    :return: dict_info dictionary with the parsed information from the input file.
+    :return: path to the parameter file, or None if it does not exist.
     """
-    if param_file.lower() == "reco":
-        if os.path.exists(jph(data_path, "pdata", str(sub_scan_num), "reco")):
-            f = open(jph(data_path, "pdata", str(sub_scan_num), "reco"), "r")
-        else:
-            print(
-                "File {} does not exist".format(
-                    jph(data_path, "pdata", str(sub_scan_num), "reco")
-                )
-            )
-            return {}
-    elif param_file.lower() == "acqp":
-        if os.path.exists(jph(data_path, "acqp")):
-            f = open(jph(data_path, "acqp"), "r")
-        else:
-            print("File {} does not exist".format(jph(data_path, "acqp")))
-            return {}
-    elif param_file.lower() == "method":
-        if os.path.exists(jph(data_path, "method")):
-            f = open(jph(data_path, "method"), "r")
-        else:
-            print("File {} does not exist".format(jph(data_path, "method")))
-            return {}
+    if param_file.lower() in ["acqp", "method", "subject"]:
+        candidates = [jph(data_path, param_file.lower())]
+    elif param_file.lower() == "reco":
+        candidates = [jph(data_path, "pdata", str(sub_scan_num), "reco")]
     elif param_file.lower() == "visu_pars":
-        if os.path.exists(jph(data_path, "pdata", str(sub_scan_num), "visu_pars")):
-            f = open(jph(data_path, "pdata", str(sub_scan_num), "visu_pars"), "r")
-        elif os.path.exists(
-            jph(data_path, str(sub_scan_num), "pdata", "1", "visu_pars")
-        ):
-            f = open(jph(data_path, str(sub_scan_num), "pdata", "1", "visu_pars"), "r")
-        else:
-            print(
-                "File {} does not exist".format(
-                    jph(data_path, "pdata", str(sub_scan_num), "visu_pars")
-                )
-            )
-            return {}
-    elif param_file.lower() == "subject":
-        if os.path.exists(jph(data_path, "subject")):
-            f = open(jph(data_path, "subject"), "r")
-        else:
-            print("File {} does not exist".format(jph(data_path, "subject")))
-            return {}
+        candidates = [
+            jph(data_path, "pdata", str(sub_scan_num), "visu_pars"),
+            jph(data_path, str(sub_scan_num), "pdata", "1", "visu_pars"),
+        ]
     else:
         raise IOError(
             "param_file input must be the string 'reco', 'acqp', 'method', 'visu_pars' or 'subject'"
         )
 
-    dict_info = {}
-    lines = f.readlines()
-
-    for line_num in range(len(lines)):
-        """
-        Relevant information are in the lines with '##'.
-        For the parameters that have arrays values specified between (), with values in the next line.
-        Values in the next line can be parsed in lists or np.ndarray when they contains also characters or numbers.
-        """
-
-        line_in = lines[line_num]
+    for pfi_param_file in candidates:
+        if os.path.exists(pfi_param_file):
+            return pfi_param_file
 
-        if "##" in line_in:
-
-            if ("$" in line_in) and ("(" in line_in) and ("<" not in line_in):
-                # A:
-                splitted_line = line_in.split("=")
-                # name of the variable contained in the row, and shape:
-                var_name = var_name_clean(splitted_line[0][3:])
-
-                done = False
-                indian_file = ""
-                pos = line_num
-                sh = splitted_line[1]
-                # this is not the shape of the vector but the beginning of a full vector.
-                if sh.replace(" ", "").endswith(",\n"):
-                    sh = sh.replace("(", "").replace(")", "").replace("\n", "").strip()
-                    indian_file += sh
-                    sh = None
-                # this is not the shape of the vector but a full vector.
-                elif sh.replace(" ", "").endswith(")\n") and "." in sh:
-                    sh = sh.replace("(", "").replace(")", "").replace("\n", "").strip()
-                    indian_file += sh
-                    sh = None
-                # this is finally the shape of the vector that will start in the next line.
-                else:
-                    sh = sh.replace("(", "").replace(")", "").replace("\n", "").strip()
-                    sh = [int(num) for num in sh.split(",")]
+    print("File {} does not exist".format(candidates[0]))
+    return None
 
-                while not done:
 
-                    pos += 1
-                    # collect the indian file: info related to the same variables that can appears on multiple rows.
-                    line_to_explore = lines[
-                        pos
-                    ]  # tell seek does not work in the line iterators...
+def bruker_read_files(param_file, data_path, sub_scan_num="1", keys=None):
+    """
+    Reads parameters files of from Bruker raw data imaging format.
+    It parses the files 'acqp', 'method', 'reco', 'visu_pars' and 'subject'.
+    Even if only 'visu_pars' is relevant for the conversion to nifti, having a more general parser has turned out
+    to be useful in many cases (e.g. in PV5.1 to check).
+    :param param_file: file parameter, must be a string in the list ['acqp', 'method', 'reco', 'visu_pars', 'subject'].
+    :param data_path: path to data.
+    :param sub_scan_num: number of the sub-scan folder where usually the 'reco' and 'visu_pars' parameter files
+    are stored.
+    :param keys: [None] if a list of variable names, only these are parsed and returned: the file is read only up to
+    the last of them (see bruker_param_lines_parser).
+    :return: dict_info dictionary with the parsed information from the input file.
+    """
+    pfi_param_file = get_param_file_path(param_file, data_path, sub_scan_num)
+    if pfi_param_file is None:
+        return {}
 
-                    if ("##" in line_to_explore) or ("$$" in line_to_explore):
-                        # indian file is over
-                        done = True
+    return param_files_cache.read(pfi_param_file, keys=keys)
 
-                    else:
-                        # we store the rows in the indian file all in the same string.
-                        indian_file += line_to_explore.replace("\n", "").strip() + " "
 
-                dict_info[var_name] = indians_file_parser(indian_file, sh)
+def bruker_param_lines_parser(lines, keys=None):
+    """
+    Parses the lines of a Bruker parameter file (JCAMP-DX format) in a single pass.
+    Relevant information are in the lines with '##'.
+    For the parameters that have arrays values specified between (), with values in the next lines.
+    Values in the next lines can be parsed in lists or np.ndarray when they contains also characters or numbers:
+    they are collected until the next line with '##' or '$$', and then parsed by indians_file_parser.
+    :param lines: iterable over the lines of the file, each one ending with its newline (e.g. an open file).
+    :param keys: [None] if a list of variable names, the values of the other variables are skipped without being
+    parsed, and the reading stops as soon as all the keys are found.
+    :return: dict_info dictionary with the parsed information.
+    """
+    dict_info = {}
+    # [variable name, list of the rows of its indian file or None if skipped, shape] of a value spanning the
+    # following lines.
+    pending = None
+
+    for line_in in lines:
+
+        if pending is not None:
+            if ("##" not in line_in) and ("$$" not in line_in):
+                # we store the rows in the indian file all in the same string.
+                if pending[1] is not None:
+                    pending[1].append(line_in.strip() + " ")
+                continue
+            # indian file is over
+            var_name, indian_file, sh = pending
+            if indian_file is not None:
+                dict_info[var_name] = indians_file_parser("".join(indian_file), sh)
+            pending = None
+
+        if "##" not in line_in:
+            # line does not contain any 'assignable' variable, so this information is not included in the info.
+            continue
+
+        if keys is not None and all(k in dict_info for k in keys):
+            break
+
+        if ("$" in line_in) and ("(" in line_in) and ("<" not in line_in):
+            # A:
+            splitted_line = line_in.split("=")
+            # name of the variable contained in the row, and shape:
+            var_name = var_name_clean(splitted_line[0][3:])
+            if keys is not None and var_name not in keys:
+                pending = [var_name, None, None]
+                continue
+            sh = splitted_line[1]
+            is_vector = sh.replace(" ", "").endswith(",\n") or (
+                sh.replace(" ", "").endswith(")\n") and "." in sh
+            )
+            sh = sh.replace("(", "").replace(")", "").replace("\n", "").strip()
+            if is_vector:
+                # this is not the shape of the vector but the beginning of a full vector, or a full vector.
+                pending = [var_name, [sh], None]
+            else:
+                # this is finally the shape of the vector that will start in the next line.
+                pending = [var_name, [], [int(num) for num in sh.split(",")]]
+
+        elif ("$" not in line_in) and ("(" in line_in):
+            # C:
+            splitted_line = line_in.split("=")
+            var_name = var_name_clean(splitted_line[0][2:])
+            if keys is not None and var_name not in keys:
+                pending = [var_name, None, None]
+            else:
+                pending = [var_name, [splitted_line[1].strip() + " "], None]
 
-            elif ("$" in line_in) and ("(" not in line_in):
-                # B:
-                splitted_line = line_in.split("=")
+        else:
+            splitted_line = line_in.split("=")
+            if ("$" in line_in) and ("(" not in line_in):
                 var_name = var_name_clean(splitted_line[0][3:])
-                indian_file = splitted_line[1]
-
-                dict_info[var_name] = indians_file_parser(indian_file)
-
-            elif ("$" not in line_in) and ("(" in line_in):
-                # C:
-                splitted_line = line_in.split("=")
-                var_name = var_name_clean(splitted_line[0][2:])
-
-                done = False
-                indian_file = splitted_line[1].strip() + " "
-                pos = line_num
-
-                while not done:
-                    pos += 1
-                    # collect the indian file: info related to the same variables that can appears on multiple rows.
-                    line_to_explore = lines[
-                        pos
-                    ]  # tell seek does not work in the line iterators...
-                    if ("##" in line_to_explore) or ("$$" in line_to_explore):
-                        # indian file is over
-                        done = True
-                    else:
-                        # we store the rows in the indian file all in the same string.
-                        indian_file += line_to_explore.replace("\n", "").strip() + " "
-
-                dict_info[var_name] = indians_file_parser(indian_file)
+            else:
+                var_name = var_name_clean(splitted_line[0])
+            if keys is not None and var_name not in keys:
+                continue
 
+            if ("$" in line_in) and ("(" not in line_in):
+                # B:
+                dict_info[var_name] = indians_file_parser(splitted_line[1])
             elif ("$" not in line_in) and ("(" not in line_in):
                 # D:
-                splitted_line = line_in.split("=")
-                var_name = var_name_clean(splitted_line[0])
-                indian_file = splitted_line[1].replace("=", "").strip()
-                dict_info[var_name] = indians_file_parser(indian_file)
-
+                dict_info[var_name] = indians_file_parser(splitted_line[1].strip())
             else:
                 # General case: take it as a simple string.
-                splitted_line = line_in.split("=")
-                var_name = var_name_clean(splitted_line[0])
                 dict_info[var_name] = (
                     splitted_line[1]
                     .replace("(", "")
@@ -266,13 +257,104 @@ def bruker_read_files(param_file, data_path, sub_scan_num="1"):
                     .strip()
                 )
 
-        else:
-            # line does not contain any 'assignable' variable, so this information is not included in the info.
-            pass
+    if pending is not None and pending[1] is not None:
+        var_name, indian_file, sh = pending
+        dict_info[var_name] = indians_file_parser("".join(indian_file), sh)
 
     return dict_info
 
 
+class ParamFilesCache(object):
+    """
+    Process-wide least recently used cache of the parsed Bruker parameter files, used by bruker_read_files.
+    An entry is valid as long as the modification time and the size of its file are unchanged, so that
+    repeated explorations and conversions of the same study parse each parameter file only once.
+    Each call returns its own deep copy of the parsed dictionary: modifying it does not alter the cache.
+    Files read only partially, for a selection of keys, are not stored.
+    """
+
+    def __init__(self, maxsize=256):
+        """
+        :param maxsize: [256] maximal number of parsed files kept in memory. If 0, the cache is disabled.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def read(self, pfi_param_file, keys=None):
+        """
+        :param pfi_param_file: path to a parameter file.
+        :param keys: [None] if a list of variable names, only these are returned. If the file is not in the cache,
+        it is parsed only up to the last of them.
+        :return: dictionary with the parsed information from the file, from the cache if up to date.
+        """
+        pfi_param_file = os.path.abspath(pfi_param_file)
+        stat = os.stat(pfi_param_file)
+        signature = (stat.st_mtime, stat.st_size)
+
+        with self._lock:
+            entry = self._entries.pop(pfi_param_file, None)
+            if entry is not None and entry[0] == signature:
+                self.hits += 1
+                # most recently used are at the end
+                self._entries[pfi_param_file] = entry
+                if keys is not None:
+                    return {
+                        k: copy.deepcopy(v) for k, v in entry[1].items() if k in keys
+                    }
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+
+        with open(pfi_param_file, "r") as f:
+            dict_info = bruker_param_lines_parser(f, keys=keys)
+
+        if self.maxsize > 0 and keys is None:
+            with self._lock:
+                self._entries[pfi_param_file] = (signature, copy.deepcopy(dict_info))
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+        return dict_info
+
+    def invalidate(self, pfi_param_file=None):
+        """
+        :param pfi_param_file: [None] path to a parameter file whose entry is removed. If None all the entries are.
+        :return: [None]
+        """
+        with self._lock:
+            if pfi_param_file is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(pfi_param_file), None)
+
+    def clear(self):
+        """
+        Remove all the entries and reset the hits and misses counters.
+        :return: [None]
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """
+        :return: dictionary with the number of hits, misses, current size and maximal size of the cache.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+
+param_files_cache = ParamFilesCache()
+
+
 # --- Slope correction utils ---
 
 
@@ -296,6 +378,136 @@ def eliminate_consecutive_duplicates(input_list):
         return output_list
 
 
+def get_broadcastable_factors(factors, data_shape, kind="slope"):
+    """
+    Reshape the slope or the offset, as parsed from the data structure, so that it can be applied to data of the
+    given shape with numpy broadcasting (see data_corrector for the cases covered).
+    :param factors: can be the slope or the offset as parsed from the data structure
+    :param data_shape: shape of the data the factors will be applied to.
+    :param kind: is a string that can be 'slope' (multiplicative factor) or 'offset' additive factor.
+    :return: np.ndarray of factors broadcastable against data_shape, or None if the factors have some inf values and
+    can not be applied.
+    """
+    assert kind in ("slope", "offset")
+
+    if hasattr(factors, "__contains__"):
+        if np.inf in factors:
+            warnings.warn(
+                "bruker2nifti - Vector corresponding to {} has some inf values. Can not correct it.".format(
+                    kind
+                ),
+                UserWarning,
+            )
+            return None
+
+    if isinstance(factors, int) or isinstance(factors, float):
+        # scalar slope/offset
+        return np.array(factors, dtype=np.float64)
+
+    factors = np.asarray(factors, dtype=np.float64)
+
+    # Check compatibility slope and data and if necessarily correct for possible consecutive duplicates
+    # (as in some cases, when the size of the slope is larger than any timepoint or spatial point, the problem can
+    # be in the fact that there are duplicates in the slope vector. This has been seein only in PV5.1).
+    if factors.ndim == 1:
+        if not factors.size == data_shape[-1] and not factors.size == data_shape[-2]:
+            factors = np.array(
+                eliminate_consecutive_duplicates(list(factors)), dtype=np.float64
+            )
+            if (
+                not factors.size == data_shape[-1]
+                and not factors.size == data_shape[-2]
+            ):
+                msg = "Slope shape {0} and data shape {1} appears to be not compatible".format(
+                    factors.shape, data_shape
+                )
+                raise IOError(msg)
+
+    if factors.size == 1:
+        # scalar slope/offset embedded in a singleton
+        return factors.reshape(())
+
+    ndim = len(data_shape)
+
+    if ndim == 3 and factors.ndim == 1:
+        # each slice of the 3d image is multiplied an element of the slope consecutively
+        if not data_shape[2] == factors.shape[0]:
+            raise IOError(
+                "Shape of the 2d image and slope dimensions are not consistent"
+            )
+        axis = 2
+    elif ndim == 4 and factors.ndim == 1 and factors.shape[0] == data_shape[2]:
+        # each slice of the 4d image, taken from the third dim, is multiplied by each element of the slope in sequence.
+        axis = 2
+    elif ndim == 5 and factors.ndim == 1 and factors.shape[0] == data_shape[3]:
+        # each slice of the 5d image, taken from the fourth dim, is multiplied by each element of the slope in sequence.
+        axis = 3
+    elif factors.size == data_shape[-1]:
+        # each slice of the nd image, taken from the last dimension, is multiplied by each element of the slope.
+        axis = ndim - 1
+    else:
+        msg = "Slope shape {0} and data shape {1} appears to be not compatible".format(
+            factors.shape, data_shape
+        )
+        raise IOError(msg)
+
+    broadcast_shape = [1] * ndim
+    broadcast_shape[axis] = factors.size
+    return factors.reshape(broadcast_shape)
+
+
+def get_uniform_scaling(slope=None, offset=None):
+    """
+    :param slope: [None] slope broadcastable against the data (see get_broadcastable_factors), None if not corrected.
+    :param offset: [None] offset broadcastable against the data, None if not corrected.
+    :return: tuple (slope, offset) of floats, if the slope and the offset are the same for all the data, so that they
+    can be stored in the scl_slope and scl_inter fields of a nifti header. None otherwise.
+    """
+    scaling = []
+    for factors, default in [(slope, 1.0), (offset, 0.0)]:
+        if factors is None:
+            scaling.append(default)
+            continue
+        factors = np.asarray(factors)
+        if not np.all(factors == factors.flat[0]):
+            return None
+        scaling.append(float(factors.flat[0]))
+    # a null scl_slope means no scaling for the nifti readers.
+    if scaling[0] == 0:
+        return None
+    return tuple(scaling)
+
+
+def get_lossless_dtype(data_dtype, slope=None, offset=None, default_dtype=np.float64):
+    """
+    :param data_dtype: datatype of the data to be corrected.
+    :param slope: [None] slope broadcastable against the data (see get_broadcastable_factors), None if not corrected.
+    :param offset: [None] offset broadcastable against the data, None if not corrected.
+    :param default_dtype: [np.float64] datatype returned if no integer datatype fits.
+    :return: smallest integer datatype holding exactly data * slope + offset for any value of data_dtype. It exists if
+    the data are integers and the slope and the offset are integer valued, default_dtype otherwise.
+    """
+    data_dtype = np.dtype(data_dtype)
+    if data_dtype.kind not in "iu":
+        return np.dtype(default_dtype)
+    for factors in [slope, offset]:
+        if factors is not None and not np.all(np.mod(factors, 1) == 0):
+            return np.dtype(default_dtype)
+
+    # the extremes of data * slope + offset are reached at the extremes of the data.
+    slope = np.float64(1) if slope is None else np.asarray(slope, dtype=np.float64)
+    offset = np.float64(0) if offset is None else np.asarray(offset, dtype=np.float64)
+    extremes = []
+    for value in [np.iinfo(data_dtype).min, np.iinfo(data_dtype).max]:
+        extremes += [np.min(value * slope + offset), np.max(value * slope + offset)]
+
+    for dtype in ["int8", "uint8", "int16", "uint16", "int32", "uint32", "int64"]:
+        info = np.iinfo(dtype)
+        if info.min <= min(extremes) and max(extremes) <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(default_dtype)
+
+
 def data_corrector(
     data, factors, kind="slope", num_initial_dir_to_skip=None, dtype=np.float64
 ):
@@ -318,7 +530,8 @@ def data_corrector(
     :param dtype: [np.float64] output datatype.
     :return: data after the slope/offset correction.
     ---
-    NOTE 1: if used in sequence to correct for slope and offset, correct FIRST slope, then OFFSET.
+    NOTE 1: if used in sequence to correct for slope and offset, correct FIRST slope, then OFFSET, or use
+    data_slope_offset_corrector to correct both in a single pass.
     NOTE 2: when read 'factor' think slope or offset. The two are embeded in the same method to avoid code repetition.
     """
 
@@ -330,121 +543,64 @@ def data_corrector(
         )
     assert kind in ("slope", "offset")
 
-    if hasattr(factors, "__contains__"):
-        if np.inf in factors:
-            warnings.warn(
-                "bruker2nifti - Vector corresponding to {} has some inf values. Can not correct it.".format(
-                    kind
-                ),
-                UserWarning,
-            )
-            return data
-
-    data = data.astype(dtype)
-
     if num_initial_dir_to_skip is not None:
         factors = factors[num_initial_dir_to_skip:]
         data = data[..., num_initial_dir_to_skip:]
 
-    # Check compatibility slope and data and if necessarily correct for possible consecutive duplicates
-    # (as in some cases, when the size of the slope is larger than any timepoint or spatial point, the problem can
-    # be in the fact that there are duplicates in the slope vector. This has been seein only in PV5.1).
-    if not (isinstance(factors, int) or isinstance(factors, float)):
-        if factors.ndim == 1:
-            if (
-                not factors.size == data.shape[-1]
-                and not factors.size == data.shape[-2]
-            ):
-                factors = np.array(
-                    eliminate_consecutive_duplicates(list(factors)), dtype=np.float64
-                )
-                if (
-                    not factors.size == data.shape[-1]
-                    and not factors.size == data.shape[-2]
-                ):
-                    msg = "Slope shape {0} and data shape {1} appears to be not compatible".format(
-                        factors.shape, data.shape
-                    )
-                    raise IOError(msg)
+    if kind == "slope":
+        return data_slope_offset_corrector(data, slope=factors, dtype=dtype)
+    else:
+        return data_slope_offset_corrector(data, offset=factors, dtype=dtype)
 
-    if isinstance(factors, int) or isinstance(factors, float):
-        # scalar slope/offset times nd array data
-        if kind == "slope":
-            data *= factors
-        elif kind == "offset":
-            data += factors
-
-    elif factors.size == 1:
-        # scalar slope/offset embedded in a singleton times nd array data
-        if kind == "slope":
-            data *= factors[0]
-        else:
-            data += factors[0]
 
-    elif len(data.shape) == 3 and len(factors.shape) == 1:
-        # each slice of the 3d image is multiplied an element of the slope consecutively
-        if data.shape[2] == factors.shape[0]:
-            for t, fa in enumerate(factors):
-                if kind == "slope":
-                    data[..., t] = data[..., t] * fa
-                elif kind == "offset":
-                    data[..., t] = data[..., t] + fa
-        else:
-            raise IOError(
-                "Shape of the 2d image and slope dimensions are not consistent"
-            )
+def data_slope_offset_corrector(data, slope=None, offset=None, dtype=np.float64):
+    """
+    Correct the data for the slope and then for the offset in a single pass over the data, with broadcasting:
 
-    elif (
-        len(data.shape) == 4
-        and len(factors.shape) == 1
-        and factors.shape[0] == data.shape[2]
-    ):
-        # each slice of the 4d image, taken from the third dim, is multiplied by each element of the slope in sequence.
-        if factors.size == data.shape[2]:
-            for t in range(data.shape[3]):
-                for k in range(factors.size):
-                    if kind == "slope":
-                        data[..., k, t] = data[..., k, t] * factors[k]
-                    elif kind == "offset":
-                        data[..., k, t] = data[..., k, t] + factors[k]
-        else:
-            raise IOError(
-                "If you are here, your case cannot be converted. Further investigations required."
-            )
+    corrected_data = data * slope + offset
 
-    elif (
-        len(data.shape) == 5
-        and len(factors.shape) == 1
-        and factors.shape[0] == data.shape[3]
-    ):
-        # each slice of the 5d image, taken from the fourth dim, is multiplied by each element of the slope in sequence.
-        if factors.size == data.shape[3]:
-            for t in range(data.shape[4]):
-                for k in range(factors.size):
-                    if kind == "slope":
-                        data[..., k, t] = data[..., k, t] * factors[k]
-                    elif kind == "offset":
-                        data[..., k, t] = data[..., k, t] + factors[k]
-        else:
-            raise IOError(
-                "If you are here, your case cannot be converted. Further investigations required."
+    A single output array of the required dtype is allocated, and the offset is added in place.
+    :param data: data as parsed from the data structure, up to 5d.
+    :param slope: [None] slope as parsed from the data structure. If None the slope is not corrected.
+    :param offset: [None] offset as parsed from the data structure. If None the offset is not corrected.
+    :param dtype: [np.float64] output datatype, np.float32 halves the memory footprint of the output.
+    :return: data after the slope/offset correction. Input data are returned as they are if there is nothing to
+    correct (see get_broadcastable_factors for inf values).
+    """
+    if len(data.shape) > 5:
+        raise IOError(
+            "4d or lower dimensional images allowed. Input data has shape {} ".format(
+                data.shape
             )
+        )
+
+    if slope is not None:
+        slope = get_broadcastable_factors(slope, data.shape, kind="slope")
+    if offset is not None:
+        offset = get_broadcastable_factors(offset, data.shape, kind="offset")
+
+    if slope is None and offset is None:
+        return data
+
+    return _apply_slope_offset(data, slope, offset, dtype)
+
+
+def _apply_slope_offset(data, slope, offset, dtype):
+    """
+    data * slope + offset with a single allocation. slope and offset must be None or broadcastable against data.
+    """
+    # subok=False: data can be memory-mapped, the output lives in memory.
+    corrected_data = np.empty_like(data, dtype=dtype, subok=False)
 
+    if slope is not None:
+        np.multiply(data, slope, out=corrected_data, casting="unsafe")
     else:
-        # each slice of the nd image, taken from the last dimension, is multiplied by each element of the slope.
-        if factors.size == data.shape[-1]:
-            for t in range(data.shape[-1]):
-                if kind == "slope":
-                    data[..., t] = data[..., t] * factors[t]
-                elif kind == "offset":
-                    data[..., t] = data[..., t] + factors[t]
-        else:
-            msg = "Slope shape {0} and data shape {1} appears to be not compatible".format(
-                factors.shape, data.shape
-            )
-            raise IOError(msg)
+        corrected_data[...] = data
 
-    return data
+    if offset is not None:
+        np.add(corrected_data, offset, out=corrected_data, casting="unsafe")
+
+    return corrected_data
 
 
 # -- nifti affine matrix utils --
@@ -750,6 +906,547 @@ def set_new_data(image, new_data, new_dtype=None, remove_nan=True):
     return new_image
 
 
+def extract_volumes(image, volumes, mean=False, dtype=np.float64):
+    """
+    Volumes of a 4d image (e.g. the b0 of a DWI), read by slicing its data object: only the frames of these volumes
+    are read from the memory mapped 2dseq, and corrected if the data object is a CorrectedArrayProxy.
+    :param image: 4d nibabel image.
+    :param volumes: index, or list of indexes, of the volumes along the last axis.
+    :param mean: [False] if True the mean of the volumes is returned, accumulated one volume at a time.
+    :param dtype: [np.float64] datatype of the output data, with the scaling of the header applied.
+    :return: nibabel image with the header of the input image, 3d if volumes is an index or if mean is True.
+    """
+    if np.ndim(volumes) == 0:
+        data = _read_volume(image, int(volumes), dtype)
+    elif mean:
+        data = np.zeros(image.shape[:-1], dtype=np.float64)
+        for v in volumes:
+            data += _read_volume(image, v, np.float64)
+        data = (data / len(volumes)).astype(dtype, copy=False)
+    else:
+        data = np.stack([_read_volume(image, v, dtype) for v in volumes], axis=-1)
+
+    return set_new_data(image, data)
+
+
+def _read_volume(image, volume, dtype):
+    data = np.array(image.dataobj[..., volume], dtype=dtype)
+    slope, inter = image.header.get_slope_inter()
+    if slope is not None:
+        data *= slope
+    if inter is not None:
+        data += inter
+    return data
+
+
+class CorrectedArrayProxy(object):
+    """
+    Slope and offset correction applied lazily to a (memory-mapped) array.
+    It follows the nibabel array proxy protocol, so it can be the data object of a nibabel image:
+    slicing it corrects only the sliced data, np.asarray(proxy) corrects the whole array in a single allocation.
+    reshape and transpose are applied to the raw data and to the factors, with no correction (nor copy) involved.
+    """
+
+    is_proxy = True
+
+    def __init__(self, raw_data, slope=None, offset=None, dtype=np.float64):
+        """
+        :param raw_data: data as parsed from the data structure (e.g. np.memmap of the 2dseq).
+        :param slope: [None] slope broadcastable against raw_data (see get_broadcastable_factors).
+        :param offset: [None] offset broadcastable against raw_data (see get_broadcastable_factors).
+        :param dtype: [np.float64] datatype of the corrected data.
+        """
+        self._raw_data = raw_data
+        # factors are broadcast (with no copy) to the data shape, to be reshaped, transposed and sliced as the data.
+        if slope is not None:
+            slope = np.broadcast_to(slope, raw_data.shape)
+        if offset is not None:
+            offset = np.broadcast_to(offset, raw_data.shape)
+        self._slope = slope
+        self._offset = offset
+        self._dtype = np.dtype(dtype)
+
+    @property
+    def shape(self):
+        return self._raw_data.shape
+
+    @property
+    def ndim(self):
+        return self._raw_data.ndim
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def raw_data(self):
+        return self._raw_data
+
+    def _new_proxy(self, function):
+        new_proxy = CorrectedArrayProxy(function(self._raw_data), dtype=self._dtype)
+        if self._slope is not None:
+            new_proxy._slope = function(self._slope)
+        if self._offset is not None:
+            new_proxy._offset = function(self._offset)
+        return new_proxy
+
+    def reshape(self, shape, order="C"):
+        return self._new_proxy(lambda a: a.reshape(shape, order=order))
+
+    def transpose(self, *axes):
+        return self._new_proxy(lambda a: a.transpose(*axes))
+
+    def __getitem__(self, slicer):
+        return _apply_slope_offset(
+            self._raw_data[slicer],
+            None if self._slope is None else self._slope[slicer],
+            None if self._offset is None else self._offset[slicer],
+            self._dtype,
+        )
+
+    def __array__(self, dtype=None):
+        corrected_data = self[...]
+        if dtype is not None:
+            corrected_data = corrected_data.astype(dtype, copy=False)
+        return corrected_data
+
+
+def memmap_file_region(array):
+    """
+    :param array: numpy array.
+    :return: tuple (path to file, offset) with the file an array is memory-mapped from, and the position in bytes of
+    its first element, if the bytes of the array are stored in the file as they are in the Fortran (nifti) order.
+    None if the array is not memory-mapped or not Fortran contiguous (e.g. after a re-ordering of its axes).
+    """
+    if not isinstance(array, np.memmap) or array.filename is None:
+        return None
+    if not array.flags.f_contiguous:
+        return None
+    # views of a memory-mapped array share the file: the offset of the view is relative to the first mapped array.
+    mapped_array = array
+    while isinstance(mapped_array.base, np.ndarray):
+        mapped_array = mapped_array.base
+    offset = (
+        mapped_array.offset
+        + array.__array_interface__["data"][0]
+        - mapped_array.__array_interface__["data"][0]
+    )
+    return array.filename, offset
+
+
+def copy_file_region(pfi_input, fileobj, offset, nbytes, block_size=1024 ** 2):
+    """
+    Copy nbytes bytes of a file, starting at offset, to the current position of an open output file.
+    Regular output files are written by the kernel (os.copy_file_range, or os.sendfile) with no data passing through
+    python, where available. Other outputs (e.g. gzip files) are written block by block.
+    :param pfi_input: path to the input file.
+    :param fileobj: output file object, open for writing.
+    :param offset: position in bytes of the first byte copied from the input file.
+    :param nbytes: number of bytes copied.
+    :param block_size: [1MB] size of the blocks held in memory when copied by python.
+    :return: [None] copy the bytes.
+    """
+    with open(pfi_input, "rb") as f_in:
+        copied = 0
+        if isinstance(fileobj, io.BufferedWriter):
+            fileobj.flush()
+            start = fileobj.tell()
+            copied = _kernel_copy(f_in.fileno(), fileobj.fileno(), offset, nbytes)
+            fileobj.seek(start + copied)
+
+        f_in.seek(offset + copied)
+        while copied < nbytes:
+            block = f_in.read(min(block_size, nbytes - copied))
+            if not block:
+                raise IOError("File {} ends before the data.".format(pfi_input))
+            fileobj.write(block)
+            copied += len(block)
+
+
+def _kernel_copy(fd_in, fd_out, offset, nbytes):
+    """
+    :return: number of bytes copied from the input at offset to the current position of the output, by the kernel.
+    Less than nbytes (possibly 0) if the copy is not supported (e.g. os.sendfile to a file on macOS, old python or
+    kernel), or if the input ends before.
+    """
+    copied = 0
+    for name in ["copy_file_range", "sendfile"]:
+        if not hasattr(os, name):
+            continue
+        try:
+            while copied < nbytes:
+                if name == "copy_file_range":
+                    count = os.copy_file_range(
+                        fd_in, fd_out, nbytes - copied, offset + copied
+                    )
+                else:
+                    count = os.sendfile(fd_out, fd_in, offset + copied, nbytes - copied)
+                if count == 0:
+                    return copied
+                copied += count
+            return copied
+        except OSError:
+            continue
+    return copied
+
+
+def fortran_slabs(shape, max_elements):
+    """
+    Split an array of the given shape into consecutive slabs, according to the Fortran (nifti) order, each with at
+    most max_elements elements (or a single 1d row along the first axis, if longer).
+    Concatenating the Fortran-ordered bytes of the slabs, in the given sequence, gives the Fortran-ordered bytes of
+    the whole array.
+    :param shape: shape of the array.
+    :param max_elements: maximal number of elements in each slab.
+    :return: generator of tuples to slice the array.
+    """
+    shape = [int(d) for d in shape]
+    # leading axes entirely included in each slab:
+    num_full_axes = 0
+    block_size = 1
+    while (
+        num_full_axes < len(shape) and block_size * shape[num_full_axes] <= max_elements
+    ):
+        block_size *= shape[num_full_axes]
+        num_full_axes += 1
+
+    if num_full_axes == len(shape):
+        yield (Ellipsis,)
+        return
+
+    step = max(1, max_elements // block_size)
+    head = (slice(None),) * num_full_axes
+    tail_shape = shape[num_full_axes + 1 :]
+    # np.ndindex moves the last index first: reversed, the first trailing axis moves first, as in Fortran order.
+    for reversed_tail in np.ndindex(*tail_shape[::-1]):
+        tail = tuple(reversed(reversed_tail))
+        for i in range(0, shape[num_full_axes], step):
+            yield head + (slice(i, i + step),) + tail
+
+
+def _deflate_block(block, compression_level, last):
+    """
+    Raw deflate of a block of data, ending on a byte boundary so that it can be concatenated to the next block.
+    """
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    flush_mode = zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    return compressor.compress(block) + compressor.flush(flush_mode)
+
+
+class ParallelGzipFile(object):
+    """
+    Write-only gzip file compressed by a pool of threads, as pigz does: data are split in blocks deflated
+    independently and concatenated in the same deflate stream. The output is a standard gzip file.
+    zlib releases the GIL, so blocks are compressed concurrently. At most 2 * threads blocks are held in memory.
+    """
+
+    def __init__(
+        self, pfi_output, compression_level=1, threads=2, block_size=1024 ** 2
+    ):
+        """
+        :param pfi_output: path to the output .gz file.
+        :param compression_level: [1] gzip compression level, from 0 (no compression) to 9 (smallest output).
+        :param threads: [2] number of threads compressing the blocks.
+        :param block_size: [1MB] size in bytes of the uncompressed blocks.
+        """
+        self.name = pfi_output
+        self.mode = "wb"
+        self._fileobj = open(pfi_output, "wb")
+        self._compression_level = compression_level
+        self._block_size = block_size
+        self._max_pending = 2 * threads
+        self._pool = ThreadPool(threads)
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._crc = 0
+        self._position = 0
+        # gzip header: magic, deflate, no flags, mtime, no extra flags, unknown OS.
+        self._fileobj.write(
+            b"\x1f\x8b\x08\x00"
+            + struct.pack("<I", int(time.time()) & 0xFFFFFFFF)
+            + b"\x00\xff"
+        )
+
+    @property
+    def closed(self):
+        return self._fileobj.closed
+
+    def read(self, *args):
+        raise IOError("ParallelGzipFile is write-only.")
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        if not (whence == 0 and offset == self._position):
+            raise IOError("ParallelGzipFile can not seek.")
+        return self._position
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        while len(self._buffer) >= self._block_size:
+            block = bytes(self._buffer[: self._block_size])
+            del self._buffer[: self._block_size]
+            self._submit(block, last=False)
+        return len(data)
+
+    def _submit(self, block, last):
+        self._crc = zlib.crc32(block, self._crc)
+        self._pending.append(
+            self._pool.apply_async(
+                _deflate_block, (block, self._compression_level, last)
+            )
+        )
+        while len(self._pending) > (0 if last else self._max_pending):
+            self._fileobj.write(self._pending.popleft().get())
+
+    def flush(self):
+        self._fileobj.flush()
+
+    def close(self):
+        if self._fileobj.closed:
+            return
+        try:
+            self._submit(bytes(self._buffer), last=True)
+            self._buffer = bytearray()
+            # gzip trailer: crc32 and size of the uncompressed data.
+            self._fileobj.write(
+                struct.pack("<II", self._crc & 0xFFFFFFFF, self._position & 0xFFFFFFFF)
+            )
+        finally:
+            self._pool.close()
+            self._pool.join()
+            self._fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_nifti_output(pfi_output, compression_level=1, compression_threads=1):
+    """
+    Open for writing the file of a nifti image, compressed if its name ends with .gz.
+    :param pfi_output: path to file of the output image.
+    :param compression_level: [1] gzip compression level, from 0 (no compression) to 9 (smallest output).
+    :param compression_threads: [1] if larger than 1, the image is compressed by this many threads with a
+    ParallelGzipFile.
+    :return: file object.
+    """
+    if not pfi_output.endswith(".gz"):
+        return open(pfi_output, "wb")
+    if compression_threads > 1:
+        return ParallelGzipFile(
+            pfi_output, compression_level=compression_level, threads=compression_threads
+        )
+    return nib.openers.Opener(pfi_output, "wb", compresslevel=compression_level)
+
+
+def save_nifti(
+    image,
+    pfi_output,
+    chunk_size=None,
+    compression_level=1,
+    compression_threads=1,
+    header_only=False,
+):
+    """
+    Save a nibabel nifti image, compressed if pfi_output ends with .gz (see open_nifti_output).
+    If the data object is memory-mapped from a file where its bytes are already as in the nifti (e.g. a 2dseq with no
+    correction, in the byte order of the output), the header is written and the bytes are copied from the file as they
+    are, by the kernel when the output is not compressed (see copy_file_region). The output is the same.
+    Otherwise, if chunk_size is None, data are written by nibabel. If not, the data are streamed to the output, slab
+    after slab (see fortran_slabs), so that at most chunk_size bytes of data are held in memory: if the data object is
+    a memory-mapped array or a CorrectedArrayProxy, only the current slab is read from disk and corrected.
+    :param image: nibabel Nifti1Image or Nifti2Image.
+    :param pfi_output: path to file of the output image.
+    :param chunk_size: [None] maximal size in bytes of the data slabs written to disk.
+    :param compression_level: [1] gzip compression level, from 0 (no compression) to 9 (smallest output).
+    :param compression_threads: [1] number of threads compressing the output.
+    :param header_only: [False] if True only the header is written, and the data are not accessed: the output is a
+    stub with the shape, datatype and geometry of the image, whose header can be loaded by nibabel.
+    :return: [None] save the image.
+    """
+    with open_nifti_output(
+        pfi_output,
+        compression_level=compression_level,
+        compression_threads=compression_threads,
+    ) as fileobj:
+
+        if header_only:
+            image.update_header()
+            hdr = image.header.copy()
+            hdr.set_data_offset(hdr.single_vox_offset)
+            hdr.write_to(fileobj)
+            return
+
+        dataobj = image.dataobj
+        file_region = memmap_file_region(dataobj)
+        if file_region is not None and dataobj.dtype != image.get_data_dtype():
+            file_region = None
+
+        if chunk_size is None and file_region is None:
+            image.to_file_map(image.make_file_map({"image": fileobj}))
+            return
+
+        image.update_header()
+        hdr = image.header.copy()
+        out_dtype = hdr.get_data_dtype()
+        if hdr.get_slope_inter() == (None, None):
+            # as written by nibabel, for data not scaled.
+            hdr.set_slope_inter(1.0, 0.0)
+
+        hdr.write_to(fileobj)
+        nib.volumeutils.seek_tell(fileobj, hdr.get_data_offset(), write0=True)
+
+        if file_region is not None:
+            copy_file_region(file_region[0], fileobj, file_region[1], dataobj.nbytes)
+            return
+
+        max_elements = max(1, int(chunk_size) // out_dtype.itemsize)
+        for slicer in fortran_slabs(dataobj.shape, max_elements):
+            slab = np.asarray(dataobj[slicer]).astype(out_dtype, copy=False)
+            fileobj.write(slab.tobytes(order="F"))
+
+
+# --- Timing utils ---
+
+
+class StageTimer(object):
+    """
+    Records wall time, bytes read and bytes written of each stage of the conversion of a scan (parameter parsing,
+    2dseq reading, slope correction, affine computation, nifti writing...). Stages can be entered many times: the
+    records are accumulated.
+
+    >> timer = StageTimer()
+    >> with timer.stage('write_nifti') as record:
+    >>     ...
+    >>     record['bytes_written'] += os.path.getsize(pfi_output)
+    >> timer.report()
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        :param name: name of the stage.
+        :return: context manager timing the stage, yielding its record where the bytes read and written can be added.
+        Stages can be timed from several threads (see WriteDispatcher): their seconds are then summed.
+        """
+        with self._lock:
+            self.stages.setdefault(
+                name, {"seconds": 0.0, "calls": 0, "bytes_read": 0, "bytes_written": 0}
+            )
+        record = {"bytes_read": 0, "bytes_written": 0}
+        start = default_timer()
+        try:
+            yield record
+        finally:
+            seconds = default_timer() - start
+            with self._lock:
+                total = self.stages[name]
+                total["seconds"] += seconds
+                total["calls"] += 1
+                total["bytes_read"] += record["bytes_read"]
+                total["bytes_written"] += record["bytes_written"]
+
+    def report(self):
+        """
+        :return: ordered dictionary {stage: record}, where each record has the wall time in seconds, the number of
+        calls, the bytes read and written and the throughput in MB/s (None if no byte was read or written).
+        """
+        report = OrderedDict()
+        for name, record in self.stages.items():
+            record = dict(record)
+            bytes_moved = record["bytes_read"] + record["bytes_written"]
+            if bytes_moved > 0 and record["seconds"] > 0:
+                record["mb_per_second"] = bytes_moved / 1024.0 ** 2 / record["seconds"]
+            else:
+                record["mb_per_second"] = None
+            report[name] = record
+        return report
+
+
+class WriteDispatcher(object):
+    """
+    Writes the outputs of a scan with a pool of threads: zlib and the file I/O release the GIL, so that the images
+    of the sub-scans are compressed concurrently. At most 2 * threads writes are pending at once, to bound the memory
+    held by the images waiting to be written. With threads <= 1 each write is done at once, in the calling thread.
+    The error of a write is raised again by the first submit once the write is finished, or when leaving the context
+    manager, the barrier waiting for all the writes.
+
+    >> with WriteDispatcher(threads=4) as dispatcher:
+    >>     dispatcher.submit(save_nifti, nib_im, pfi_output)
+    """
+
+    def __init__(self, threads=1):
+        """
+        :param threads: [1] number of threads writing the outputs.
+        """
+        self._max_pending = 2 * threads
+        self._pool = ThreadPool(threads) if threads > 1 else None
+        self._pending = deque()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        :return: [None] call function(*args, **kwargs) in a thread of the pool.
+        """
+        if self._pool is None:
+            function(*args, **kwargs)
+            return
+        # the writes finished are checked first, so that their errors are raised before any other write.
+        for result in [result for result in self._pending if result.ready()]:
+            self._pending.remove(result)
+            result.get()
+        while len(self._pending) >= self._max_pending:
+            self._pending.popleft().get()
+        self._pending.append(self._pool.apply_async(function, args, kwargs))
+
+    def join(self):
+        """
+        :return: [None] wait for all the writes submitted, raising the first error, and release the threads.
+        """
+        try:
+            while self._pending:
+                self._pending.popleft().get()
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        :return: [None] wait for the writes running, ignoring their errors, and release the threads.
+        """
+        self._pending.clear()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.join()
+        else:
+            self.close()
+
+
+def save_timings(timings, pfi_output):
+    """
+    :param timings: report of a StageTimer, or dictionary {scan: report of a StageTimer}.
+    :param pfi_output: path to the output .json file.
+    :return: [None] save the timings in a json file.
+    """
+    with open(pfi_output, "w") as f:
+        json.dump(timings, f, indent=2)
+
+
 def path_contains_whitespace(*args):
 
     if re.search("\\s+", os.path.join(*args)):
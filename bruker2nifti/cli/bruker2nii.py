@@ -1,9 +1,12 @@
 import argparse
+from collections import OrderedDict
 from datetime import datetime, timedelta
+import os
 import re
 import sys
 
-from bruker2nifti.converter import Bruker2Nifti
+from bruker2nifti.converter import Bruker2Nifti, convert_many
+from bruker2nifti.watcher import StudyWatcher
 import bruker2nifti._utils as utils
 from bruker2nifti._metadata import BrukerMetadata
 
@@ -20,15 +23,19 @@ def main():
     # The action to be taken
     #  'convert': Convert images to nifti format (default)
     #  'list': List scans without converting
+    #  'batch': Convert all the studies found under the input folder
+    #  'watch': Convert the scans arriving in the input folder, until interrupted
     parser.add_argument(
         "command",
         type=str,
         nargs="?",
         default="convert",
-        choices=["convert", "list"],
+        choices=["convert", "list", "batch", "watch"],
         help="Action to take: "
         + "convert - convert to nifti, "
-        + "list - list studies and exit",
+        + "list - list studies and exit, "
+        + "batch - convert all the studies under the input folder, "
+        + "watch - convert the scans as they arrive in the input folder",
     )
 
     # custom helper
@@ -47,7 +54,7 @@ def main():
         dest="pfo_input",
         type=str,
         required=False,
-        help="Bruker study folder.",
+        help="Bruker study folder (root folder of the studies for batch and watch).",
     )
 
     # pfo_study_nifti_output
@@ -94,12 +101,82 @@ def main():
         action="store_true",
     )
 
+    # metadata_format = npy,
+    parser.add_argument(
+        "-metadata_format",
+        dest="metadata_format",
+        type=str,
+        default="npy",
+        choices=["npy", "sidecar"],
+        help="Save the parameters of each scan in a .npy (and .txt) file per "
+        + "parameter file, or in a single .json and .npz sidecar.",
+    )
+
     # correct_slope = False,
     parser.add_argument("-correct_slope", dest="correct_slope", action="store_true")
 
     # correct_offset = False,
     parser.add_argument("-correct_offset", dest="correct_offset", action="store_true")
 
+    # corrected_dtype = float64,
+    parser.add_argument(
+        "-corrected_dtype",
+        dest="corrected_dtype",
+        type=str,
+        default="float64",
+        choices=["float32", "float64"],
+        help="Datatype of the slope/offset corrected images.",
+    )
+
+    # integer_output = False,
+    parser.add_argument(
+        "-integer_output",
+        dest="integer_output",
+        action="store_true",
+        help="Keep the integer data, with a uniform slope/offset "
+        + "in the scl_slope/scl_inter of the nifti header.",
+    )
+
+    # stream_chunk_mb = None,
+    parser.add_argument(
+        "-stream_chunk_mb",
+        dest="stream_chunk_mb",
+        type=float,
+        default=None,
+        help="Stream the images to disk in slabs of at most this size in MB.",
+    )
+
+    # compress_output = True,
+    parser.add_argument("-do_not_compress", dest="do_not_compress", action="store_true")
+
+    # compression_level = 1,
+    parser.add_argument(
+        "-compression_level",
+        dest="compression_level",
+        type=int,
+        default=1,
+        choices=range(10),
+        help="Gzip compression level of the .nii.gz images (1 fast, 9 small).",
+    )
+
+    # compression_threads = 1,
+    parser.add_argument(
+        "-compression_threads",
+        dest="compression_threads",
+        type=int,
+        default=1,
+        help="Number of threads compressing each .nii.gz image.",
+    )
+
+    # write_threads = 1,
+    parser.add_argument(
+        "-write_threads",
+        dest="write_threads",
+        type=int,
+        default=1,
+        help="Number of threads writing the output files of each scan concurrently.",
+    )
+
     # sample_upside_down = True,
     parser.add_argument(
         "-sample_upside_down", dest="sample_upside_down", action="store_true"
@@ -115,6 +192,101 @@ def main():
     # verbose = 1
     parser.add_argument("-verbose", "-v", dest="verbose", type=int, default=1)
 
+    # workers = 1
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="workers",
+        type=int,
+        default=1,
+        help="Number of scans converted in parallel.",
+    )
+
+    # pipeline_memory_mb = None
+    parser.add_argument(
+        "-pipeline_memory_mb",
+        dest="pipeline_memory_mb",
+        type=float,
+        default=None,
+        help="Read the next scans while writing the current one, "
+        + "keeping at most this many MB of images in memory.",
+    )
+
+    # incremental = False
+    parser.add_argument(
+        "-incremental",
+        dest="incremental",
+        action="store_true",
+        help="Resume a previous conversion in the same output folder, "
+        + "converting only the new, changed or failed scans.",
+    )
+
+    # geometry_only = False
+    parser.add_argument(
+        "-geometry_only",
+        dest="geometry_only",
+        action="store_true",
+        help="Do not read the images: save header-only .nii stubs "
+        + "and a .json table with the geometry of each scan.",
+    )
+
+    # index_dir = None
+    parser.add_argument(
+        "-index_dir",
+        dest="index_dir",
+        type=str,
+        default=None,
+        help="Folder of a persistent index of the parsed parameter files, "
+        + "speeding up the listing of studies already seen.",
+    )
+
+    # report = None
+    parser.add_argument(
+        "--report",
+        dest="report",
+        type=str,
+        default=None,
+        help="Batch only: save the report of the conversion in this .json file "
+        + "(default bruker2nifti_batch_report.json in the output folder).",
+    )
+
+    # continue_on_error = False
+    parser.add_argument(
+        "-continue_on_error",
+        dest="continue_on_error",
+        action="store_true",
+        help="Convert only: report the scans that can not be converted, "
+        + "instead of stopping at the first one. Always on for batch and watch.",
+    )
+
+    # poll_interval = 10
+    parser.add_argument(
+        "-poll_interval",
+        dest="poll_interval",
+        type=float,
+        default=10,
+        help="Watch only: seconds between two polls of the input folder.",
+    )
+
+    # stable_time = 60
+    parser.add_argument(
+        "-stable_time",
+        dest="stable_time",
+        type=float,
+        default=60,
+        help="Watch only: seconds a scan has to be unchanged before being converted.",
+    )
+
+    # timings = None
+    parser.add_argument(
+        "--timings",
+        dest="timings",
+        type=str,
+        default=None,
+        help="Save the time spent in each stage of the conversion of each scan "
+        + "in this .json file.",
+    )
+
     # ------ Parsing user's input ------ #
 
     args = parser.parse_args()
@@ -128,7 +300,7 @@ def main():
 
     # Check input:
     if args.command == "list":
-        list_scans(args.pfo_input)
+        list_scans(args.pfo_input, index_dir=args.index_dir)
         sys.exit(0)
 
     if args.what:
@@ -141,6 +313,50 @@ def main():
     if not args.pfo_input or not args.pfo_output:
         sys.exit("Input bruker study [-i] and output folder [-o] required")
 
+    settings = converter_settings(args)
+
+    if args.command == "batch":
+        if args.report is None:
+            args.report = os.path.join(
+                args.pfo_output, "bruker2nifti_batch_report.json"
+            )
+        report = convert_many(
+            args.pfo_input,
+            args.pfo_output,
+            workers=args.workers,
+            settings=settings,
+            pfi_report=args.report,
+        )
+        if args.timings is not None:
+            utils.save_timings(
+                OrderedDict(
+                    (
+                        study,
+                        OrderedDict(
+                            (scan, r["timings"]) for scan, r in result["scans"].items()
+                        ),
+                    )
+                    for study, result in report.items()
+                ),
+                args.timings,
+            )
+        failed = [s for s, result in report.items() if result["status"] == "failed"]
+        if failed:
+            sys.exit("Conversion failed for studies {}".format(failed))
+        sys.exit(0)
+
+    if args.command == "watch":
+        watcher = StudyWatcher(
+            args.pfo_input,
+            args.pfo_output,
+            settings=settings,
+            workers=args.workers,
+            poll_interval=args.poll_interval,
+            stable_time=args.stable_time,
+        )
+        watcher.run()
+        sys.exit(0)
+
     # Instantiate a converter:
     bruconv = Bruker2Nifti(args.pfo_input, args.pfo_output, study_name=args.study_name)
 
@@ -158,17 +374,9 @@ def main():
             bruconv.study_name + "_" + ls for ls in scan_list
         ]
 
-    # Basics
-    bruconv.nifti_version = args.nifti_version
-    bruconv.qform_code = args.qform_code
-    bruconv.sform_code = args.sform_code
-    bruconv.save_human_readable = not args.do_not_save_human_readable
-    bruconv.correct_slope = args.correct_slope
-    bruconv.correct_offset = args.correct_offset
-    bruconv.verbose = args.verbose
-    # Sample position
-    bruconv.sample_upside_down = args.sample_upside_down
-    bruconv.frame_body_as_frame_head = args.frame_body_as_frame_head
+    for attribute, value in settings.items():
+        setattr(bruconv, attribute, value)
+    bruconv.continue_on_error = args.continue_on_error
 
     print("\nConverter input parameters: ")
     print("-------------------------------------------------------- ")
@@ -179,13 +387,33 @@ def main():
     print("Output NifTi q-form  : {}".format(bruconv.qform_code))
     print("Output NifTi s-form  : {}".format(bruconv.sform_code))
     print("Save human readable  : {}".format(bruconv.save_human_readable))
+    print("Metadata format      : {}".format(bruconv.metadata_format))
+    print("Continue on error    : {}".format(bruconv.continue_on_error))
     print("Correct the slope    : {}".format(bruconv.correct_slope))
     print("Correct the offset   : {}".format(bruconv.correct_offset))
+    print("Corrected datatype   : {}".format(bruconv.corrected_dtype))
+    print("Integer output       : {}".format(bruconv.integer_output))
+    print("Stream chunk (MB)    : {}".format(bruconv.stream_chunk_mb))
+    print("Compress output      : {}".format(bruconv.compress_output))
+    print("Compression level    : {}".format(bruconv.compression_level))
+    print("Compression threads  : {}".format(bruconv.compression_threads))
+    print("Write threads        : {}".format(bruconv.write_threads))
+    print("Parallel jobs        : {}".format(bruconv.workers))
+    print("Pipeline memory (MB) : {}".format(bruconv.pipeline_memory_mb))
+    print("Incremental          : {}".format(bruconv.incremental))
+    print("Geometry only        : {}".format(bruconv.geometry_only))
+    print("Timings              : {}".format(args.timings))
     print("-------------------------------------------------------- ")
     print("Sample upside down         : {}".format(bruconv.sample_upside_down))
     print("Frame body as frame head   : {}".format(bruconv.frame_body_as_frame_head))
     print("-------------------------------------------------------- ")
-    bruconv.convert()
+    report = bruconv.convert()
+
+    if args.timings is not None:
+        utils.save_timings(
+            OrderedDict((scan, result["timings"]) for scan, result in report.items()),
+            args.timings,
+        )
 
     # Print a warning message for paths with whitespace as it may interfere
     # with subsequent steps in an image analysis pipeline
@@ -194,9 +422,56 @@ def main():
     ):
         print("INFO: Output path/filename contains whitespace")
 
+    failed = [scan for scan, result in report.items() if result["status"] == "failed"]
+    if failed:
+        sys.exit("Conversion failed for scans {}".format(failed))
+
 
-def list_scans(pfo_study):
-    study = BrukerMetadata(pfo_study)
+def converter_settings(args):
+    """
+    :param args: parsed arguments of the command line.
+    :return: ordered dictionary {attribute: value} with the settings of the converter selected by the user.
+    """
+    settings = OrderedDict()
+    # Basics
+    settings["nifti_version"] = args.nifti_version
+    settings["qform_code"] = args.qform_code
+    settings["sform_code"] = args.sform_code
+    settings["save_human_readable"] = not args.do_not_save_human_readable
+    settings["metadata_format"] = args.metadata_format
+    settings["correct_slope"] = args.correct_slope
+    settings["correct_offset"] = args.correct_offset
+    settings["corrected_dtype"] = args.corrected_dtype
+    settings["integer_output"] = args.integer_output
+    settings["stream_chunk_mb"] = args.stream_chunk_mb
+    settings["compress_output"] = not args.do_not_compress
+    settings["compression_level"] = args.compression_level
+    settings["compression_threads"] = args.compression_threads
+    settings["write_threads"] = args.write_threads
+    settings["verbose"] = args.verbose
+    settings["workers"] = args.workers
+    settings["pipeline_memory_mb"] = args.pipeline_memory_mb
+    settings["record_timings"] = args.timings is not None
+    settings["incremental"] = args.incremental
+    settings["geometry_only"] = args.geometry_only
+    # Sample position
+    settings["sample_upside_down"] = args.sample_upside_down
+    settings["frame_body_as_frame_head"] = args.frame_body_as_frame_head
+    return settings
+
+
+def list_scans(pfo_study, index_dir=None):
+    # only the acqp and method files of each scan are parsed, when printed.
+    study = BrukerMetadata(
+        pfo_study,
+        index=index_dir,
+        lazy=True,
+        keys={
+            "subject": ["SUBJECT_name_string", "SUBJECT_date"],
+            "acqp": ["ACQ_protocol_name", "ACQ_method"],
+            "method": ["ScanTime"],
+        },
+    )
     study.parse_subject()
     study.parse_scans()
 
@@ -49,6 +49,17 @@ def main_scan():
         action="store_true",
     )
 
+    # metadata_format = npy,
+    parser.add_argument(
+        "-metadata_format",
+        dest="metadata_format",
+        type=str,
+        default="npy",
+        choices=["npy", "sidecar"],
+        help="Save the parameters of each scan in a .npy (and .txt) file per "
+        + "parameter file, or in a single .json and .npz sidecar.",
+    )
+
     # correct_slope = False,
 
     parser.add_argument("-correct_slope", dest="correct_slope", action="store_true")
@@ -56,6 +67,65 @@ def main_scan():
     # correct_offset = False,
     parser.add_argument("-correct_offset", dest="correct_offset", action="store_true")
 
+    # corrected_dtype = float64,
+    parser.add_argument(
+        "-corrected_dtype",
+        dest="corrected_dtype",
+        type=str,
+        default="float64",
+        choices=["float32", "float64"],
+        help="Datatype of the slope/offset corrected images.",
+    )
+
+    # integer_output = False,
+    parser.add_argument(
+        "-integer_output",
+        dest="integer_output",
+        action="store_true",
+        help="Keep the integer data, with a uniform slope/offset "
+        + "in the scl_slope/scl_inter of the nifti header.",
+    )
+
+    # stream_chunk_mb = None,
+    parser.add_argument(
+        "-stream_chunk_mb",
+        dest="stream_chunk_mb",
+        type=float,
+        default=None,
+        help="Stream the images to disk in slabs of at most this size in MB.",
+    )
+
+    # compress_output = True,
+    parser.add_argument("-do_not_compress", dest="do_not_compress", action="store_true")
+
+    # compression_level = 1,
+    parser.add_argument(
+        "-compression_level",
+        dest="compression_level",
+        type=int,
+        default=1,
+        choices=range(10),
+        help="Gzip compression level of the .nii.gz images (1 fast, 9 small).",
+    )
+
+    # compression_threads = 1,
+    parser.add_argument(
+        "-compression_threads",
+        dest="compression_threads",
+        type=int,
+        default=1,
+        help="Number of threads compressing each .nii.gz image.",
+    )
+
+    # write_threads = 1,
+    parser.add_argument(
+        "-write_threads",
+        dest="write_threads",
+        type=int,
+        default=1,
+        help="Number of threads writing the output files of each scan concurrently.",
+    )
+
     # sample_upside_down = False,
     parser.add_argument(
         "-sample_upside_down", dest="sample_upside_down", action="store_true"
@@ -71,6 +141,15 @@ def main_scan():
     # verbose = 1
     parser.add_argument("-verbose", "-v", dest="verbose", type=int, default=1)
 
+    # timings = None
+    parser.add_argument(
+        "--timings",
+        dest="timings",
+        type=str,
+        default=None,
+        help="Save the time spent in each stage of the conversion in this .json file.",
+    )
+
     args = parser.parse_args()
 
     # instantiate a converter:
@@ -80,8 +159,16 @@ def main_scan():
     bruconv.qform_code = args.qform_code
     bruconv.sform_code = args.sform_code
     bruconv.save_human_readable = not args.do_not_save_human_readable
+    bruconv.metadata_format = args.metadata_format
     bruconv.correct_slope = args.correct_slope
     bruconv.correct_offset = args.correct_offset
+    bruconv.corrected_dtype = args.corrected_dtype
+    bruconv.integer_output = args.integer_output
+    bruconv.stream_chunk_mb = args.stream_chunk_mb
+    bruconv.compress_output = not args.do_not_compress
+    bruconv.compression_level = args.compression_level
+    bruconv.compression_threads = args.compression_threads
+    bruconv.write_threads = args.write_threads
     bruconv.verbose = args.verbose
     # Sample position
     bruconv.sample_upside_down = args.sample_upside_down
@@ -98,8 +185,17 @@ def main_scan():
         print("Output NifTi q-form  : {}".format(bruconv.qform_code))
         print("Output NifTi s-form  : {}".format(bruconv.sform_code))
         print("Save human readable  : {}".format(bruconv.save_human_readable))
+        print("Metadata format      : {}".format(bruconv.metadata_format))
         print("Correct the slope    : {}".format(bruconv.correct_slope))
         print("Correct the offset   : {}".format(bruconv.correct_offset))
+        print("Corrected datatype   : {}".format(bruconv.corrected_dtype))
+        print("Integer output       : {}".format(bruconv.integer_output))
+        print("Stream chunk (MB)    : {}".format(bruconv.stream_chunk_mb))
+        print("Compress output      : {}".format(bruconv.compress_output))
+        print("Compression level    : {}".format(bruconv.compression_level))
+        print("Compression threads  : {}".format(bruconv.compression_threads))
+        print("Write threads        : {}".format(bruconv.write_threads))
+        print("Timings              : {}".format(args.timings))
         print("-------------------------------------------------------- ")
         print("Sample upside down         : {}".format(bruconv.sample_upside_down))
         print(
@@ -107,14 +203,20 @@ def main_scan():
         )
         print("-------------------------------------------------------- ")
 
+    timer = utils.StageTimer() if args.timings is not None else None
+
     # convert the single:
     bruconv.convert_scan(
         args.pfo_input,
         args.pfo_output,
         nifti_file_name=args.fin_output,
         create_output_folder_if_not_exists=True,
+        timer=timer,
     )
 
+    if timer is not None:
+        utils.save_timings(timer.report(), args.timings)
+
     # Print a warning message for paths with whitespace as it may interfere
     # with subsequent steps in an image analysis pipeline
     if utils.path_contains_whitespace(
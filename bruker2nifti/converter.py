@@ -1,8 +1,21 @@
+import json
 import os
+import shutil
+import threading
+import traceback
+import numpy as np
+from collections import OrderedDict
+from multiprocessing import Pool
 
-from bruker2nifti._utils import bruker_read_files
-from bruker2nifti._getters import get_list_scans, get_subject_name
-from bruker2nifti._cores import scan2struct, write_struct
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from bruker2nifti._utils import bruker_read_files, StageTimer
+from bruker2nifti._getters import get_list_scans, get_list_studies, get_subject_name
+from bruker2nifti._cores import scan2struct, write_struct, load_struct, struct_nbytes
+from bruker2nifti._manifest import ConversionManifest, files_signature
 
 
 class Bruker2Nifti(object):
@@ -28,12 +41,20 @@ class Bruker2Nifti(object):
     the raw Bruker and to progressively creating the nifti images.
     """
 
-    def __init__(self, pfo_study_bruker_input, pfo_study_nifti_output, study_name=None):
+    def __init__(
+        self,
+        pfo_study_bruker_input,
+        pfo_study_nifti_output,
+        study_name=None,
+        settings=None,
+    ):
         """
         Initialise the Facade class to the converter.
         :param pfo_study_bruker_input: path to folder (pfo) to the Bruker input data folder.
         :param pfo_study_nifti_output: path to folder (pfo) where the converted study will be stored.
         :param study_name: optional name of the study. If None, the name parsed from the Bruker study will be used.
+        :param settings: optional dictionary {attribute: value} with the settings of the converter, set before the
+        study is explored: e.g. the names of the scans follow the scans_list given here.
         """
         self.pfo_study_bruker_input = pfo_study_bruker_input
         self.pfo_study_nifti_output = pfo_study_nifti_output
@@ -46,8 +67,17 @@ class Bruker2Nifti(object):
         self.save_b0_if_dwi = (
             True
         )  # if DWI, it saves the first layer as a single nfti image.
+        # if DWI, it saves the mean of the volumes with b-value below b0_threshold (s/mm2) as a single nifti image.
+        self.save_mean_b0_if_dwi = False
+        self.b0_threshold = 50
         self.correct_slope = True
         self.correct_offset = True
+        # np.float32 halves the size of slope/offset corrected images.
+        self.corrected_dtype = np.float64
+        # if True, the raw integer data are saved, with a slope and an offset uniform across the frames in the nifti
+        # header (scl_slope, scl_inter). Frame-wise factors are corrected in the smallest exact datatype, if any, or
+        # in corrected_dtype.
+        self.integer_output = False
         # advanced sample positioning
         self.sample_upside_down = False
         self.frame_body_as_frame_head = False
@@ -63,6 +93,40 @@ class Bruker2Nifti(object):
             None
         )  # you can select specific names for the subset self.scans_list.
         self.verbose = 1
+        # if not None, nifti images are streamed to disk in slabs of at most this many MB, and the slope/offset
+        # correction is applied slab by slab: memory is bounded also for huge 4D series.
+        self.stream_chunk_mb = None
+        # number of scans converted in parallel, each one in its own process.
+        self.workers = 1
+        # output compression: .nii.gz if compress_output else .nii. Level 1 is fast, 9 gives the smallest files.
+        # With compression_threads > 1 each image is gzipped by a pool of threads.
+        self.compress_output = True
+        self.compression_level = 1
+        self.compression_threads = 1
+        # number of threads writing the output files of each scan concurrently: the sub-scans, sub-volumes and
+        # reconstructions of a scan are compressed at the same time.
+        self.write_threads = 1
+        # if True, convert records the time and the bytes read and written of each stage of the conversion of each
+        # scan, in the 'timings' of the report.
+        self.record_timings = False
+        # if True, convert does not fail if the output study exists: a manifest of the scans converted is kept in it
+        # (see _manifest), and only new, changed or failed scans are converted again.
+        self.incremental = False
+        # if not None, and the scans are not converted in parallel, the next scans are read while the current one is
+        # compressed and written, keeping in memory at most this many MB of images.
+        self.pipeline_memory_mb = None
+        # if True, the 2dseq are not read: the nifti images are header-only .nii stubs, and the geometry of the images
+        # (shape, datatype, affine, sub-volumes) is saved in a _geometry.json table for each scan.
+        self.geometry_only = False
+        # 'npy': each parameter file is saved as a .npy (and a .txt if save_human_readable). 'sidecar': all the
+        # parameters of a scan are saved in a _metadata.json and a _metadata.npz, without pickles (see _sidecar).
+        self.metadata_format = "npy"
+        # if True, a scan that can not be converted is marked as 'failed' in the report of convert, with its
+        # traceback, and the other scans go on. If False the error is raised, as for a single scan.
+        self.continue_on_error = False
+        if settings is not None:
+            for attribute, value in settings.items():
+                setattr(self, attribute, value)
         # automatic filling of advanced selections class attributes
         self.explore_study()
 
@@ -121,7 +185,7 @@ class Bruker2Nifti(object):
         print("\n")
         print("List of scans: {}".format(scans_list))
         pfi_first_scan = os.path.join(self.pfo_study_bruker_input, scans_list[0])
-        acqp = bruker_read_files("acqp", pfi_first_scan)
+        acqp = bruker_read_files("acqp", pfi_first_scan, keys=["ACQ_sw_version"])
         print("Version: {}".format(acqp["ACQ_sw_version"][0]))
 
     def convert_scan(
@@ -130,6 +194,7 @@ class Bruker2Nifti(object):
         pfo_output_converted,
         nifti_file_name=None,
         create_output_folder_if_not_exists=True,
+        timer=None,
     ):
         """
         :param pfo_input_scan: path to folder (pfo) containing a scan from Bruker, see documentation for the difference
@@ -138,6 +203,7 @@ class Bruker2Nifti(object):
         :param create_output_folder_if_not_exists: [True] if the output folder does not exist will be created.
         :param nifti_file_name: [None] filename of the nifti image that will be saved into the pfo_output folder.
          If None, the filename will be obtained from the parameter file of the study.
+        :param timer: [None] optional StageTimer recording the stages of the conversion (see _utils.StageTimer).
         :return: [None] save the data parsed from the raw Bruker scan into a folder, including the nifti image.
         """
 
@@ -147,7 +213,34 @@ class Bruker2Nifti(object):
         if create_output_folder_if_not_exists:
             os.makedirs(pfo_output_converted)
 
-        struct_scan = scan2struct(
+        # the sub-scans are created one at a time, while they are written.
+        struct_scan = self.read_scan(pfo_input_scan, iterate_recons=True, timer=timer)
+
+        if struct_scan is not None:
+            self.write_scan(
+                struct_scan,
+                pfo_output_converted,
+                nifti_file_name=nifti_file_name,
+                timer=timer,
+            )
+
+    def read_scan(
+        self, pfo_input_scan, lazy_correction=None, iterate_recons=False, timer=None
+    ):
+        """
+        First part of convert_scan: parse the scan with the settings of the converter (see _cores.scan2struct).
+        :param pfo_input_scan: path to folder (pfo) containing a scan from Bruker.
+        :param lazy_correction: [None] if True, the slope and offset correction is proxied and not applied. If None,
+        it is proxied only if the images are streamed to disk (self.stream_chunk_mb).
+        :param iterate_recons: [False] if True, the images of the sub-scans are created one at a time while they are
+        written (see _cores.scan2struct).
+        :param timer: [None] optional StageTimer recording the stages of the conversion (see _utils.StageTimer).
+        :return: struct of the scan, or None if the scan can not be converted.
+        """
+        if lazy_correction is None:
+            lazy_correction = self.stream_chunk_mb is not None
+
+        return scan2struct(
             pfo_input_scan,
             correct_slope=self.correct_slope,
             correct_offset=self.correct_offset,
@@ -159,23 +252,62 @@ class Bruker2Nifti(object):
             get_method=self.get_method,
             get_reco=self.get_reco,
             frame_body_as_frame_head=self.frame_body_as_frame_head,
+            corrected_dtype=self.corrected_dtype,
+            lazy_correction=lazy_correction,
+            integer_output=self.integer_output,
+            geometry_only=self.geometry_only,
+            iterate_recons=iterate_recons,
+            timer=timer,
         )
 
-        if struct_scan is not None:
-            write_struct(
-                struct_scan,
-                pfo_output_converted,
-                fin_scan=nifti_file_name,
-                save_human_readable=self.save_human_readable,
-                save_b0_if_dwi=self.save_b0_if_dwi,
-                verbose=self.verbose,
-            )
+    def write_scan(
+        self, struct_scan, pfo_output_converted, nifti_file_name=None, timer=None
+    ):
+        """
+        Second part of convert_scan: write the struct of a scan with the settings of the converter
+        (see _cores.write_struct).
+        :param struct_scan: struct of the scan, as given by read_scan.
+        :param pfo_output_converted: path to the folder where the converted scan will be stored.
+        :param nifti_file_name: [None] filename of the nifti image that will be saved into the pfo_output folder.
+        :param timer: [None] optional StageTimer recording the stages of the conversion (see _utils.StageTimer).
+        :return: [None] save the scan.
+        """
+        if self.stream_chunk_mb is None:
+            chunk_size = None
+        else:
+            chunk_size = int(self.stream_chunk_mb * 1024 ** 2)
+
+        write_struct(
+            struct_scan,
+            pfo_output_converted,
+            fin_scan=nifti_file_name,
+            save_human_readable=self.save_human_readable,
+            save_b0_if_dwi=self.save_b0_if_dwi,
+            save_mean_b0_if_dwi=self.save_mean_b0_if_dwi,
+            b0_threshold=self.b0_threshold,
+            verbose=self.verbose,
+            chunk_size=chunk_size,
+            compress_output=self.compress_output,
+            compression_level=self.compression_level,
+            compression_threads=self.compression_threads,
+            write_threads=self.write_threads,
+            geometry_only=self.geometry_only,
+            metadata_format=self.metadata_format,
+            timer=timer,
+        )
 
     def convert(self):
         """
         To call the converter, once all the settings of the converter are selected and modified by the user.
         :return: Convert the Bruker study, whose path is stored in the class variable self.pfo_study_bruker_input
         in the specified folder stored in self.pfo_study_nifti_output, and according to the other class attributes.
+        If self.workers > 1 the scans are converted in parallel by a pool of processes. An error in a scan does not
+        stop the conversion of the others: it is returned in the report, an ordered dictionary
+        {bruker_scan_name: {'output': path, 'status': 'converted' or 'failed', 'error': None or traceback}}.
+        If self.incremental, the scans up to date in the manifest of a previous conversion are not converted again,
+        and have status 'skipped'.
+        If self.record_timings, each result has also the 'timings' of the stages of the conversion of the scan
+        (see _utils.StageTimer.report).
 
         Example:
 
@@ -185,19 +317,49 @@ class Bruker2Nifti(object):
 
         >> bru.verbose = 2
         >> bru.correct_slope = True
+        >> bru.integer_output = True  # keep the integer data, with the slope in the nifti header when possible.
         >> bru.get_acqp = False
         >> bru.get_method = True  # I want to see the method parameter file converted as well.
         >> bru.get_reco = False
+        >> bru.workers = 4  # convert up to 4 scans in parallel.
+        >> bru.record_timings = True  # time spent in each stage, in report[scan]['timings'].
+        >> bru.incremental = True  # resume a previous conversion, converting only new or changed scans.
+        >> bru.pipeline_memory_mb = 2048  # read the next scans while writing, with up to 2GB of images in memory.
+        >> bru.geometry_only = True  # headers and geometry only, without reading the images.
+        >> bru.metadata_format = 'sidecar'  # the parameters of each scan in a .json and a .npz.
+        >> bru.continue_on_error = True  # report the scans failing, instead of stopping at the first one.
 
         >> # Convert the study:
-        >> bru.convert()
+        >> report = bru.convert()
 
         """
-        pfo_nifti_study = os.path.join(self.pfo_study_nifti_output, self.study_name)
-        os.makedirs(pfo_nifti_study)
-
         print("\nStudy conversion \n{}\nstarted:\n".format(self.pfo_study_bruker_input))
 
+        # the outputs of the jobs come in their order, so the report follows self.scans_list.
+        report = OrderedDict(
+            _run_scan_jobs(
+                self.scan_jobs(),
+                self.workers,
+                pipeline_memory_mb=self.pipeline_memory_mb,
+            )
+        )
+        print_conversion_report(report)
+
+        print("\nStudy converted and saved in \n{}".format(self.pfo_study_nifti_output))
+
+        return report
+
+    def scan_jobs(self):
+        """
+        Create the output folder of the study and list the conversion jobs of its scans.
+        :return: list of jobs (converter, bruker_scan_name, pfo_scan_bruker, pfo_scan_nifti, scan_name), one for each
+        scan of self.scans_list, to be run by _convert_scan_job.
+        """
+        pfo_nifti_study = os.path.join(self.pfo_study_nifti_output, self.study_name)
+        if not (self.incremental and os.path.isdir(pfo_nifti_study)):
+            os.makedirs(pfo_nifti_study)
+
+        jobs = []
         for bruker_scan_name, scan_name in zip(
             self.scans_list, self.list_new_name_each_scan
         ):
@@ -205,14 +367,426 @@ class Bruker2Nifti(object):
                 self.pfo_study_bruker_input, bruker_scan_name
             )
             pfo_scan_nifti = os.path.join(pfo_nifti_study, scan_name)
+            jobs.append(
+                (self, bruker_scan_name, pfo_scan_bruker, pfo_scan_nifti, scan_name)
+            )
+        return jobs
 
-            print("\nConverting experiment {}:\n".format(bruker_scan_name))
+    def conversion_settings(self):
+        """
+        :return: dictionary with the settings of the converter changing the converted scans, recorded in the
+        manifest of the incremental conversion: a scan converted with different settings is converted again.
+        """
+        return {
+            "nifti_version": self.nifti_version,
+            "qform_code": self.qform_code,
+            "sform_code": self.sform_code,
+            "save_human_readable": self.save_human_readable,
+            "save_b0_if_dwi": self.save_b0_if_dwi,
+            "save_mean_b0_if_dwi": self.save_mean_b0_if_dwi,
+            "b0_threshold": self.b0_threshold,
+            "correct_slope": self.correct_slope,
+            "correct_offset": self.correct_offset,
+            "corrected_dtype": np.dtype(self.corrected_dtype).name,
+            "integer_output": self.integer_output,
+            "sample_upside_down": self.sample_upside_down,
+            "frame_body_as_frame_head": self.frame_body_as_frame_head,
+            "get_acqp": self.get_acqp,
+            "get_method": self.get_method,
+            "get_reco": self.get_reco,
+            "compress_output": self.compress_output,
+            "compression_level": self.compression_level,
+            "geometry_only": self.geometry_only,
+            "metadata_format": self.metadata_format,
+        }
+
+
+def convert_many(
+    pfo_root_bruker_input,
+    pfo_nifti_output,
+    workers=1,
+    settings=None,
+    pfi_report=None,
+):
+    """
+    Convert all the Bruker studies found under a root folder (see _getters.get_list_studies). The scans of all the
+    studies are put on the same work queue, served by a pool of workers processes: the conversion scales with the
+    number of cores across studies, and not only within each study.
+    :param pfo_root_bruker_input: path to the root folder containing the Bruker studies, e.g. a scanner archive.
+    :param pfo_nifti_output: path to the folder where the converted studies will be stored.
+    :param workers: [1] number of scans converted in parallel, each one in its own process.
+    :param settings: [None] dictionary {attribute: value} with the settings of the converters of every study,
+    e.g. {'correct_slope': True, 'compression_level': 6} (see the attributes of Bruker2Nifti). They are set before
+    each study is explored. continue_on_error is always True: a failing scan fails its study only.
+    :param pfi_report: [None] if not None, the report is also saved in this .json file.
+    :return: consolidated report, ordered dictionary {pfo_study: {'output': path, 'status': 'converted' or 'failed',
+    'error': None or traceback, 'scans': report of the study as returned by Bruker2Nifti.convert}}.
+    A study fails if it can not be read or if any of its scans fails.
+    """
+    if not os.path.isdir(pfo_root_bruker_input):
+        raise IOError("Input folder does not exist.")
+    if not os.path.isdir(pfo_nifti_output):
+        raise IOError("Output folder does not exist.")
+
+    if settings is None:
+        settings = {}
+
+    studies_list = get_list_studies(pfo_root_bruker_input)
+    print(
+        "\nBatch conversion of {0} studies found in \n{1}\nstarted:\n".format(
+            len(studies_list), pfo_root_bruker_input
+        )
+    )
+
+    report = OrderedDict()
+    jobs = []
+    jobs_study = []
+    study_names = set()
+
+    for pfo_study in studies_list:
+        report[pfo_study] = {
+            "output": None,
+            "status": "converted",
+            "error": None,
+            "scans": OrderedDict(),
+        }
+        try:
+            bruconv = Bruker2Nifti(pfo_study, pfo_nifti_output, settings=settings)
+            if bruconv.study_name in study_names:
+                # same subject in different studies: the name of the study folder tells them apart.
+                study_name = bruconv.study_name + "".join(
+                    e for e in os.path.basename(pfo_study) if e.isalnum()
+                )
+                bruconv = Bruker2Nifti(
+                    pfo_study,
+                    pfo_nifti_output,
+                    study_name=study_name,
+                    settings=settings,
+                )
+            # a failing scan fails its study, without stopping the batch, whatever the settings.
+            bruconv.continue_on_error = True
+            study_jobs = bruconv.scan_jobs()
+        except Exception:
+            report[pfo_study]["status"] = "failed"
+            report[pfo_study]["error"] = traceback.format_exc()
+            print(
+                "Warning: study {0} can not be converted:\n{1}".format(
+                    pfo_study, report[pfo_study]["error"]
+                )
+            )
+            continue
+
+        study_names.add(bruconv.study_name)
+        report[pfo_study]["output"] = os.path.join(pfo_nifti_output, bruconv.study_name)
+        jobs += study_jobs
+        jobs_study += [pfo_study] * len(study_jobs)
+
+    outputs = _run_scan_jobs(
+        jobs, workers, pipeline_memory_mb=settings.get("pipeline_memory_mb")
+    )
+    for pfo_study, (bruker_scan_name, result) in zip(jobs_study, outputs):
+        report[pfo_study]["scans"][bruker_scan_name] = result
+        if result["status"] == "failed":
+            report[pfo_study]["status"] = "failed"
+
+    print_batch_report(report)
+
+    if pfi_report is not None:
+        save_report(report, pfi_report)
 
-            self.convert_scan(
+    print("\nStudies converted and saved in \n{}".format(pfo_nifti_output))
+
+    return report
+
+
+def _run_scan_jobs(jobs, workers=1, pipeline_memory_mb=None):
+    """
+    :param jobs: list of jobs, as given by Bruker2Nifti.scan_jobs.
+    :param workers: [1] if more than 1, the jobs are run by a pool of processes.
+    :param pipeline_memory_mb: [None] if not None and the jobs are not run by a pool, reading and writing of the
+    scans are overlapped, with at most this many MB of images in memory (see _pipelined_scan_jobs).
+    :return: generator of the outputs of _convert_scan_job, in the order of the jobs. For the jobs of incremental
+    converters, the scans up to date in the manifest of their study are skipped, and the manifest is saved as soon as
+    each scan is converted: an interrupted conversion resumes from the scans left.
+    """
+    manifests = {}
+    inputs = {}
+    skipped = set()
+    jobs_to_run = []
+    for id_job, job in enumerate(jobs):
+        converter, bruker_scan_name, pfo_scan_bruker, pfo_scan_nifti, _ = job
+        if converter.incremental:
+            pfo_nifti_study = os.path.dirname(pfo_scan_nifti)
+            if pfo_nifti_study not in manifests:
+                manifests[pfo_nifti_study] = ConversionManifest(pfo_nifti_study)
+            if manifests[pfo_nifti_study].is_up_to_date(
+                bruker_scan_name,
                 pfo_scan_bruker,
                 pfo_scan_nifti,
-                create_output_folder_if_not_exists=True,
-                nifti_file_name=scan_name,
+                converter.conversion_settings(),
+            ):
+                skipped.add(id_job)
+                continue
+            inputs[id_job] = files_signature(pfo_scan_bruker)
+        jobs_to_run.append(job)
+
+    pool = None
+    if workers > 1 and len(jobs_to_run) > 1:
+        pool = Pool(processes=min(workers, len(jobs_to_run)))
+        # imap keeps the order of the jobs, giving each output as soon as it is ready.
+        outputs = pool.imap(_convert_scan_job, jobs_to_run, chunksize=1)
+    elif pipeline_memory_mb is not None and len(jobs_to_run) > 1:
+        outputs = _pipelined_scan_jobs(jobs_to_run, pipeline_memory_mb)
+    else:
+        outputs = (_convert_scan_job(job) for job in jobs_to_run)
+
+    try:
+        for id_job, job in enumerate(jobs):
+            converter, bruker_scan_name, pfo_scan_bruker, pfo_scan_nifti, _ = job
+            if id_job in skipped:
+                result = {"output": pfo_scan_nifti, "status": "skipped", "error": None}
+                if converter.record_timings:
+                    result["timings"] = StageTimer().report()
+                yield bruker_scan_name, result
+                continue
+
+            output = next(outputs)
+            if converter.incremental:
+                manifest = manifests[os.path.dirname(pfo_scan_nifti)]
+                manifest.record(
+                    bruker_scan_name,
+                    pfo_scan_bruker,
+                    output[1],
+                    converter.conversion_settings(),
+                    inputs=inputs[id_job],
+                )
+                manifest.save()
+            yield output
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def _convert_scan_job(job):
+    """
+    Convert a single scan of a study. If the converter continues on error, any error is isolated so that the other
+    scans can go on, otherwise it is raised.
+    Module level function, so that it can be sent to the processes of a multiprocessing pool.
+    :param job: tuple (converter, bruker_scan_name, pfo_scan_bruker, pfo_scan_nifti, scan_name).
+    :return: tuple (bruker_scan_name, result) where result is a dictionary with the keys 'output', 'status'
+    ('converted' or 'failed') and 'error' (None or the traceback of the failure), and 'timings' if the converter
+    records them.
+    """
+    converter, bruker_scan_name, pfo_scan_bruker, pfo_scan_nifti, scan_name = job
+
+    print("\nConverting experiment {}:\n".format(bruker_scan_name))
+
+    result = {"output": pfo_scan_nifti, "status": "converted", "error": None}
+    timer = StageTimer() if converter.record_timings else None
+    try:
+        if converter.incremental and os.path.exists(pfo_scan_nifti):
+            # outdated or partial output of a previous conversion
+            shutil.rmtree(pfo_scan_nifti)
+        converter.convert_scan(
+            pfo_scan_bruker,
+            pfo_scan_nifti,
+            create_output_folder_if_not_exists=True,
+            nifti_file_name=scan_name,
+            timer=timer,
+        )
+    except Exception:
+        if not converter.continue_on_error:
+            raise
+        _scan_failed(bruker_scan_name, result)
+
+    if timer is not None:
+        result["timings"] = timer.report()
+
+    return bruker_scan_name, result
+
+
+def _scan_failed(bruker_scan_name, result):
+    """
+    To be called while handling the exception raised by the conversion of a scan.
+    :return: [None] set the result of the scan as failed, with the traceback of the exception.
+    """
+    result["status"] = "failed"
+    result["error"] = traceback.format_exc()
+    print(
+        "Warning: conversion of experiment {0} failed:\n{1}".format(
+            bruker_scan_name, result["error"]
+        )
+    )
+
+
+class _MemoryBudget(object):
+    """
+    Bytes of images held in memory by the pipelined conversion. A scan larger than the whole budget is let in when
+    nothing else is held, so that any scan can be converted.
+    """
+
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes):
+        with self._condition:
+            while self.used > 0 and self.used + nbytes > self.nbytes:
+                self._condition.wait()
+            self.used += nbytes
+
+    def release(self, nbytes):
+        with self._condition:
+            self.used -= nbytes
+            self._condition.notify_all()
+
+
+def _pipelined_scan_jobs(jobs, pipeline_memory_mb):
+    """
+    Run the jobs in two overlapped stages: a reader thread parses the scans, reads their data and corrects them,
+    while the calling thread compresses and writes the scans already read. The scans read wait for the writer in a
+    queue, bounded by the memory budget: the images of the scans in the queue or being written never take more than
+    pipeline_memory_mb. The memory of a scan is known before reading its data, since they are first proxied.
+    numpy and zlib release the GIL on large arrays, so that reads and writes overlap also in a single process.
+    :param jobs: list of jobs, as given by Bruker2Nifti.scan_jobs.
+    :param pipeline_memory_mb: memory budget in MB.
+    :return: generator of the outputs of the jobs, as given by _convert_scan_job, in the order of the jobs.
+    """
+    budget = _MemoryBudget(int(pipeline_memory_mb * 1024 ** 2))
+    scans_read = Queue()
+    # set when the writer stops at an error, so that the reader does not read the next scans.
+    stop = threading.Event()
+
+    def read_scans():
+        for job in jobs:
+            if stop.is_set():
+                return
+            converter, bruker_scan_name, pfo_scan_bruker, pfo_scan_nifti, _ = job
+
+            print("\nConverting experiment {}:\n".format(bruker_scan_name))
+
+            result = {"output": pfo_scan_nifti, "status": "converted", "error": None}
+            timer = StageTimer() if converter.record_timings else None
+            struct_scan = None
+            nbytes = 0
+            error = None
+            try:
+                if converter.incremental and os.path.exists(pfo_scan_nifti):
+                    shutil.rmtree(pfo_scan_nifti)
+                if not os.path.isdir(pfo_scan_bruker):
+                    raise IOError("Input folder does not exist.")
+                os.makedirs(pfo_scan_nifti)
+                struct_scan = converter.read_scan(
+                    pfo_scan_bruker, lazy_correction=True, timer=timer
+                )
+                if struct_scan is not None:
+                    nbytes = struct_nbytes(struct_scan)
+                    budget.acquire(nbytes)
+                    if converter.stream_chunk_mb is None:
+                        struct_scan = load_struct(struct_scan, timer=timer)
+            except Exception as e:
+                if not converter.continue_on_error:
+                    # raised by the writer, in the calling thread.
+                    scans_read.put((job, result, timer, None, nbytes, e))
+                    return
+                _scan_failed(bruker_scan_name, result)
+            scans_read.put((job, result, timer, struct_scan, nbytes, error))
+
+    reader = threading.Thread(target=read_scans)
+    reader.daemon = True
+    reader.start()
+
+    for _ in jobs:
+        job, result, timer, struct_scan, nbytes, error = scans_read.get()
+        converter, bruker_scan_name, _, pfo_scan_nifti, scan_name = job
+        try:
+            if error is not None:
+                raise error
+            if result["status"] == "converted" and struct_scan is not None:
+                try:
+                    converter.write_scan(
+                        struct_scan,
+                        pfo_scan_nifti,
+                        nifti_file_name=scan_name,
+                        timer=timer,
+                    )
+                except Exception:
+                    if not converter.continue_on_error:
+                        raise
+                    _scan_failed(bruker_scan_name, result)
+        except Exception:
+            stop.set()
+            raise
+        finally:
+            # free the images before letting the reader in
+            struct_scan = None
+            budget.release(nbytes)
+
+        if timer is not None:
+            result["timings"] = timer.report()
+        yield bruker_scan_name, result
+
+    reader.join()
+
+
+def print_conversion_report(report):
+    """
+    Print to console the aggregated outcome of a conversion.
+    :param report: ordered dictionary {bruker_scan_name: result} as returned by Bruker2Nifti.convert.
+    :return: [None] only print to console information.
+    """
+    failed = [scan for scan, result in report.items() if result["status"] == "failed"]
+    skipped = [s for s, result in report.items() if result["status"] == "skipped"]
+    print("\nConversion report:")
+    print("-------------------------------------------------------- ")
+    for scan, result in report.items():
+        print("Scan {0:<6} : {1}".format(scan, result["status"]))
+    print("-------------------------------------------------------- ")
+    print(
+        "{0} scans converted, {1} up to date, {2} failed {3}".format(
+            len(report) - len(failed) - len(skipped),
+            len(skipped),
+            len(failed),
+            failed if failed else "",
+        )
+    )
+
+
+def print_batch_report(report):
+    """
+    Print to console the aggregated outcome of a batch conversion.
+    :param report: ordered dictionary {pfo_study: result} as returned by convert_many.
+    :return: [None] only print to console information.
+    """
+    failed = [study for study, result in report.items() if result["status"] == "failed"]
+    print("\nBatch conversion report:")
+    print("-------------------------------------------------------- ")
+    for study, result in report.items():
+        status_scans = [r["status"] for r in result["scans"].values()]
+        print(
+            "{0} : {1} ({2} scans converted, {3} up to date, {4} failed)".format(
+                study,
+                result["status"],
+                status_scans.count("converted"),
+                status_scans.count("skipped"),
+                status_scans.count("failed"),
             )
+        )
+    print("-------------------------------------------------------- ")
+    print(
+        "{0} studies converted, {1} failed".format(
+            len(report) - len(failed), len(failed)
+        )
+    )
 
-        print("\nStudy converted and saved in \n{}".format(self.pfo_study_nifti_output))
+
+def save_report(report, pfi_output):
+    """
+    :param report: report of a conversion, as returned by Bruker2Nifti.convert or convert_many.
+    :param pfi_output: path to the output .json file.
+    :return: [None] save the report in a json file.
+    """
+    with open(pfi_output, "w") as f:
+        json.dump(report, f, indent=2)
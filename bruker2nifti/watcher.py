@@ -0,0 +1,351 @@
+import json
+import os
+import time
+import traceback
+from multiprocessing import Pool
+
+try:
+    # optional, installed with: pip install bruker2nifti[watch]
+    from inotify_simple import INotify, flags
+except ImportError:
+    # polling only
+    INotify = None
+
+from bruker2nifti._getters import get_list_studies
+from bruker2nifti._manifest import ConversionManifest, files_signature
+from bruker2nifti.converter import Bruker2Nifti, _convert_scan_job
+
+
+class StudyWatcher(object):
+    """
+    Watch a root folder where Bruker studies are acquired (or copied), and convert each scan as soon as it is
+    complete, with Bruker2Nifti.convert_scan.
+
+    At each poll the root folder is walked, stat only: a scan is ready when the '2dseq' and 'visu_pars' of all of its
+    reconstructions exist, are the same as at the previous poll, and have not been modified for stable_time seconds.
+    Ready scans are converted by a pool of workers, in the output folder of their study.
+
+    Scans are converted incrementally (see Bruker2Nifti.incremental): the manifest of each study and the names given
+    to the studies, saved in the output folder, are the state of the watcher. A watcher restarted on the same output
+    folder does not convert again the scans converted before.
+
+    If the optional package inotify_simple is installed (pip install bruker2nifti[watch]), the watcher polls as soon as
+    files change in the folders of the scans being acquired and of their reconstructions, instead of sleeping for
+    poll_interval seconds.
+
+    >> watcher = StudyWatcher('/path/to/scanner/data', '/path/output', settings={'correct_slope': True}, workers=4)
+    >> watcher.run()
+    """
+
+    state_filename = "bruker2nifti_watch_state.json"
+
+    def __init__(
+        self,
+        pfo_root_bruker_input,
+        pfo_nifti_output,
+        settings=None,
+        workers=1,
+        poll_interval=10,
+        stable_time=60,
+    ):
+        """
+        :param pfo_root_bruker_input: path to the folder watched, containing the Bruker studies.
+        :param pfo_nifti_output: path to the folder where the converted studies will be stored.
+        :param settings: [None] dictionary {attribute: value} with the settings of the converters of every study
+        (see the attributes of Bruker2Nifti).
+        :param workers: [1] number of scans converted in parallel, each one in its own process.
+        :param poll_interval: [10] seconds between two polls of the watched folder.
+        :param stable_time: [60] seconds a scan has to be left unchanged before being converted.
+        """
+        if not os.path.isdir(pfo_root_bruker_input):
+            raise IOError("Input folder does not exist.")
+        if not os.path.isdir(pfo_nifti_output):
+            raise IOError("Output folder does not exist.")
+
+        self.pfo_root_bruker_input = pfo_root_bruker_input
+        self.pfo_nifti_output = pfo_nifti_output
+        self.settings = settings if settings is not None else {}
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stable_time = stable_time
+
+        # {pfo_study: study_name}, saved in the output folder.
+        self.pfi_state = os.path.join(pfo_nifti_output, self.state_filename)
+        self.study_names = {}
+        if os.path.exists(self.pfi_state):
+            with open(self.pfi_state) as f:
+                self.study_names = json.load(f)["studies"]
+
+        self._converters = {}
+        self._manifests = {}
+        # signature of the scans at the previous poll, and of the scans converted (or failed) with it.
+        self._signatures = {}
+        self._done = {}
+        # {pfo_scan: (pfo_study, job, inputs signature, async result)}
+        self._pending = {}
+
+        self._pool = Pool(processes=workers) if workers > 1 else None
+        self._inotify = INotify() if INotify is not None else None
+        self._watched = set()
+
+    def poll(self):
+        """
+        Walk the watched folder once, start the conversion of the scans ready and collect the conversions finished.
+        :return: list of tuples (pfo_study, bruker_scan_name, result) of the scans whose conversion finished, result
+        as in the report of Bruker2Nifti.convert.
+        """
+        finished = self._collect()
+        now = time.time()
+
+        for pfo_study in get_list_studies(self.pfo_root_bruker_input):
+            self._watch(pfo_study)
+            for bruker_scan_name in sorted(os.listdir(pfo_study)):
+                pfo_scan = os.path.join(pfo_study, bruker_scan_name)
+                if not bruker_scan_name.isdigit() or pfo_scan in self._pending:
+                    continue
+
+                signature = _scan_signature(pfo_scan)
+                previous_signature = self._signatures.get(pfo_scan)
+                self._signatures[pfo_scan] = signature
+
+                if signature is not None and self._done.get(pfo_scan) == signature:
+                    continue
+                if not (
+                    signature is not None
+                    and signature == previous_signature
+                    and now - max(mtime for _, mtime in signature.values())
+                    >= self.stable_time
+                ):
+                    # still being acquired or copied: inotify is not recursive, the folders where the '2dseq' and
+                    # 'visu_pars' are written are watched one by one, as they appear.
+                    self._watch(pfo_scan, *_recon_folders(pfo_scan))
+                    continue
+
+                try:
+                    converter = self._converter(pfo_study)
+                except Exception:
+                    print(
+                        "Warning: study {0} can not be read yet:\n{1}".format(
+                            pfo_study, traceback.format_exc()
+                        )
+                    )
+                    break
+
+                finished += self._submit(pfo_study, bruker_scan_name, converter)
+                self._done[pfo_scan] = signature
+
+        return finished + self._collect()
+
+    def run(self, max_polls=None):
+        """
+        Poll the watched folder until interrupted (e.g. with ctrl+C), or for max_polls times.
+        :param max_polls: [None] maximal number of polls, for ever if None.
+        :return: [None] convert the scans as they are ready.
+        """
+        print(
+            "\nWatching \n{0}\nconverted studies will be saved in \n{1}\n".format(
+                self.pfo_root_bruker_input, self.pfo_nifti_output
+            )
+        )
+        num_polls = 0
+        try:
+            while max_polls is None or num_polls < max_polls:
+                for pfo_study, bruker_scan_name, result in self.poll():
+                    print(
+                        "Scan {0} of {1} : {2}".format(
+                            bruker_scan_name, pfo_study, result["status"]
+                        )
+                    )
+                num_polls += 1
+                if max_polls is None or num_polls < max_polls:
+                    self._wait()
+        except KeyboardInterrupt:
+            print("\nWatcher interrupted.")
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        :return: [None] wait for the conversions started, and release the workers.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._collect()
+            self._pool = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _converter(self, pfo_study):
+        """
+        :return: the converter of the study, created at the first scan ready. The name of the study is kept in the
+        state of the watcher: studies of the same subject get the name of their folder appended.
+        """
+        if pfo_study in self._converters:
+            return self._converters[pfo_study]
+
+        study_name = self.study_names.get(pfo_study)
+        converter = Bruker2Nifti(
+            pfo_study,
+            self.pfo_nifti_output,
+            study_name=study_name,
+            settings=self.settings,
+        )
+        if study_name is None and converter.study_name in self.study_names.values():
+            study_name = converter.study_name + "".join(
+                e for e in os.path.basename(pfo_study) if e.isalnum()
+            )
+            converter = Bruker2Nifti(
+                pfo_study,
+                self.pfo_nifti_output,
+                study_name=study_name,
+                settings=self.settings,
+            )
+        converter.incremental = True
+        # a failing scan is recorded as failed in the manifest, and the watcher goes on.
+        converter.continue_on_error = True
+
+        pfo_nifti_study = os.path.join(self.pfo_nifti_output, converter.study_name)
+        if not os.path.isdir(pfo_nifti_study):
+            os.makedirs(pfo_nifti_study)
+
+        self._converters[pfo_study] = converter
+        self._manifests[pfo_study] = ConversionManifest(pfo_nifti_study)
+        if pfo_study not in self.study_names:
+            self.study_names[pfo_study] = converter.study_name
+            self._save_state()
+        return converter
+
+    def _submit(self, pfo_study, bruker_scan_name, converter):
+        """
+        :return: list with the outcome of the conversion of the scan if converted right away, empty if it is
+        converted by the pool of workers or if it is up to date.
+        """
+        pfo_scan = os.path.join(pfo_study, bruker_scan_name)
+        scan_name = converter.study_name + "_" + bruker_scan_name
+        pfo_scan_nifti = os.path.join(
+            self.pfo_nifti_output, converter.study_name, scan_name
+        )
+        if self._manifests[pfo_study].is_up_to_date(
+            bruker_scan_name, pfo_scan, pfo_scan_nifti, converter.conversion_settings()
+        ):
+            return []
+
+        job = (converter, bruker_scan_name, pfo_scan, pfo_scan_nifti, scan_name)
+        inputs = files_signature(pfo_scan)
+        if self._pool is None:
+            _, result = _convert_scan_job(job)
+            self._record(pfo_study, job, inputs, result)
+            return [(pfo_study, bruker_scan_name, result)]
+
+        self._pending[pfo_scan] = (
+            pfo_study,
+            job,
+            inputs,
+            self._pool.apply_async(_convert_scan_job, (job,)),
+        )
+        return []
+
+    def _collect(self):
+        """
+        :return: list of tuples (pfo_study, bruker_scan_name, result) of the conversions finished in the pool.
+        """
+        finished = []
+        for pfo_scan, (pfo_study, job, inputs, async_result) in list(
+            self._pending.items()
+        ):
+            if not async_result.ready():
+                continue
+            del self._pending[pfo_scan]
+            bruker_scan_name, result = async_result.get()
+            self._record(pfo_study, job, inputs, result)
+            finished.append((pfo_study, bruker_scan_name, result))
+        return finished
+
+    def _record(self, pfo_study, job, inputs, result):
+        converter, bruker_scan_name, pfo_scan, _, _ = job
+        manifest = self._manifests[pfo_study]
+        manifest.record(
+            bruker_scan_name,
+            pfo_scan,
+            result,
+            converter.conversion_settings(),
+            inputs=inputs,
+        )
+        manifest.save()
+
+    def _save_state(self):
+        pfi_tmp = self.pfi_state + ".tmp"
+        with open(pfi_tmp, "w") as f:
+            json.dump({"studies": self.study_names}, f, indent=2, sort_keys=True)
+        getattr(os, "replace", os.rename)(pfi_tmp, self.pfi_state)
+
+    def _watch(self, *list_pfo):
+        """
+        :return: [None] add the folders to the ones watched by inotify, if available.
+        """
+        if self._inotify is None:
+            return
+        for pfo in (self.pfo_root_bruker_input,) + list_pfo:
+            if pfo in self._watched or not os.path.isdir(pfo):
+                continue
+            try:
+                self._inotify.add_watch(
+                    pfo,
+                    flags.CREATE | flags.MODIFY | flags.CLOSE_WRITE | flags.MOVED_TO,
+                )
+                self._watched.add(pfo)
+            except OSError:
+                # e.g. too many watches: polling is enough
+                pass
+
+    def _wait(self):
+        """
+        :return: [None] wait poll_interval seconds, or less if inotify sees files changing.
+        """
+        if self._inotify is None:
+            time.sleep(self.poll_interval)
+        else:
+            # a short delay, to collect the events of a burst of writes at once
+            self._inotify.read(timeout=int(self.poll_interval * 1000), read_delay=1000)
+
+
+def _recon_folders(pfo_scan):
+    """
+    :param pfo_scan: path to a Bruker scan.
+    :return: list with the 'pdata' folder of the scan, if any, and the folders of its reconstructions.
+    """
+    pfo_pdata = os.path.join(pfo_scan, "pdata")
+    if not os.path.isdir(pfo_pdata):
+        return []
+    return [pfo_pdata] + [
+        os.path.join(pfo_pdata, recon)
+        for recon in sorted(os.listdir(pfo_pdata))
+        if recon.isdigit() and os.path.isdir(os.path.join(pfo_pdata, recon))
+    ]
+
+
+def _scan_signature(pfo_scan):
+    """
+    :param pfo_scan: path to a Bruker scan.
+    :return: dictionary {path relative to the scan: (size, mtime)} of the '2dseq' and 'visu_pars' of all the
+    reconstructions of the scan. None if a reconstruction misses one of them, or if there is no reconstruction.
+    """
+    pfo_pdata = os.path.join(pfo_scan, "pdata")
+    if not os.path.isdir(pfo_pdata):
+        return None
+    signature = {}
+    for recon in os.listdir(pfo_pdata):
+        if not recon.isdigit():
+            continue
+        for filename in ["2dseq", "visu_pars"]:
+            pfi = os.path.join(pfo_pdata, recon, filename)
+            if not os.path.isfile(pfi):
+                return None
+            stat = os.stat(pfi)
+            signature[os.path.join("pdata", recon, filename)] = (
+                stat.st_size,
+                stat.st_mtime,
+            )
+    return signature if signature else None
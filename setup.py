@@ -37,6 +37,8 @@ setup(
     url=infos["repository"]["url"],
     packages=find_packages(),
     install_requires=requirements2list(),
+    # the watcher reacts to the files written as soon as they change, instead of polling.
+    extras_require={"watch": ["inotify_simple"]},
     entry_points={
         "console_scripts": [
             "bruker2nifti=bruker2nifti.cli.bruker2nii:main",
@@ -1,3 +1,4 @@
+import json
 import os
 import warnings
 import subprocess
@@ -6,7 +7,11 @@ import shutil
 import sys
 import pytest
 
-from bruker2nifti.converter import Bruker2Nifti
+import nibabel as nib
+from numpy.testing import assert_array_equal
+
+from bruker2nifti.converter import Bruker2Nifti, convert_many
+from bruker2nifti._getters import get_list_studies
 
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -156,3 +161,245 @@ def test_warning_banana_bad_n():
         else:
             with pytest.raises(FileExistsError):
                 bru.convert()
+
+
+def test_convert_the_banana_in_parallel(tmp_path):
+
+    pfo_study_in = os.path.join(root_dir, "test_data", "bru_banana")
+    pfo_study_out = str(tmp_path)
+    target_folder = os.path.join(pfo_study_out, "banana_parallel")
+
+    bru = Bruker2Nifti(pfo_study_in, pfo_study_out, study_name="banana_parallel")
+    bru.correct_slope = True
+    bru.verbose = 0
+    bru.workers = 3
+    bru.record_timings = True
+    # a scan that does not exist must fail without stopping the others:
+    bru.continue_on_error = True
+    bru.scans_list = ["1", "2", "3", "42"]
+    bru.list_new_name_each_scan = ["banana_parallel_" + s for s in bru.scans_list]
+
+    report = bru.convert()
+
+    assert list(report.keys()) == ["1", "2", "3", "42"]
+    assert report["42"]["status"] == "failed"
+    assert "Input folder does not exist" in report["42"]["error"]
+
+    for ex in ["1", "2", "3"]:
+        assert report[ex]["status"] == "converted"
+        experiment_folder = os.path.join(target_folder, "banana_parallel_{}".format(ex))
+        assert report[ex]["output"] == experiment_folder
+        assert "write_nifti" in report[ex]["timings"]
+        assert os.path.exists(
+            os.path.join(experiment_folder, "banana_parallel_{}.nii.gz".format(ex))
+        )
+
+
+def test_convert_the_banana_stops_at_error(tmp_path):
+
+    pfo_study_in = os.path.join(root_dir, "test_data", "bru_banana")
+
+    # serial, pipelined and parallel conversions raise the error of a scan, unless continue_on_error.
+    for workers, pipeline_memory_mb in [(1, None), (1, 100), (2, None)]:
+        pfo_study_out = str(
+            tmp_path / "workers_{}_{}".format(workers, pipeline_memory_mb)
+        )
+        os.mkdir(pfo_study_out)
+
+        bru = Bruker2Nifti(pfo_study_in, pfo_study_out, study_name="banana_error")
+        bru.verbose = 0
+        bru.workers = workers
+        bru.pipeline_memory_mb = pipeline_memory_mb
+        bru.scans_list = ["1", "42"]
+        bru.list_new_name_each_scan = ["banana_error_" + s for s in bru.scans_list]
+
+        with pytest.raises(IOError):
+            bru.convert()
+
+
+def test_convert_the_banana_geometry_only_without_2dseq(tmp_path):
+
+    # banana study without the 2dseq of its first scan: its geometry does not need it.
+    pfo_study_in = str(tmp_path / "bru_banana")
+    shutil.copytree(os.path.join(root_dir, "test_data", "bru_banana"), pfo_study_in)
+    os.remove(os.path.join(pfo_study_in, "1", "pdata", "1", "2dseq"))
+    pfo_study_out = str(tmp_path / "nifti_banana")
+    os.mkdir(pfo_study_out)
+
+    bru = Bruker2Nifti(pfo_study_in, pfo_study_out, study_name="banana")
+    bru.verbose = 0
+    bru.geometry_only = True
+    bru.convert()
+
+    for ex in ["1", "2", "3"]:
+        experiment_folder = os.path.join(
+            pfo_study_out, "banana", "banana_{}".format(ex)
+        )
+        assert os.path.exists(
+            os.path.join(experiment_folder, "banana_{}.nii".format(ex))
+        )
+        assert os.path.exists(
+            os.path.join(experiment_folder, "banana_{}_geometry.json".format(ex))
+        )
+
+
+def test_convert_many_bananas(tmp_path):
+
+    pfo_root_in = str(tmp_path / "batch_in")
+    pfo_root_out = str(tmp_path / "batch_out")
+    os.mkdir(pfo_root_out)
+
+    # two sessions of the same subject, and a broken study, in nested folders:
+    original_study_in = os.path.join(root_dir, "test_data", "bru_banana")
+    shutil.copytree(original_study_in, os.path.join(pfo_root_in, "2011", "session1"))
+    shutil.copytree(original_study_in, os.path.join(pfo_root_in, "2011", "session2"))
+    pfo_bad_study = os.path.join(pfo_root_in, "2012", "bad")
+    shutil.copytree(original_study_in, pfo_bad_study)
+    with open(os.path.join(pfo_bad_study, "2", "pdata", "1", "2dseq"), "wb") as f:
+        f.write(b"truncated")
+
+    studies_list = get_list_studies(pfo_root_in)
+    assert studies_list == [
+        os.path.join(pfo_root_in, "2011", "session1"),
+        os.path.join(pfo_root_in, "2011", "session2"),
+        os.path.join(pfo_root_in, "2012", "bad"),
+    ]
+
+    pfi_report = os.path.join(pfo_root_out, "report.json")
+    report = convert_many(
+        pfo_root_in,
+        pfo_root_out,
+        workers=4,
+        # settings set before exploring the studies, and not stopping the batch at the first error.
+        settings={
+            "correct_slope": True,
+            "verbose": 0,
+            "scans_list": ["1", "2"],
+            "continue_on_error": False,
+        },
+        pfi_report=pfi_report,
+    )
+
+    assert list(report.keys()) == studies_list
+    assert report[studies_list[0]]["output"] == os.path.join(
+        pfo_root_out, "APMFruits20111130"
+    )
+    assert report[studies_list[1]]["output"] == os.path.join(
+        pfo_root_out, "APMFruits20111130session2"
+    )
+    for study in studies_list[:2]:
+        assert report[study]["status"] == "converted"
+        assert list(report[study]["scans"].keys()) == ["1", "2"]
+        study_name = os.path.basename(report[study]["output"])
+        for scan, result in report[study]["scans"].items():
+            assert result["status"] == "converted"
+            assert os.path.basename(result["output"]) == study_name + "_" + scan
+            assert os.path.exists(result["output"])
+    assert report[studies_list[2]]["status"] == "failed"
+    assert report[studies_list[2]]["scans"]["1"]["status"] == "converted"
+    assert report[studies_list[2]]["scans"]["2"]["status"] == "failed"
+
+    with open(pfi_report) as f:
+        assert list(json.load(f).keys()) == studies_list
+
+
+def test_convert_the_banana_incremental(tmp_path):
+
+    pfo_study_in = str(tmp_path / "incremental_in")
+    pfo_study_out = str(tmp_path / "nifti_banana")
+    os.mkdir(pfo_study_out)
+
+    # copy of the test data, to be modified between conversions
+    shutil.copytree(os.path.join(root_dir, "test_data", "bru_banana"), pfo_study_in)
+    target_folder = os.path.join(pfo_study_out, "banana_incremental")
+
+    def convert_incremental():
+        bru = Bruker2Nifti(pfo_study_in, pfo_study_out, study_name="banana_incremental")
+        bru.correct_slope = True
+        bru.verbose = 0
+        bru.incremental = True
+        return bru.convert()
+
+    report = convert_incremental()
+    assert [r["status"] for r in report.values()] == ["converted"] * 3
+    assert os.path.exists(os.path.join(target_folder, "bruker2nifti_manifest.json"))
+
+    # nothing changed: nothing is converted again
+    report = convert_incremental()
+    assert [r["status"] for r in report.values()] == ["skipped"] * 3
+
+    # scan 2 changed and an output of scan 3 removed: only those are converted again
+    pfi_visu_pars = os.path.join(pfo_study_in, "2", "pdata", "1", "visu_pars")
+    stat = os.stat(pfi_visu_pars)
+    os.utime(pfi_visu_pars, (stat.st_atime, stat.st_mtime + 10))
+    os.remove(
+        os.path.join(
+            target_folder, "banana_incremental_3", "banana_incremental_3.nii.gz"
+        )
+    )
+
+    report = convert_incremental()
+    assert [r["status"] for r in report.values()] == [
+        "skipped",
+        "converted",
+        "converted",
+    ]
+    assert os.path.exists(
+        os.path.join(
+            target_folder, "banana_incremental_3", "banana_incremental_3.nii.gz"
+        )
+    )
+
+    # a non incremental conversion still refuses to overwrite the study
+    bru = Bruker2Nifti(pfo_study_in, pfo_study_out, study_name="banana_incremental")
+    bru.verbose = 0
+    if sys.version_info.major == 2:
+        with pytest.raises(OSError):
+            bru.convert()
+    else:
+        with pytest.raises(FileExistsError):
+            bru.convert()
+
+
+def test_convert_the_banana_pipelined(tmp_path):
+
+    pfo_study_in = os.path.join(root_dir, "test_data", "bru_banana")
+    pfo_study_out = str(tmp_path)
+
+    reports = {}
+    for study_name, pipeline_memory_mb in [
+        ("banana_sequential", None),
+        # smaller than a single scan: scans are still converted, one at the time.
+        ("banana_pipelined", 0.1),
+        ("banana_pipelined_large", 100),
+    ]:
+        bru = Bruker2Nifti(pfo_study_in, pfo_study_out, study_name=study_name)
+        bru.correct_slope = True
+        bru.verbose = 0
+        bru.record_timings = True
+        bru.pipeline_memory_mb = pipeline_memory_mb
+        bru.continue_on_error = True
+        bru.scans_list = ["1", "2", "42", "3"]
+        bru.list_new_name_each_scan = [study_name + "_" + s for s in bru.scans_list]
+        reports[study_name] = bru.convert()
+
+    for study_name in ["banana_pipelined", "banana_pipelined_large"]:
+        report = reports[study_name]
+        assert list(report.keys()) == ["1", "2", "42", "3"]
+        assert report["42"]["status"] == "failed"
+        for ex in ["1", "2", "3"]:
+            assert report[ex]["status"] == "converted"
+            assert "load_data" in report[ex]["timings"]
+            im_sequential = nib.load(
+                os.path.join(
+                    pfo_study_out,
+                    "banana_sequential",
+                    "banana_sequential_" + ex,
+                    "banana_sequential_" + ex + ".nii.gz",
+                )
+            )
+            im_pipelined = nib.load(
+                os.path.join(report[ex]["output"], study_name + "_" + ex + ".nii.gz")
+            )
+            assert_array_equal(im_sequential.affine, im_pipelined.affine)
+            assert_array_equal(im_sequential.get_fdata(), im_pipelined.get_fdata())
@@ -1,11 +1,33 @@
+import gc
+import json
 import os
+import shutil
+import weakref
 import numpy as np
+import nibabel as nib
 import warnings
 import sys
 
-from numpy.testing import assert_array_equal, assert_equal
+if sys.version_info >= (3, 3):
+    import unittest.mock as mock
+else:
+    import mock as mock
 
-from bruker2nifti._cores import scan2struct, write_struct
+from numpy.testing import (
+    assert_allclose,
+    assert_almost_equal,
+    assert_array_equal,
+    assert_equal,
+)
+
+import bruker2nifti._cores as cores
+from bruker2nifti._cores import (
+    scan2struct,
+    write_struct,
+    struct_geometry,
+    iter_scan_recons,
+)
+from bruker2nifti._utils import CorrectedArrayProxy, StageTimer
 
 here = os.path.abspath(os.path.dirname(__file__))
 root_dir = os.path.dirname(here)
@@ -77,3 +99,299 @@ def test_write_struct():
 
     assert os.path.exists(os.path.join(pfo_output, "acquisition_method.txt"))
     assert os.path.exists(os.path.join(pfo_output, "test.nii.gz"))
+
+
+def test_scan2struct_memory_maps_uncorrected_data():
+
+    pfo_scan_in = os.path.join(root_dir, "test_data", "bru_banana", "1")
+
+    struct_no_slope_corrected = scan2struct(
+        pfo_scan_in, correct_slope=False, correct_offset=False
+    )
+    struct_yes_slope_corrected = scan2struct(pfo_scan_in, correct_slope=True)
+
+    data_no_slope = struct_no_slope_corrected["nib_scans_list"][0].dataobj
+    data_yes_slope = struct_yes_slope_corrected["nib_scans_list"][0].dataobj
+
+    # the raw data are not copied in memory, corrected data are.
+    assert isinstance(data_no_slope, np.memmap)
+    assert data_no_slope.filename.endswith("2dseq")
+    assert getattr(data_yes_slope, "filename", None) is None
+    assert_equal(data_yes_slope.dtype, np.float64)
+
+
+def test_write_struct_streamed_in_chunks(tmp_path):
+
+    pfo_scan_in = os.path.join(root_dir, "test_data", "bru_banana", "1")
+    pfo_output = str(tmp_path)
+
+    banana_struct = scan2struct(pfo_scan_in, correct_slope=True)
+    banana_struct_lazy = scan2struct(
+        pfo_scan_in, correct_slope=True, lazy_correction=True
+    )
+
+    assert isinstance(
+        banana_struct_lazy["nib_scans_list"][0].dataobj, CorrectedArrayProxy
+    )
+
+    write_struct(banana_struct, pfo_output, fin_scan="test_in_memory")
+    # chunks smaller than a single slice
+    write_struct(
+        banana_struct_lazy, pfo_output, fin_scan="test_streamed", chunk_size=100
+    )
+
+    im_in_memory = nib.load(os.path.join(pfo_output, "test_in_memory.nii.gz"))
+    im_streamed = nib.load(os.path.join(pfo_output, "test_streamed.nii.gz"))
+
+    assert_array_equal(im_in_memory.affine, im_streamed.affine)
+    assert_equal(im_in_memory.get_data_dtype(), im_streamed.get_data_dtype())
+    assert_array_equal(im_in_memory.get_fdata(), im_streamed.get_fdata())
+
+
+def test_write_struct_uncompressed(tmp_path):
+
+    pfo_scan_in = os.path.join(root_dir, "test_data", "bru_banana", "1")
+    pfo_output = str(tmp_path)
+
+    banana_struct = scan2struct(pfo_scan_in, correct_slope=True)
+    write_struct(
+        banana_struct, pfo_output, fin_scan="test_uncompressed", compress_output=False
+    )
+    write_struct(
+        banana_struct, pfo_output, fin_scan="test_compressed", compression_threads=2
+    )
+
+    im_uncompressed = nib.load(os.path.join(pfo_output, "test_uncompressed.nii"))
+    im_compressed = nib.load(os.path.join(pfo_output, "test_compressed.nii.gz"))
+
+    assert_array_equal(im_uncompressed.affine, im_compressed.affine)
+    assert_array_equal(im_uncompressed.get_fdata(), im_compressed.get_fdata())
+
+
+def test_scan2struct_write_struct_timings(tmp_path):
+
+    pfo_scan_in = os.path.join(root_dir, "test_data", "bru_banana", "1")
+    pfo_output = str(tmp_path)
+
+    timer = StageTimer()
+    banana_struct = scan2struct(pfo_scan_in, correct_slope=True, timer=timer)
+    write_struct(banana_struct, pfo_output, fin_scan="test_timings", timer=timer)
+
+    report = timer.report()
+
+    for stage in [
+        "parse_parameters",
+        "read_2dseq",
+        "slope_correction",
+        "affine",
+        "write_parameters",
+        "write_human_readable",
+        "write_nifti",
+    ]:
+        assert stage in report
+    # the 2dseq is only mapped: its bytes are read by the slope correction.
+    assert_equal(report["read_2dseq"]["bytes_read"], 0)
+    assert report["read_2dseq"]["mb_per_second"] is None
+    assert_equal(
+        report["slope_correction"]["bytes_read"],
+        os.path.getsize(os.path.join(pfo_scan_in, "pdata", "1", "2dseq")),
+    )
+    assert_equal(
+        report["write_nifti"]["bytes_written"],
+        os.path.getsize(os.path.join(pfo_output, "test_timings.nii.gz")),
+    )
+
+
+def test_scan2struct_write_struct_integer_output(tmp_path):
+
+    pfo_scan_in = os.path.join(root_dir, "test_data", "bru_banana", "1")
+    pfo_output = str(tmp_path)
+
+    banana_struct = scan2struct(pfo_scan_in, correct_slope=True, correct_offset=True)
+    integer_struct = scan2struct(
+        pfo_scan_in, correct_slope=True, correct_offset=True, integer_output=True
+    )
+
+    # the banana has the same slope in all the frames: the raw data are kept.
+    integer_im = integer_struct["nib_scans_list"][0]
+    assert isinstance(integer_im.dataobj, np.memmap)
+    assert_equal(integer_im.get_data_dtype(), np.int16)
+    slope = integer_struct["visu_pars_list"][0]["VisuCoreDataSlope"][0]
+    assert_almost_equal(integer_im.header.get_slope_inter(), (slope, 0), decimal=5)
+
+    write_struct(banana_struct, pfo_output, fin_scan="test_float_output")
+    write_struct(integer_struct, pfo_output, fin_scan="test_integer_output")
+
+    float_im = nib.load(os.path.join(pfo_output, "test_float_output.nii.gz"))
+    integer_im = nib.load(os.path.join(pfo_output, "test_integer_output.nii.gz"))
+    assert_equal(integer_im.get_data_dtype(), np.int16)
+    assert_array_equal(
+        np.asanyarray(integer_im.dataobj.get_unscaled()),
+        np.asanyarray(integer_struct["nib_scans_list"][0].dataobj),
+    )
+    # scl_slope is stored in single precision.
+    assert_allclose(integer_im.get_fdata(), float_im.get_fdata(), rtol=1e-7)
+    assert os.path.getsize(
+        os.path.join(pfo_output, "test_integer_output.nii.gz")
+    ) < os.path.getsize(os.path.join(pfo_output, "test_float_output.nii.gz"))
+
+
+def test_scan2struct_write_struct_geometry_only(tmp_path):
+
+    pfo_scan_in = os.path.join(root_dir, "test_data", "bru_banana", "2")
+    pfo_output = str(tmp_path)
+
+    timer = StageTimer()
+    geometry_struct = scan2struct(
+        pfo_scan_in, correct_slope=True, geometry_only=True, timer=timer
+    )
+    banana_struct = scan2struct(pfo_scan_in, correct_slope=True)
+
+    # the 2dseq is not read, and the images take no memory.
+    assert "read_2dseq" not in timer.report()
+    geometry_im = geometry_struct["nib_scans_list"][0]
+    banana_im = banana_struct["nib_scans_list"][0]
+    assert_equal(geometry_im.dataobj.strides, (0,) * geometry_im.ndim)
+
+    assert_equal(geometry_im.shape, banana_im.shape)
+    assert_equal(geometry_im.get_data_dtype(), banana_im.get_data_dtype())
+    assert_array_equal(geometry_im.affine, banana_im.affine)
+    assert_equal(struct_geometry(geometry_struct), struct_geometry(banana_struct))
+
+    write_struct(
+        geometry_struct,
+        pfo_output,
+        fin_scan="test_geometry",
+        compress_output=True,
+        geometry_only=True,
+    )
+
+    pfi_stub = os.path.join(pfo_output, "test_geometry.nii")
+    assert_equal(os.path.getsize(pfi_stub), 352)
+    stub = nib.load(pfi_stub)
+    assert_equal(stub.shape, banana_im.shape)
+    assert_equal(stub.get_data_dtype(), banana_im.get_data_dtype())
+    assert_array_equal(stub.affine, banana_im.affine)
+    assert_equal(stub.header.get_sform(coded=True)[1], 2)
+
+    with open(os.path.join(pfo_output, "test_geometry_geometry.json")) as f:
+        geometry = json.load(f)
+    assert_equal(len(geometry), 1)
+    assert_equal(geometry[0]["shape"], list(banana_im.shape))
+    assert_equal(geometry[0]["dtype"], "float64")
+    assert_array_equal(geometry[0]["affine"], banana_im.affine)
+
+
+def test_iter_scan_recons_one_at_a_time(tmp_path):
+
+    pfo_tmp = str(tmp_path)
+    # banana scan with 3 reconstructions
+    pfo_scan_in = os.path.join(pfo_tmp, "1")
+    shutil.copytree(os.path.join(root_dir, "test_data", "bru_banana", "1"), pfo_scan_in)
+    for recon in ["2", "3"]:
+        shutil.copytree(
+            os.path.join(pfo_scan_in, "pdata", "1"),
+            os.path.join(pfo_scan_in, "pdata", recon),
+        )
+    pfo_output = os.path.join(pfo_tmp, "output")
+    os.mkdir(pfo_output)
+
+    recons = iter_scan_recons(pfo_scan_in, correct_slope=True)
+    visu_pars, nib_im = next(recons)
+    assert_equal(nib_im.shape, (80, 64, 5))
+    first_im = weakref.ref(nib_im)
+    del nib_im
+    visu_pars, nib_im = next(recons)
+    gc.collect()
+    # the first image is not held by the generator once the second one is created.
+    assert first_im() is None
+    visu_pars, nib_im = next(recons)
+    assert next(recons, None) is None
+
+    with mock.patch.object(
+        cores, "bruker_read_files", side_effect=cores.bruker_read_files
+    ) as mock_read:
+        iterated_struct = scan2struct(
+            pfo_scan_in, correct_slope=True, iterate_recons=True
+        )
+        assert not isinstance(iterated_struct["nib_scans_list"], list)
+        assert_equal(len(iterated_struct["visu_pars_list"]), 3)
+        write_struct(iterated_struct, pfo_output, fin_scan="iterated")
+    # the visu_pars of each sub-scan is parsed only once.
+    visu_pars_reads = [c for c in mock_read.call_args_list if c[0][0] == "visu_pars"]
+    assert_equal(len(visu_pars_reads), 3)
+    write_struct(
+        scan2struct(pfo_scan_in, correct_slope=True), pfo_output, fin_scan="listed"
+    )
+
+    for i in range(3):
+        iterated_im = nib.load(
+            os.path.join(pfo_output, "iterated_subscan_{}.nii.gz".format(i))
+        )
+        listed_im = nib.load(
+            os.path.join(pfo_output, "listed_subscan_{}.nii.gz".format(i))
+        )
+        assert_array_equal(iterated_im.get_fdata(), listed_im.get_fdata())
+        assert_array_equal(iterated_im.affine, listed_im.affine)
+
+    # a sub-scan without its 2dseq: the scan is not converted, before any of its sub-scans is created.
+    os.remove(os.path.join(pfo_scan_in, "pdata", "3", "2dseq"))
+    with warnings.catch_warnings(record=True):
+        warnings.simplefilter("always")
+        assert scan2struct(pfo_scan_in, correct_slope=True, iterate_recons=True) is None
+        assert scan2struct(pfo_scan_in, correct_slope=True) is None
+
+
+def test_write_struct_write_threads(tmp_path):
+
+    pfo_tmp = str(tmp_path)
+    # banana scan with 4 reconstructions
+    pfo_scan_in = os.path.join(pfo_tmp, "1")
+    shutil.copytree(os.path.join(root_dir, "test_data", "bru_banana", "1"), pfo_scan_in)
+    for recon in ["2", "3", "4"]:
+        shutil.copytree(
+            os.path.join(pfo_scan_in, "pdata", "1"),
+            os.path.join(pfo_scan_in, "pdata", recon),
+        )
+    pfo_serial = os.path.join(pfo_tmp, "serial")
+    pfo_threads = os.path.join(pfo_tmp, "threads")
+    os.mkdir(pfo_serial)
+    os.mkdir(pfo_threads)
+
+    write_struct(
+        scan2struct(pfo_scan_in, correct_slope=True, iterate_recons=True),
+        pfo_serial,
+        fin_scan="banana",
+    )
+    timer = StageTimer()
+    write_struct(
+        scan2struct(pfo_scan_in, correct_slope=True, iterate_recons=True),
+        pfo_threads,
+        fin_scan="banana",
+        write_threads=3,
+        timer=timer,
+    )
+
+    assert_equal(sorted(os.listdir(pfo_threads)), sorted(os.listdir(pfo_serial)))
+    for filename in os.listdir(pfo_serial):
+        if filename.endswith(".nii.gz"):
+            serial_im = nib.load(os.path.join(pfo_serial, filename))
+            threads_im = nib.load(os.path.join(pfo_threads, filename))
+            assert_array_equal(threads_im.get_fdata(), serial_im.get_fdata())
+            assert_array_equal(threads_im.affine, serial_im.affine)
+        else:
+            with open(os.path.join(pfo_serial, filename), "rb") as f:
+                serial_content = f.read()
+            with open(os.path.join(pfo_threads, filename), "rb") as f:
+                assert f.read() == serial_content
+
+    report = timer.report()
+    assert_equal(report["write_nifti"]["calls"], 4)
+    assert_equal(
+        report["write_nifti"]["bytes_written"],
+        sum(
+            os.path.getsize(os.path.join(pfo_threads, filename))
+            for filename in os.listdir(pfo_threads)
+            if filename.endswith(".nii.gz")
+        ),
+    )
@@ -5,7 +5,18 @@ import sys
 
 from numpy.testing import assert_array_equal, assert_equal, assert_raises
 
-from bruker2nifti._getters import get_stack_direction_from_VisuCorePosition
+from bruker2nifti._getters import (
+    get_stack_direction_from_VisuCorePosition,
+    get_data_dtype_from_visu_pars,
+    get_frame_groups_from_visu_pars,
+    reorder_frame_groups,
+    get_list_scans,
+    get_folder_tree,
+)
+from bruker2nifti._utils import CorrectedArrayProxy
+
+here = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.dirname(here)
 
 
 def test_get_stack_direction_from_VisuCorePosition_OK_dummy_multiple_cases():
@@ -153,3 +164,159 @@ def test_get_stack_direction_from_VisuCorePosition_wrong_sub_volumes():
     )
     with assert_raises(IOError):
         get_stack_direction_from_VisuCorePosition(visu_core_position_, 2)
+
+
+def test_get_data_dtype_from_visu_pars():
+    dt = get_data_dtype_from_visu_pars(
+        {"VisuCoreWordType": "_16BIT_SGN_INT", "VisuCoreByteOrder": "littleEndian"}
+    )
+    assert_equal(dt, np.dtype("<i2"))
+    dt = get_data_dtype_from_visu_pars(
+        {"VisuCoreWordType": "_32BIT_FLOAT", "VisuCoreByteOrder": "bigEndian"}
+    )
+    assert_equal(dt, np.dtype(">f4"))
+    # big endian when the byte order is not specified
+    dt = get_data_dtype_from_visu_pars({"VisuCoreWordType": "_32BIT_SGN_INT"})
+    assert_equal(dt, np.dtype(">i4"))
+    with assert_raises(IOError):
+        get_data_dtype_from_visu_pars({"VisuCoreWordType": "_64BIT_SPAM"})
+
+
+def test_get_frame_groups_from_visu_pars():
+    visu_pars = {
+        "VisuFGOrderDescDim": 2,
+        "VisuFGOrderDesc": ["(4, <FG_ECHO>, <>, 0, 2)", "(3, <FG_SLICE>, <>, 2, 2)"],
+    }
+    assert_equal(
+        get_frame_groups_from_visu_pars(visu_pars), [(4, "FG_ECHO"), (3, "FG_SLICE")]
+    )
+    # a single frame group is parsed as a string
+    visu_pars = {
+        "VisuFGOrderDescDim": 1,
+        "VisuFGOrderDesc": "(5, <FG_SLICE>, <>, 0, 2)",
+    }
+    assert_equal(get_frame_groups_from_visu_pars(visu_pars), [(5, "FG_SLICE")])
+    assert_equal(get_frame_groups_from_visu_pars({"VisuFGOrderDescDim": 0}), [])
+    assert_equal(get_frame_groups_from_visu_pars({}), [])
+
+
+def test_reorder_frame_groups_msme():
+    # 3 slices and 4 echoes, echoes varying fastest in the frames:
+    vol_data = np.random.normal(size=(5, 6, 12))
+    frame_groups = [(4, "FG_ECHO"), (3, "FG_SLICE")]
+
+    stack_data = reorder_frame_groups(vol_data, [5, 6], frame_groups)
+
+    assert_equal(stack_data.shape, (5, 6, 3, 4))
+    assert np.shares_memory(stack_data, vol_data)
+    for t in range(4):
+        for z in range(3):
+            assert_array_equal(stack_data[:, :, z, t], vol_data[:, :, z * 4 + t])
+
+
+def test_reorder_frame_groups_slice_first_and_many_groups():
+    # slice first (e.g. DTI): a reshape is enough.
+    vol_data = np.random.normal(size=(5, 6, 12))
+    stack_data = reorder_frame_groups(
+        vol_data, [5, 6], [(3, "FG_SLICE"), (4, "FG_MOVIE")]
+    )
+    assert_array_equal(stack_data, vol_data.reshape(5, 6, 3, 4, order="F"))
+
+    # echo, then slice, then cycle: slice moved first, the others keep their order.
+    vol_data = np.random.normal(size=(5, 6, 24))
+    stack_data = reorder_frame_groups(
+        vol_data, [5, 6], [(2, "FG_ECHO"), (3, "FG_SLICE"), (4, "FG_CYCLE")]
+    )
+    assert_equal(stack_data.shape, (5, 6, 3, 2, 4))
+    for e in range(2):
+        for z in range(3):
+            for c in range(4):
+                assert_array_equal(
+                    stack_data[:, :, z, e, c], vol_data[:, :, e + 2 * z + 6 * c]
+                )
+
+    # corrected data are reordered as the raw ones, and corrected when accessed.
+    vol_data = np.arange(5 * 6 * 12, dtype=np.int16).reshape(5, 6, 12, order="F")
+    proxy = CorrectedArrayProxy(vol_data, slope=np.full(vol_data.shape, 2.0))
+    stack_proxy = reorder_frame_groups(proxy, [5, 6], [(4, "FG_ECHO"), (3, "FG_SLICE")])
+    assert isinstance(stack_proxy, CorrectedArrayProxy)
+    assert_array_equal(
+        np.asarray(stack_proxy),
+        2.0 * reorder_frame_groups(vol_data, [5, 6], [(4, "FG_ECHO"), (3, "FG_SLICE")]),
+    )
+
+
+def test_reorder_frame_groups_without_echo():
+    # slice, then diffusion (e.g. DTI): a reshape is enough.
+    vol_data = np.random.normal(size=(5, 6, 12))
+    stack_data = reorder_frame_groups(
+        vol_data, [5, 6], [(3, "FG_SLICE"), (4, "FG_DIFFUSION")]
+    )
+    assert_equal(stack_data.shape, (5, 6, 3, 4))
+    for z in range(3):
+        for d in range(4):
+            assert_array_equal(stack_data[:, :, z, d], vol_data[:, :, z + 3 * d])
+
+    # cycle, then slice: slice swapped with cycle, the frames are split in this order.
+    stack_data = reorder_frame_groups(
+        vol_data, [5, 6], [(4, "FG_CYCLE"), (3, "FG_SLICE")]
+    )
+    assert_equal(stack_data.shape, (5, 6, 3, 4))
+    assert np.shares_memory(stack_data, vol_data)
+    for z in range(3):
+        for c in range(4):
+            assert_array_equal(stack_data[:, :, z, c], vol_data[:, :, z + 3 * c])
+
+    # frame groups not matching the frames: nothing to reorder.
+    assert (
+        reorder_frame_groups(vol_data, [5, 6], [(5, "FG_CYCLE"), (3, "FG_SLICE")])
+        is vol_data
+    )
+
+    with assert_raises(IOError):
+        reorder_frame_groups(vol_data, [5, 6], [(4, "FG_CYCLE"), (3, "FG_MOVIE")])
+
+
+def test_get_list_scans(capsys):
+    pfo_study = os.path.join(root_dir, "test_data", "bru_banana")
+
+    assert_equal(get_list_scans(pfo_study, print_structure=False), ["1", "2", "3"])
+    assert_equal(capsys.readouterr().out, "")
+    assert_equal(
+        get_list_scans(os.path.join(pfo_study, "1", "pdata"), print_structure=False),
+        ["1"],
+    )
+    assert_equal(get_list_scans(os.path.join(pfo_study, "spam")), [])
+
+    # the tree is printed only on demand
+    assert_equal(get_list_scans(pfo_study), ["1", "2", "3"])
+    printed = capsys.readouterr().out
+    assert printed.startswith("bru_banana/\n")
+    assert "        pdata/\n" in printed
+    assert "                2dseq\n" in printed
+
+
+def test_get_folder_tree_cached(tmp_path):
+    pfo_study = str(tmp_path / "tree")
+    os.makedirs(os.path.join(pfo_study, "1", "pdata", "1"))
+
+    tree = get_folder_tree(pfo_study)
+    assert_equal(
+        [dirpath for dirpath, _, _ in tree],
+        [
+            pfo_study,
+            os.path.join(pfo_study, "1"),
+            os.path.join(pfo_study, "1", "pdata"),
+            os.path.join(pfo_study, "1", "pdata", "1"),
+        ],
+    )
+
+    # a change deep in the tree is seen only without cache, the default
+    open(os.path.join(pfo_study, "1", "pdata", "1", "2dseq"), "w").close()
+    assert_equal(get_folder_tree(pfo_study, use_cache=True)[-1][2], [])
+    assert_equal(get_folder_tree(pfo_study)[-1][2], ["2dseq"])
+
+    # a change of the folder itself updates the cached listing
+    os.makedirs(os.path.join(pfo_study, "2"))
+    os.utime(pfo_study, (0, os.stat(pfo_study).st_mtime + 10))
+    assert_equal(sorted(get_folder_tree(pfo_study, use_cache=True)[0][1]), ["1", "2"])
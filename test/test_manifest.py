@@ -0,0 +1,57 @@
+import os
+
+from numpy.testing import assert_equal
+
+from bruker2nifti._manifest import ConversionManifest, files_signature
+
+here = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.dirname(here)
+
+
+def test_conversion_manifest(tmp_path):
+
+    pfo_scan_bruker = os.path.join(root_dir, "test_data", "bru_banana", "1")
+    pfo_nifti_study = str(tmp_path)
+    pfo_scan_nifti = os.path.join(pfo_nifti_study, "scan_1")
+    os.makedirs(pfo_scan_nifti)
+    with open(os.path.join(pfo_scan_nifti, "scan_1.nii"), "w") as f:
+        f.write("spam")
+
+    settings = {"correct_slope": True, "corrected_dtype": "float64"}
+    result = {"output": pfo_scan_nifti, "status": "converted", "error": None}
+
+    manifest = ConversionManifest(pfo_nifti_study)
+    assert not manifest.is_up_to_date("1", pfo_scan_bruker, pfo_scan_nifti, settings)
+    manifest.record("1", pfo_scan_bruker, result, settings)
+    manifest.save()
+
+    # the manifest is read back from the output folder
+    manifest = ConversionManifest(pfo_nifti_study)
+    assert_equal(manifest.scans["1"]["inputs"], files_signature(pfo_scan_bruker))
+    assert manifest.is_up_to_date("1", pfo_scan_bruker, pfo_scan_nifti, settings)
+    assert not manifest.is_up_to_date(
+        "1", pfo_scan_bruker, pfo_scan_nifti, {"correct_slope": False}
+    )
+    assert not manifest.is_up_to_date(
+        "1", pfo_scan_bruker, os.path.join(pfo_nifti_study, "other"), settings
+    )
+    assert not manifest.is_up_to_date("2", pfo_scan_bruker, pfo_scan_nifti, settings)
+    assert_equal(manifest.verify_outputs("1"), [])
+
+    # same size, different content:
+    with open(os.path.join(pfo_scan_nifti, "scan_1.nii"), "w") as f:
+        f.write("eggs")
+    assert_equal(manifest.verify_outputs("1"), ["scan_1.nii"])
+
+    # failed scans are never up to date
+    manifest.record("1", pfo_scan_bruker, dict(result, status="failed"), settings)
+    assert not manifest.is_up_to_date("1", pfo_scan_bruker, pfo_scan_nifti, settings)
+
+
+def test_conversion_manifest_unreadable(tmp_path):
+
+    pfo_nifti_study = str(tmp_path)
+    with open(os.path.join(pfo_nifti_study, ConversionManifest.filename), "w") as f:
+        f.write('{"scans": {"1": ')
+
+    assert_equal(ConversionManifest(pfo_nifti_study).scans, {})
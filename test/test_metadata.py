@@ -1,7 +1,10 @@
 import os
 import sys
 
-from bruker2nifti._metadata import BrukerMetadata
+import numpy as np
+
+import bruker2nifti._utils as utils
+from bruker2nifti._metadata import BrukerMetadata, LazyParamFile, MetadataIndex
 from bruker2nifti._utils import bruker_read_files
 
 if sys.version_info >= (3, 3):
@@ -156,3 +159,105 @@ class TestMetadata(object):
             m.parse_subject()
             assert m.subject_data == expected_contents
             mock_read_subject.assert_called_once()
+
+    def test_read_scans_with_index(self, tmp_path):
+        pfo_index = str(tmp_path / "index")
+        index = MetadataIndex(pfo_index)
+        expected_scans = BrukerMetadata(banana_data).read_scans()
+
+        # first reading parses the files and fills the index
+        scans = BrukerMetadata(banana_data, index=index).read_scans()
+        with mock.patch.object(
+            utils.param_files_cache, "read", side_effect=utils.param_files_cache.read
+        ) as mock_read:
+            scans_from_index = BrukerMetadata(banana_data, index=pfo_index).read_scans()
+            mock_read.assert_not_called()
+
+        for parsed in [scans, scans_from_index]:
+            assert set(parsed.keys()) == set(expected_scans.keys())
+            for scan in expected_scans:
+                expected = expected_scans[scan]
+                assert_same_param_files(parsed[scan]["acqp"], expected["acqp"])
+                assert_same_param_files(parsed[scan]["method"], expected["method"])
+                for recon in expected["recons"]:
+                    for param_file in ["reco", "visu_pars"]:
+                        assert_same_param_files(
+                            parsed[scan]["recons"][recon][param_file],
+                            expected["recons"][recon][param_file],
+                        )
+        index.close()
+
+    def test_read_scans_lazy(self):
+        with mock.patch("bruker2nifti._utils.bruker_read_files") as mock_function:
+            mock_function.configure_mock(side_effect=bruker_read_files)
+            m = BrukerMetadata(banana_data, lazy=True)
+            m.parse_scans()
+            mock_function.assert_not_called()
+            assert isinstance(m.scan_data["1"]["acqp"], LazyParamFile)
+            assert not m.scan_data["1"]["acqp"].loaded
+
+            method = m.scan_data["1"]["acqp"]["ACQ_method"]
+            mock_function.assert_called_once_with(
+                "acqp", os.path.join(banana_data, "1")
+            )
+            assert m.scan_data["1"]["acqp"].loaded
+            assert not m.scan_data["1"]["method"].loaded
+            assert not m.scan_data["1"]["recons"]["1"]["visu_pars"].loaded
+
+        expected_acqp = bruker_read_files("acqp", os.path.join(banana_data, "1"))
+        assert method == expected_acqp["ACQ_method"]
+        assert m.scan_data["1"]["acqp"].keys() == expected_acqp.keys()
+
+    def test_read_scan_selected_keys(self):
+        m = BrukerMetadata(banana_data, keys=["ACQ_method", "ScanTimeStr", "missing"])
+        scan = m.read_scan("1")
+        assert list(scan["acqp"].keys()) == ["ACQ_method"]
+        assert list(scan["method"].keys()) == ["ScanTimeStr"]
+        assert scan["recons"]["1"]["visu_pars"] == {}
+
+    def test_read_scan_keys_of_each_param_file(self):
+        keys = {
+            "acqp": ["ACQ_protocol_name", "ACQ_method"],
+            "method": ["ScanTimeStr"],
+        }
+        full_acqp = bruker_read_files("acqp", os.path.join(banana_data, "1"))
+        full_method = bruker_read_files("method", os.path.join(banana_data, "1"))
+        consumed = {}
+        parser = utils.bruker_param_lines_parser
+
+        def counting_parser(lines, keys=None):
+            name = os.path.basename(lines.name)
+            consumed[name] = 0
+
+            def counting_lines():
+                for line in lines:
+                    consumed[name] += 1
+                    yield line
+
+            return parser(counting_lines(), keys=keys)
+
+        utils.param_files_cache.clear()
+        with mock.patch.object(utils, "bruker_param_lines_parser", counting_parser):
+            scan = BrukerMetadata(banana_data, keys=keys).read_scan("1")
+
+        assert set(scan["acqp"].keys()) == set(keys["acqp"])
+        assert scan["acqp"]["ACQ_method"] == full_acqp["ACQ_method"]
+        assert scan["method"]["ScanTimeStr"] == full_method["ScanTimeStr"]
+        # each file is read only up to its own keys, the others are fully parsed.
+        pfi_acqp = os.path.join(banana_data, "1", "acqp")
+        pfi_method = os.path.join(banana_data, "1", "method")
+        assert consumed["acqp"] < sum(1 for _ in open(pfi_acqp))
+        assert consumed["method"] < sum(1 for _ in open(pfi_method))
+        assert scan["recons"]["1"]["visu_pars"].keys() == (
+            bruker_read_files("visu_pars", os.path.join(banana_data, "1")).keys()
+        )
+
+
+def assert_same_param_files(parsed, expected):
+    assert list(parsed.keys()) == list(expected.keys())
+    for k in expected:
+        if isinstance(expected[k], np.ndarray):
+            assert parsed[k].dtype == expected[k].dtype
+            np.testing.assert_array_equal(parsed[k], expected[k])
+        else:
+            assert parsed[k] == expected[k]
@@ -0,0 +1,300 @@
+import os
+
+import numpy as np
+
+from bruker2nifti._utils import (
+    bruker_read_files,
+    indians_file_parser,
+    unique_words_in_string,
+    var_name_clean,
+)
+
+here = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.dirname(here)
+
+jph = os.path.join
+
+
+# --- Reference implementation: the parser in use before bruker_param_lines_parser ---
+
+
+def legacy_indians_file_parser(s, sh=None):
+    """
+    indians_file_parser as it was before the single-pass parser.
+    """
+
+    s = s.strip()  # removes initial and final spaces.
+
+    # A
+    if ("(" in s) and (")" in s):
+        s = s[1:-1]  # removes initial and final ( )
+        a = ["(" + v + ")" for v in s.split(") (")]
+    # B
+    elif (
+        s.replace("-", "").replace(".", "").replace(" ", "").replace("e", "").isdigit()
+    ):
+        if " " in s:
+            a = np.array([float(x) for x in s.split()])
+            if sh is not None:
+                a = a.reshape(sh)
+        else:
+            a = float(s)
+    # B-bis
+    elif "inf" in s:
+        if "inf" == unique_words_in_string(s):
+            num_occurrences = sum("inf" == word for word in s.split())
+            a = [np.inf] * num_occurrences
+        else:
+            a = s[:]
+    # C
+    elif ("<" in s) and (">" in s):
+        s = s[1:-1]  # removes initial and final < >
+        a = [v for v in s.split("> <")]
+    # D
+    else:
+        a = s[:]
+
+    # added to work with ParaVision vers 6.0.1:
+    if isinstance(a, list):
+        if len(a) == 1:
+            a = a[0]
+
+    return a
+
+
+def legacy_bruker_read_files(param_file, data_path, sub_scan_num="1"):
+    """
+    bruker_read_files as it was before the single-pass parser.
+    """
+    if param_file.lower() == "reco":
+        if os.path.exists(jph(data_path, "pdata", str(sub_scan_num), "reco")):
+            f = open(jph(data_path, "pdata", str(sub_scan_num), "reco"), "r")
+        else:
+            print(
+                "File {} does not exist".format(
+                    jph(data_path, "pdata", str(sub_scan_num), "reco")
+                )
+            )
+            return {}
+    elif param_file.lower() == "acqp":
+        if os.path.exists(jph(data_path, "acqp")):
+            f = open(jph(data_path, "acqp"), "r")
+        else:
+            print("File {} does not exist".format(jph(data_path, "acqp")))
+            return {}
+    elif param_file.lower() == "method":
+        if os.path.exists(jph(data_path, "method")):
+            f = open(jph(data_path, "method"), "r")
+        else:
+            print("File {} does not exist".format(jph(data_path, "method")))
+            return {}
+    elif param_file.lower() == "visu_pars":
+        if os.path.exists(jph(data_path, "pdata", str(sub_scan_num), "visu_pars")):
+            f = open(jph(data_path, "pdata", str(sub_scan_num), "visu_pars"), "r")
+        elif os.path.exists(
+            jph(data_path, str(sub_scan_num), "pdata", "1", "visu_pars")
+        ):
+            f = open(jph(data_path, str(sub_scan_num), "pdata", "1", "visu_pars"), "r")
+        else:
+            print(
+                "File {} does not exist".format(
+                    jph(data_path, "pdata", str(sub_scan_num), "visu_pars")
+                )
+            )
+            return {}
+    elif param_file.lower() == "subject":
+        if os.path.exists(jph(data_path, "subject")):
+            f = open(jph(data_path, "subject"), "r")
+        else:
+            print("File {} does not exist".format(jph(data_path, "subject")))
+            return {}
+    else:
+        raise IOError(
+            "param_file input must be the string 'reco', 'acqp', 'method', 'visu_pars' or 'subject'"
+        )
+
+    dict_info = {}
+    lines = f.readlines()
+
+    for line_num in range(len(lines)):
+        """
+        Relevant information are in the lines with '##'.
+        For the parameters that have arrays values specified between (), with values in the next line.
+        Values in the next line can be parsed in lists or np.ndarray when they contains also characters or numbers.
+        """
+
+        line_in = lines[line_num]
+
+        if "##" in line_in:
+
+            if ("$" in line_in) and ("(" in line_in) and ("<" not in line_in):
+                # A:
+                splitted_line = line_in.split("=")
+                # name of the variable contained in the row, and shape:
+                var_name = var_name_clean(splitted_line[0][3:])
+
+                done = False
+                indian_file = ""
+                pos = line_num
+                sh = splitted_line[1]
+                # this is not the shape of the vector but the beginning of a full vector.
+                if sh.replace(" ", "").endswith(",\n"):
+                    sh = sh.replace("(", "").replace(")", "").replace("\n", "").strip()
+                    indian_file += sh
+                    sh = None
+                # this is not the shape of the vector but a full vector.
+                elif sh.replace(" ", "").endswith(")\n") and "." in sh:
+                    sh = sh.replace("(", "").replace(")", "").replace("\n", "").strip()
+                    indian_file += sh
+                    sh = None
+                # this is finally the shape of the vector that will start in the next line.
+                else:
+                    sh = sh.replace("(", "").replace(")", "").replace("\n", "").strip()
+                    sh = [int(num) for num in sh.split(",")]
+
+                while not done:
+
+                    pos += 1
+                    # collect the indian file: info related to the same variables that can appears on multiple rows.
+                    line_to_explore = lines[
+                        pos
+                    ]  # tell seek does not work in the line iterators...
+
+                    if ("##" in line_to_explore) or ("$$" in line_to_explore):
+                        # indian file is over
+                        done = True
+
+                    else:
+                        # we store the rows in the indian file all in the same string.
+                        indian_file += line_to_explore.replace("\n", "").strip() + " "
+
+                dict_info[var_name] = legacy_indians_file_parser(indian_file, sh)
+
+            elif ("$" in line_in) and ("(" not in line_in):
+                # B:
+                splitted_line = line_in.split("=")
+                var_name = var_name_clean(splitted_line[0][3:])
+                indian_file = splitted_line[1]
+
+                dict_info[var_name] = legacy_indians_file_parser(indian_file)
+
+            elif ("$" not in line_in) and ("(" in line_in):
+                # C:
+                splitted_line = line_in.split("=")
+                var_name = var_name_clean(splitted_line[0][2:])
+
+                done = False
+                indian_file = splitted_line[1].strip() + " "
+                pos = line_num
+
+                while not done:
+                    pos += 1
+                    # collect the indian file: info related to the same variables that can appears on multiple rows.
+                    line_to_explore = lines[
+                        pos
+                    ]  # tell seek does not work in the line iterators...
+                    if ("##" in line_to_explore) or ("$$" in line_to_explore):
+                        # indian file is over
+                        done = True
+                    else:
+                        # we store the rows in the indian file all in the same string.
+                        indian_file += line_to_explore.replace("\n", "").strip() + " "
+
+                dict_info[var_name] = legacy_indians_file_parser(indian_file)
+
+            elif ("$" not in line_in) and ("(" not in line_in):
+                # D:
+                splitted_line = line_in.split("=")
+                var_name = var_name_clean(splitted_line[0])
+                indian_file = splitted_line[1].replace("=", "").strip()
+                dict_info[var_name] = legacy_indians_file_parser(indian_file)
+
+            else:
+                # General case: take it as a simple string.
+                splitted_line = line_in.split("=")
+                var_name = var_name_clean(splitted_line[0])
+                dict_info[var_name] = (
+                    splitted_line[1]
+                    .replace("(", "")
+                    .replace(")", "")
+                    .replace("\n", "")
+                    .replace("<", "")
+                    .replace(">", "")
+                    .replace(",", " ")
+                    .strip()
+                )
+
+        else:
+            # line does not contain any 'assignable' variable, so this information is not included in the info.
+            pass
+
+    return dict_info
+
+
+# --- Compatibility tests ---
+
+
+def assert_same_parsed_value(value, expected):
+    assert type(value) == type(expected), (value, expected)
+    if isinstance(expected, np.ndarray):
+        assert value.dtype == expected.dtype
+        np.testing.assert_array_equal(value, expected)
+    elif isinstance(expected, list):
+        assert len(value) == len(expected)
+        for v, e in zip(value, expected):
+            assert_same_parsed_value(v, e)
+    else:
+        assert value == expected
+
+
+def test_indians_file_parser_same_as_legacy():
+
+    for s in [
+        "(1, 2) (3, 4)",
+        " 3.5 ",
+        "-2e-05",
+        "1 2 3 4 5 6",
+        "1. -2.5 3e-3 4 .5 6",
+        "inf inf inf",
+        "inf",
+        "inf and beyond",
+        "<one> <two> <three>",
+        "<one>",
+        "Some string",
+        "",
+        "- . e",
+    ]:
+        assert_same_parsed_value(indians_file_parser(s), legacy_indians_file_parser(s))
+
+    assert_same_parsed_value(
+        indians_file_parser("1 2 3 4 5 6", [3, 2]),
+        legacy_indians_file_parser("1 2 3 4 5 6", [3, 2]),
+    )
+
+
+def test_bruker_read_files_same_as_legacy_on_test_data():
+
+    num_files_compared = 0
+    for pfo, _, fis in os.walk(jph(root_dir, "test_data")):
+        for param_file in ["acqp", "method", "subject", "reco", "visu_pars"]:
+            if param_file not in fis:
+                continue
+            if param_file in ["reco", "visu_pars"]:
+                # pdata/<sub_scan_num>/param_file
+                pfo_scan = os.path.dirname(os.path.dirname(pfo))
+                sub_scan_num = os.path.basename(pfo)
+            else:
+                pfo_scan = pfo
+                sub_scan_num = "1"
+
+            parsed = bruker_read_files(param_file, pfo_scan, sub_scan_num=sub_scan_num)
+            expected = legacy_bruker_read_files(
+                param_file, pfo_scan, sub_scan_num=sub_scan_num
+            )
+
+            assert list(parsed.keys()) == list(expected.keys())
+            for k in expected.keys():
+                assert_same_parsed_value(parsed[k], expected[k])
+            num_files_compared += 1
+
+    assert num_files_compared > 0
@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+
+from numpy.testing import assert_array_equal, assert_equal, assert_raises
+
+from bruker2nifti._cores import scan2struct, write_struct
+from bruker2nifti._sidecar import read_sidecar, sidecar_paths, write_sidecar
+
+here = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.dirname(here)
+
+
+def test_write_read_sidecar(tmp_path):
+
+    pfo_output = str(tmp_path)
+
+    metadata = {
+        "method": {
+            "Matrix": np.array([80, 64]),
+            "SpatResol": np.array([0.2, 0.2]),
+            "Method": "FLASH",
+            "PVM_ScanTime": np.int64(60000),
+            "SPackArrSliceOrient": np.array(["axial"]),
+        },
+        "visu_pars": [{"VisuCoreOrientation": np.eye(3)}, {"VisuCoreSize": [2, 3]}],
+        "acquisition_method": "FLASH",
+    }
+    pfi_json, pfi_npz = sidecar_paths(pfo_output, "banana")
+    write_sidecar(metadata, pfi_json, pfi_npz)
+
+    # nothing pickled
+    with np.load(pfi_npz, allow_pickle=False) as npz:
+        assert_equal(
+            sorted(npz.files),
+            ["method/Matrix", "method/SpatResol", "visu_pars/0/VisuCoreOrientation"],
+        )
+
+    sidecar = read_sidecar(pfi_json)
+    assert_equal(sorted(sidecar.keys()), ["acquisition_method", "method", "visu_pars"])
+    assert_array_equal(sidecar["method"]["Matrix"], [80, 64])
+    assert_equal(sidecar["method"]["Matrix"].dtype, np.int64)
+    assert_array_equal(sidecar["method"]["SpatResol"], [0.2, 0.2])
+    assert_equal(sidecar["method"]["Method"], "FLASH")
+    assert_equal(sidecar["method"]["PVM_ScanTime"], 60000)
+    assert_equal(sidecar["method"]["SPackArrSliceOrient"], ["axial"])
+    assert_array_equal(sidecar["visu_pars"][0]["VisuCoreOrientation"], np.eye(3))
+    assert_equal(sidecar["visu_pars"][1]["VisuCoreSize"], [2, 3])
+
+    # arrays are read only when accessed
+    os.remove(pfi_npz)
+    sidecar = read_sidecar(pfi_json)
+    assert_equal(sidecar["acquisition_method"], "FLASH")
+    with assert_raises(IOError):
+        sidecar["method"]["Matrix"]
+
+
+def test_write_struct_metadata_sidecar(tmp_path):
+
+    pfo_scan_in = os.path.join(root_dir, "test_data", "bru_banana", "1")
+    pfo_output = str(tmp_path)
+
+    banana_struct = scan2struct(pfo_scan_in, correct_slope=True, get_method=True)
+    write_struct(
+        banana_struct, pfo_output, fin_scan="banana", metadata_format="sidecar"
+    )
+
+    # the images and the sidecar only.
+    assert_equal(
+        sorted(os.listdir(pfo_output)),
+        ["banana.nii.gz", "banana_metadata.json", "banana_metadata.npz"],
+    )
+
+    sidecar = read_sidecar(os.path.join(pfo_output, "banana_metadata.json"))
+    assert_equal(len(sidecar["visu_pars"]), 1)
+    for key, value in banana_struct["visu_pars_list"][0].items():
+        if isinstance(value, np.ndarray) and value.dtype.kind in "biufc":
+            assert_array_equal(sidecar["visu_pars"][0][key], value)
+    assert_array_equal(sidecar["method"]["Matrix"], banana_struct["method"]["Matrix"])
+    assert_equal(sidecar["acquisition_method"], banana_struct["acquisition_method"])
+    assert "visu_pars['VisuUid']" in sidecar["summary"]
+
+    with assert_raises(IOError):
+        write_struct(banana_struct, pfo_output, metadata_format="pickle")
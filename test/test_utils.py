@@ -1,4 +1,6 @@
+import gzip
 import os
+import shutil
 
 import numpy as np
 import nibabel as nib
@@ -14,20 +16,122 @@ from bruker2nifti._utils import (
     indians_file_parser,
     normalise_b_vect,
     data_corrector,
+    data_slope_offset_corrector,
+    get_broadcastable_factors,
+    get_uniform_scaling,
+    get_lossless_dtype,
+    CorrectedArrayProxy,
+    fortran_slabs,
+    ParallelGzipFile,
+    save_nifti,
+    WriteDispatcher,
+    memmap_file_region,
+    copy_file_region,
     eliminate_consecutive_duplicates,
     compute_resolution_from_visu_pars,
     compute_affine_from_visu_pars,
     apply_reorientation_to_b_vects,
     set_new_data,
+    extract_volumes,
     obtain_b_vectors_orient_matrix,
     path_contains_whitespace,
+    bruker_read_files,
+    bruker_param_lines_parser,
+    ParamFilesCache,
+    param_files_cache,
+    StageTimer,
 )
 from bruker2nifti.converter import Bruker2Nifti
 
+here = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.dirname(here)
+
 
 # --- TEST text-files utils ---
 
 
+def test_param_files_cache(tmp_path):
+
+    pfo_scan = str(tmp_path)
+    shutil.copy(
+        os.path.join(root_dir, "test_data", "bru_banana", "1", "acqp"), pfo_scan
+    )
+    shutil.copy(
+        os.path.join(root_dir, "test_data", "bru_banana", "1", "method"), pfo_scan
+    )
+    pfi_acqp = os.path.join(pfo_scan, "acqp")
+
+    param_files_cache.clear()
+    acqp = bruker_read_files("acqp", pfo_scan)
+    acqp["NR"] = "modified"
+    acqp_again = bruker_read_files("acqp", pfo_scan)
+    assert acqp_again["NR"] != "modified"
+    assert_equal(param_files_cache.info()["misses"], 1)
+    assert_equal(param_files_cache.info()["hits"], 1)
+
+    # a modified file is parsed again
+    stat = os.stat(pfi_acqp)
+    os.utime(pfi_acqp, (stat.st_atime, stat.st_mtime + 10))
+    bruker_read_files("acqp", pfo_scan)
+    assert_equal(param_files_cache.info()["misses"], 2)
+
+    param_files_cache.invalidate(pfi_acqp)
+    bruker_read_files("acqp", pfo_scan)
+    assert_equal(param_files_cache.info()["misses"], 3)
+    assert_equal(param_files_cache.info()["size"], 1)
+
+    # least recently used entries are evicted
+    cache = ParamFilesCache(maxsize=1)
+    cache.read(pfi_acqp)
+    cache.read(os.path.join(pfo_scan, "method"))
+    cache.read(pfi_acqp)
+    assert_equal(cache.info(), {"hits": 0, "misses": 3, "size": 1, "maxsize": 1})
+
+    disabled_cache = ParamFilesCache(maxsize=0)
+    disabled_cache.read(pfi_acqp)
+    disabled_cache.read(pfi_acqp)
+    assert_equal(disabled_cache.info()["size"], 0)
+    assert_equal(disabled_cache.info()["hits"], 0)
+
+
+def test_bruker_param_lines_parser_selected_keys():
+
+    pfi_visu_pars = os.path.join(
+        root_dir, "test_data", "bru_banana", "1", "pdata", "1", "visu_pars"
+    )
+    with open(pfi_visu_pars, "r") as f:
+        lines = f.readlines()
+    visu_pars = bruker_param_lines_parser(lines)
+    keys = ["VisuCoreSize", "VisuSubjectId", "VisuCoreDataSlope", "not_a_key"]
+
+    selected = bruker_param_lines_parser(lines, keys=keys)
+    assert_equal(set(selected.keys()), set(keys[:3]))
+    for k in keys[:3]:
+        assert_array_equal(selected[k], visu_pars[k])
+
+    # reading stops after the last requested key
+    consumed = []
+
+    def counting_lines():
+        for line in lines:
+            consumed.append(line)
+            yield line
+
+    selected = bruker_param_lines_parser(counting_lines(), keys=["VisuCoreSize"])
+    assert_array_equal(selected["VisuCoreSize"], visu_pars["VisuCoreSize"])
+    assert len(consumed) < len(lines)
+
+    # from the cache as well
+    param_files_cache.clear()
+    pfo_scan = os.path.join(root_dir, "test_data", "bru_banana", "1")
+    selected_not_cached = bruker_read_files("visu_pars", pfo_scan, keys=keys)
+    assert_equal(param_files_cache.info()["size"], 0)
+    bruker_read_files("visu_pars", pfo_scan)
+    selected_cached = bruker_read_files("visu_pars", pfo_scan, keys=keys)
+    assert_equal(param_files_cache.info()["hits"], 1)
+    assert_equal(set(selected_cached.keys()), set(selected_not_cached.keys()))
+
+
 def test_indians_file_parser_A():
 
     indian_file_test_1 = "('<VisuCoreOrientation>, 0') ('<VisuCorePosition>, 0')"
@@ -184,6 +288,95 @@ def test_slope_corrector_slice_wise_slope_5d_fail():
 test_slope_corrector_slice_wise_slope_5d_fail()
 
 
+def test_get_broadcastable_factors():
+
+    assert_equal(get_broadcastable_factors(2.0, [2, 3, 4]).shape, ())
+    assert_equal(get_broadcastable_factors(np.array([2.0]), [2, 3, 1]).shape, ())
+    assert_equal(get_broadcastable_factors(np.ones(4), [2, 3, 4]).shape, (1, 1, 4))
+    assert_equal(
+        get_broadcastable_factors(np.ones(4), [2, 3, 4, 5]).shape, (1, 1, 4, 1)
+    )
+    assert_equal(
+        get_broadcastable_factors(np.ones(5), [2, 3, 4, 5, 6]).shape, (1, 1, 1, 5, 1)
+    )
+    assert_equal(
+        get_broadcastable_factors(np.ones(5), [2, 3, 4, 5]).shape, (1, 1, 1, 5)
+    )
+    # consecutive duplicates are removed when not compatible
+    assert_equal(
+        get_broadcastable_factors(np.array([1, 1, 2, 2, 3.0]), [2, 3, 3]).shape,
+        (1, 1, 3),
+    )
+    assert get_broadcastable_factors([np.inf] * 4, [2, 3, 4], kind="offset") is None
+
+
+def test_slope_offset_corrector_slice_wise_4d():
+
+    in_data = np.random.randint(-100, 100, [2, 3, 4, 5]).astype(np.int16)
+    sl = np.random.normal(5, 10, 4)
+    of = np.random.normal(5, 10, 4)
+
+    out_data = data_slope_offset_corrector(in_data, slope=sl, offset=of)
+
+    assert_equal(out_data.dtype, np.float64)
+    for t in range(5):
+        for k in range(4):
+            assert_array_equal(out_data[..., k, t], in_data[..., k, t] * sl[k] + of[k])
+    # same as correcting first slope then offset:
+    assert_array_equal(
+        out_data,
+        data_corrector(data_corrector(in_data, sl, kind="slope"), of, kind="offset"),
+    )
+
+
+def test_slope_offset_corrector_dtype_and_nothing_to_correct():
+
+    in_data = np.random.randint(-100, 100, [4, 5, 3]).astype(np.int16)
+    sl = np.random.normal(5, 10, 3)
+
+    out_data = data_slope_offset_corrector(in_data, slope=sl, dtype=np.float32)
+    assert_equal(out_data.dtype, np.float32)
+    assert_almost_equal(out_data, in_data * sl, decimal=4)
+
+    # input data are not modified
+    out_data = data_slope_offset_corrector(in_data, offset=3)
+    assert_array_equal(out_data, in_data + 3)
+    assert_equal(in_data.dtype, np.int16)
+
+    assert data_slope_offset_corrector(in_data) is in_data
+    assert data_slope_offset_corrector(in_data, slope=[np.inf] * 3) is in_data
+
+
+def test_get_uniform_scaling():
+
+    assert_equal(get_uniform_scaling(np.array(2.5)), (2.5, 0.0))
+    assert_equal(get_uniform_scaling(offset=np.array(-3.0)), (1.0, -3.0))
+    assert_equal(
+        get_uniform_scaling(np.full([1, 1, 4], 2.5), np.zeros([1, 1, 4])), (2.5, 0.0)
+    )
+    assert get_uniform_scaling(np.array([[[1.0, 2.0]]])) is None
+    assert get_uniform_scaling(np.array(2.0), np.array([[[0.0, 1.0]]])) is None
+    # null scl_slope is no scaling for the nifti readers
+    assert get_uniform_scaling(np.array(0.0)) is None
+
+
+def test_get_lossless_dtype():
+
+    # integer factors: smallest integer datatype holding the corrected range
+    assert_equal(get_lossless_dtype(np.int16, np.array([1.0, 2.0])), np.int32)
+    assert_equal(get_lossless_dtype(np.uint8, np.array([1.0, 2.0])), np.int16)
+    assert_equal(get_lossless_dtype(np.uint8, offset=np.array([-1.0])), np.int16)
+    assert_equal(get_lossless_dtype(np.int16, offset=np.array([0.0, 1.0])), np.int32)
+    assert_equal(get_lossless_dtype(np.dtype("<i2"), np.array([1.0, 1.0])), np.int16)
+    # fractional factors or float data: default datatype
+    assert_equal(get_lossless_dtype(np.int16, np.array([0.5, 2.0])), np.float64)
+    assert_equal(
+        get_lossless_dtype(np.int16, np.array([0.5, 2.0]), default_dtype=np.float32),
+        np.float32,
+    )
+    assert_equal(get_lossless_dtype(np.float32, np.array([1.0, 2.0])), np.float64)
+
+
 # -- TEST nifti affine matrix utils --
 
 
@@ -318,6 +511,234 @@ def test_set_new_data_nan_no_nan():
     assert np.nan not in im_data_2.get_data()
 
 
+def test_corrected_array_proxy():
+
+    raw_data = np.random.randint(-100, 100, [4, 5, 6]).astype(np.int16)
+    sl = np.random.normal(5, 10, 6)
+    of = np.random.normal(5, 10, 6)
+
+    proxy = CorrectedArrayProxy(
+        raw_data,
+        slope=get_broadcastable_factors(sl, raw_data.shape),
+        offset=get_broadcastable_factors(of, raw_data.shape, kind="offset"),
+        dtype=np.float32,
+    )
+    expected_data = data_slope_offset_corrector(raw_data, sl, of, dtype=np.float32)
+
+    assert_equal(proxy.shape, (4, 5, 6))
+    assert_equal(proxy.dtype, np.float32)
+    assert_array_equal(np.asarray(proxy), expected_data)
+    assert_array_equal(proxy[..., 2:4], expected_data[..., 2:4])
+
+    # re-shaping is applied to data and factors alike
+    reshaped_proxy = proxy.reshape([4, 5, 2, 3], order="F").transpose(0, 1, 3, 2)
+    assert_array_equal(
+        np.asarray(reshaped_proxy),
+        expected_data.reshape([4, 5, 2, 3], order="F").transpose(0, 1, 3, 2),
+    )
+
+    im = nib.Nifti1Image(proxy, np.eye(4))
+    assert_array_equal(im.get_fdata(), expected_data)
+
+
+def test_extract_volumes():
+
+    raw_data = np.random.randint(-100, 100, [4, 5, 3, 6]).astype(np.int16)
+    sl = np.random.normal(5, 10, 6)
+    proxy = CorrectedArrayProxy(
+        raw_data, slope=get_broadcastable_factors(sl, raw_data.shape)
+    )
+    expected_data = data_slope_offset_corrector(raw_data, sl)
+    im = nib.Nifti1Image(proxy, np.eye(4))
+
+    b0_im = extract_volumes(im, 0)
+    assert_equal(b0_im.shape, (4, 5, 3))
+    assert_equal(b0_im.get_data_dtype(), np.float64)
+    assert_array_equal(b0_im.get_fdata(), expected_data[..., 0])
+
+    assert_almost_equal(
+        extract_volumes(im, [0, 2, 5], mean=True).get_fdata(),
+        expected_data[..., [0, 2, 5]].mean(axis=-1),
+    )
+    assert_array_equal(
+        extract_volumes(im, [1, 3]).get_fdata(), expected_data[..., [1, 3]]
+    )
+
+    # the scaling of the header is applied
+    scaled_im = nib.Nifti1Image(raw_data, np.eye(4))
+    scaled_im.header.set_slope_inter(2, -1)
+    assert_array_equal(
+        extract_volumes(scaled_im, 4).get_fdata(), 2.0 * raw_data[..., 4] - 1
+    )
+
+
+def test_fortran_slabs():
+
+    data = np.random.normal(5, 10, [4, 5, 6, 3])
+    full_bytes = data.tobytes(order="F")
+
+    for max_elements in [1, 3, 4, 7, 20, 21, 100, 360, 1000]:
+        slabs = list(fortran_slabs(data.shape, max_elements))
+        assert b"".join(data[s].tobytes(order="F") for s in slabs) == full_bytes
+        for s in slabs:
+            assert data[s].size <= max(max_elements, data.shape[0])
+
+    assert_equal(list(fortran_slabs(data.shape, 360)), [(Ellipsis,)])
+
+
+def test_parallel_gzip_file(tmp_path):
+
+    pfo_output = str(tmp_path)
+    pfi_output = os.path.join(pfo_output, "parallel.gz")
+
+    data = np.random.normal(5, 10, [300, 200]).tobytes()
+    with ParallelGzipFile(pfi_output, threads=3, block_size=10000) as f:
+        assert_equal(f.seek(0), 0)
+        f.write(data[:12345])
+        f.write(data[12345:])
+        assert_equal(f.tell(), len(data))
+        assert_raises(IOError, f.seek, 0)
+        assert_raises(IOError, f.read)
+
+    with gzip.open(pfi_output, "rb") as f:
+        assert f.read() == data
+
+
+def test_save_nifti_compression(tmp_path):
+
+    pfo_output = str(tmp_path)
+
+    data = np.random.normal(5, 10, [20, 30, 10, 4])
+    im = nib.Nifti1Image(data, np.diag([0.1, 0.2, 0.3, 1]))
+
+    for fin, kwargs in [
+        ("default.nii.gz", {}),
+        ("level_9.nii.gz", {"compression_level": 9}),
+        ("threads.nii.gz", {"compression_threads": 3}),
+        ("threads_chunks.nii.gz", {"compression_threads": 3, "chunk_size": 5000}),
+        ("uncompressed.nii", {"compression_level": 9}),
+        ("uncompressed_chunks.nii", {"chunk_size": 5000}),
+    ]:
+        pfi_output = os.path.join(pfo_output, fin)
+        save_nifti(im, pfi_output, **kwargs)
+        im_saved = nib.load(pfi_output)
+        assert_almost_equal(im_saved.affine, im.affine)
+        assert_array_equal(im_saved.get_fdata(), data)
+
+    with open(os.path.join(pfo_output, "uncompressed.nii"), "rb") as f:
+        assert f.read(2) != b"\x1f\x8b"
+    with open(os.path.join(pfo_output, "threads.nii.gz"), "rb") as f:
+        assert f.read(2) == b"\x1f\x8b"
+
+
+def test_save_nifti_raw_passthrough(tmp_path):
+
+    pfo_output = str(tmp_path)
+
+    # a 2dseq-like file with a header of 16 bytes: 3 sub-volumes of 10 slices.
+    pfi_raw = os.path.join(pfo_output, "raw_2dseq")
+    data = np.random.randint(-2000, 2000, [20, 30, 30]).astype("<i2")
+    with open(pfi_raw, "wb") as f:
+        f.write(b"x" * 16)
+        f.write(data.tobytes(order="F"))
+    raw = np.memmap(pfi_raw, dtype="<i2", mode="r", offset=16)
+    vol_data = raw.reshape(data.shape, order="F")
+
+    sub_vol = vol_data[..., 10:20]
+    assert_equal(memmap_file_region(sub_vol), (pfi_raw, 16 + 20 * 30 * 10 * 2))
+    # re-ordered data are not stored as in the nifti.
+    assert memmap_file_region(vol_data.transpose(1, 0, 2)) is None
+    assert memmap_file_region(np.array(sub_vol)) is None
+
+    for fin, kwargs in [
+        ("passthrough.nii", {}),
+        ("passthrough.nii.gz", {}),
+        ("passthrough_threads.nii.gz", {"compression_threads": 3}),
+        ("passthrough_chunks.nii", {"chunk_size": 5000}),
+    ]:
+        pfi_output = os.path.join(pfo_output, fin)
+        save_nifti(nib.Nifti1Image(sub_vol, np.eye(4)), pfi_output, **kwargs)
+        im_saved = nib.load(pfi_output)
+        assert_equal(im_saved.get_data_dtype(), np.int16)
+        assert_array_equal(im_saved.get_fdata(), data[..., 10:20])
+
+    # same bytes as written by nibabel from the data in memory.
+    nib.save(
+        nib.Nifti1Image(np.array(sub_vol), np.eye(4)),
+        os.path.join(pfo_output, "nibabel.nii"),
+    )
+    with open(os.path.join(pfo_output, "nibabel.nii"), "rb") as f:
+        nibabel_bytes = f.read()
+    with open(os.path.join(pfo_output, "passthrough.nii"), "rb") as f:
+        assert f.read() == nibabel_bytes
+    with gzip.open(os.path.join(pfo_output, "passthrough_threads.nii.gz"), "rb") as f:
+        assert f.read() == nibabel_bytes
+
+    # block copy to a non regular file, and truncated input.
+    with gzip.open(os.path.join(pfo_output, "copy.gz"), "wb") as f:
+        copy_file_region(pfi_raw, f, 16, data.nbytes, block_size=1000)
+    with gzip.open(os.path.join(pfo_output, "copy.gz"), "rb") as f:
+        assert f.read() == data.tobytes(order="F")
+    with open(os.path.join(pfo_output, "copy"), "wb") as f:
+        assert_raises(IOError, copy_file_region, pfi_raw, f, 16, data.nbytes + 1)
+
+
+def test_stage_timer():
+
+    timer = StageTimer()
+    for _ in range(3):
+        with timer.stage("write_nifti") as record:
+            record["bytes_written"] += 1024 ** 2
+    with timer.stage("affine"):
+        pass
+    # a stage raising an error is recorded as well
+    with assert_raises(IOError):
+        with timer.stage("parse_parameters"):
+            raise IOError
+
+    report = timer.report()
+
+    assert_equal(list(report.keys()), ["write_nifti", "affine", "parse_parameters"])
+    assert_equal(report["write_nifti"]["calls"], 3)
+    assert_equal(report["write_nifti"]["bytes_read"], 0)
+    assert_equal(report["write_nifti"]["bytes_written"], 3 * 1024 ** 2)
+    assert report["write_nifti"]["mb_per_second"] > 0
+    assert report["affine"]["seconds"] >= 0
+    assert report["affine"]["mb_per_second"] is None
+    assert_equal(report["parse_parameters"]["calls"], 1)
+
+
+def test_write_dispatcher():
+
+    for threads in [1, 3]:
+        written = []
+        with WriteDispatcher(threads) as dispatcher:
+            for i in range(10):
+                dispatcher.submit(written.append, i)
+        # all the writes are done when leaving the with.
+        assert_equal(sorted(written), list(range(10)))
+
+    def failing_write(i):
+        if i == 3:
+            raise IOError("write {} failed".format(i))
+
+    for threads in [1, 3]:
+        with assert_raises(IOError):
+            with WriteDispatcher(threads) as dispatcher:
+                for i in range(5):
+                    dispatcher.submit(failing_write, i)
+
+    # the error is raised by the first submit after the failed write is finished.
+    written = []
+    dispatcher = WriteDispatcher(3)
+    dispatcher.submit(failing_write, 3)
+    dispatcher._pending[0].wait()
+    with assert_raises(IOError):
+        dispatcher.submit(written.append, 0)
+    dispatcher.close()
+    assert_equal(written, [])
+
+
 def test_path_contains_whitespace():
 
     assert path_contains_whitespace(os.path.join("path", "with spaces", "to"), "study")
@@ -0,0 +1,115 @@
+import os
+import shutil
+import sys
+
+from numpy.testing import assert_equal
+
+import bruker2nifti.watcher as watcher_module
+from bruker2nifti.watcher import StudyWatcher
+
+if sys.version_info >= (3, 3):
+    import unittest.mock as mock
+else:
+    import mock as mock
+
+here = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.dirname(here)
+
+
+def test_study_watcher(tmp_path):
+
+    pfo_root_in = str(tmp_path / "watch_in")
+    pfo_root_out = str(tmp_path / "watch_out")
+    os.mkdir(pfo_root_out)
+
+    # a study arriving: scan 3 still misses its 2dseq
+    pfo_study_in = os.path.join(pfo_root_in, "banana")
+    shutil.copytree(os.path.join(root_dir, "test_data", "bru_banana"), pfo_study_in)
+    pfi_2dseq_3 = os.path.join(pfo_study_in, "3", "pdata", "1", "2dseq")
+    shutil.move(pfi_2dseq_3, pfi_2dseq_3 + ".part")
+
+    watcher = StudyWatcher(
+        pfo_root_in, pfo_root_out, settings={"verbose": 0}, stable_time=0
+    )
+    # scans must be unchanged between two polls
+    assert_equal(watcher.poll(), [])
+    finished = watcher.poll()
+    assert_equal([scan for _, scan, _ in finished], ["1", "2"])
+    assert all(result["status"] == "converted" for _, _, result in finished)
+    assert_equal(watcher.poll(), [])
+
+    shutil.move(pfi_2dseq_3 + ".part", pfi_2dseq_3)
+    assert_equal(watcher.poll(), [])
+    finished = watcher.poll()
+    assert_equal([scan for _, scan, _ in finished], ["3"])
+    assert os.path.exists(
+        os.path.join(
+            pfo_root_out,
+            "APMFruits20111130",
+            "APMFruits20111130_3",
+            "APMFruits20111130_3.nii.gz",
+        )
+    )
+    watcher.close()
+
+    # a watcher restarted on the same output does not convert the scans again
+    watcher = StudyWatcher(
+        pfo_root_in,
+        pfo_root_out,
+        settings={"verbose": 0},
+        workers=2,
+        poll_interval=0.1,
+        stable_time=0,
+    )
+    assert_equal(watcher.study_names, {pfo_study_in: "APMFruits20111130"})
+    watcher.run(max_polls=2)
+    assert_equal(watcher._pending, {})
+    assert_equal(
+        sorted(watcher._done), [os.path.join(pfo_study_in, s) for s in ["1", "2", "3"]]
+    )
+    assert_equal(
+        sorted(os.listdir(os.path.join(pfo_root_out, "APMFruits20111130"))),
+        [
+            "APMFruits20111130_1",
+            "APMFruits20111130_2",
+            "APMFruits20111130_3",
+            "bruker2nifti_manifest.json",
+        ],
+    )
+
+
+class RecordingINotify(object):
+    def __init__(self):
+        self.watched = []
+
+    def add_watch(self, pfo, mask):
+        self.watched.append(pfo)
+
+    def close(self):
+        pass
+
+
+def test_study_watcher_watches_recon_folders(tmp_path):
+
+    pfo_root_in = str(tmp_path / "watch_in")
+    pfo_root_out = str(tmp_path / "watch_out")
+    os.mkdir(pfo_root_out)
+
+    # scan 3 is being acquired: its 2dseq is not there yet
+    pfo_study_in = os.path.join(pfo_root_in, "banana")
+    shutil.copytree(os.path.join(root_dir, "test_data", "bru_banana"), pfo_study_in)
+    os.remove(os.path.join(pfo_study_in, "3", "pdata", "1", "2dseq"))
+
+    watcher = StudyWatcher(
+        pfo_root_in, pfo_root_out, settings={"verbose": 0}, stable_time=0
+    )
+    watcher._inotify = RecordingINotify()
+    with mock.patch.object(watcher_module, "flags", mock.MagicMock(), create=True):
+        watcher.poll()
+
+    # inotify is not recursive: the folder where the 2dseq will be written is watched.
+    pfo_pdata = os.path.join(pfo_study_in, "3", "pdata")
+    assert os.path.join(pfo_pdata, "1") in watcher._inotify.watched
+    assert pfo_pdata in watcher._inotify.watched
+    watcher._inotify = None
+    watcher.close()